@@ -0,0 +1,218 @@
+import argparse
+import copy
+import gzip
+import json
+import os
+import secrets
+import sys
+from datetime import date, timedelta
+from functools import lru_cache
+import instrumentation
+from journal import write_json_atomic, fsync_dir
+from money import to_minor
+
+MANIFEST_VERSION = 1
+# Сколько разобранных сегментов держать в памяти (файлы сегментов не изменяются)
+SEGMENT_CACHE_SIZE = 64
+
+
+def archive_dir(transactions_file):
+    """Каталог архива рядом со снимком: transactions.json.archive"""
+    return transactions_file + ".archive"
+
+
+def _card_dir(number):
+    return number if number.isalnum() else number.encode().hex()
+
+
+@lru_cache(maxsize=SEGMENT_CACHE_SIZE)
+def _load_segment(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        segment = json.load(f)
+    return list(zip(segment['positions'], segment['transactions']))
+
+
+class Archive:
+    """Архив старых транзакций: сжатые сегменты по карте и месяцу.
+    В архив переносится начало истории карты (в порядке добавления), поэтому
+    позиция транзакции = число архивных + позиция в живом списке, и позиции
+    в журнале не зависят от того, успел ли архив попасть на диск.
+    Состояние по картам: count - сколько транзакций в архиве, balance - их сумма
+    в копейках (входящий остаток), before - дата, раньше которой переносились
+    транзакции, segments - [месяц, файл, число транзакций].
+    manifest.json записывается в два этапа вокруг записи снимка (prepare/commit)
+    и содержит отпечаток снимка, к которому относится. Подготовленное состояние
+    действует, только если снимок с этим отпечатком уже заменен"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        self.cards = {}
+        # Состояние, относящееся к снимку на диске (прочитанное или записанное commit)
+        self._committed = {}
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if manifest.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Неизвестная версия архива: {self.manifest_path}")
+        return manifest
+
+    def load(self, fingerprint):
+        """Чтение состояния для снимка с отпечатком fingerprint (lazy_history.fingerprint)"""
+        manifest = self._read_manifest()
+        if manifest is None:
+            self._committed = {}
+        else:
+            current = manifest['current']
+            replaced = tuple(current['fingerprint'] or ()) != tuple(fingerprint or ())
+            # Снимок уже заменен, а commit не успел - действует подготовленное состояние
+            if manifest.get('next') is not None and replaced:
+                self._committed = manifest['next']
+            else:
+                self._committed = current['cards']
+        self.cards = copy.deepcopy(self._committed)
+
+    def base(self, number):
+        """Сколько транзакций карты в архиве (начальная позиция живого списка)"""
+        entry = self.cards.get(number)
+        return entry['count'] if entry else 0
+
+    def opening(self, number):
+        """Входящий остаток карты: сумма архивных транзакций в копейках"""
+        entry = self.cards.get(number)
+        return entry['balance'] if entry else 0
+
+    def covers(self, card_numbers, date_from):
+        """Могут ли архивные транзакции карт попасть в выборку с датой начала date_from
+        (None - без нижней границы)"""
+        numbers = self.cards if card_numbers is None else card_numbers
+        return any(number in self.cards and (not date_from or date_from < self.cards[number]['before'])
+                   for number in numbers)
+
+    def read(self, number, date_from=None, date_to=None):
+        """Архивные транзакции карты за диапазон дат: список (позиция, транзакция)"""
+        entry = self.cards.get(number)
+        if entry is None:
+            return []
+        result = []
+        for month, name, _ in entry['segments']:
+            if (date_from and month < date_from[:7]) or (date_to and month > date_to[:7]):
+                continue
+            try:
+                items = _load_segment(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Карту удалил другой процесс, и сегменты уже убраны
+                continue
+            result.extend((pos, trans) for pos, trans in items
+                          if (not date_from or trans['date'] >= date_from)
+                          and (not date_to or trans['date'] <= date_to))
+        return result
+
+    def store(self, number, items, before):
+        """Перенос начала истории карты (items) в новые сегменты по месяцам.
+        Файлы пишутся сразу; в manifest.json они попадут со следующим снимком"""
+        start = self.base(number)
+        months = {}
+        minor = 0
+        for offset, trans in enumerate(items):
+            positions, transactions = months.setdefault(trans['date'][:7], ([], []))
+            positions.append(start + offset)
+            transactions.append(trans)
+            minor += to_minor(trans['amount'])
+        card_dir = os.path.join(self.directory, _card_dir(number))
+        os.makedirs(card_dir, exist_ok=True)
+        segments = []
+        for month, (positions, transactions) in sorted(months.items()):
+            name = f"{_card_dir(number)}/{month}.{positions[0]}.{secrets.token_hex(4)}.json.gz"
+            with open(os.path.join(self.directory, name), 'wb') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as f:
+                    f.write(json.dumps({'card': number, 'month': month, 'positions': positions,
+                                        'transactions': transactions}).encode('utf-8'))
+                raw.flush()
+                os.fsync(raw.fileno())
+                instrumentation.count('bytes_written', raw.tell())
+            segments.append([month, name, len(positions)])
+        if segments:
+            fsync_dir(os.path.join(self.directory, segments[-1][1]))
+        entry = self.cards.setdefault(number, {'count': 0, 'balance': 0, 'before': before, 'segments': []})
+        entry['count'] += len(items)
+        entry['balance'] += minor
+        entry['before'] = max(entry['before'], before)
+        entry['segments'].extend(segments)
+
+    def drop(self, number):
+        """Удаление архива карты (файлы удаляются после записи снимка)"""
+        return self.cards.pop(number, None)
+
+    def restore(self, number, entry):
+        if entry is None:
+            self.cards.pop(number, None)
+        else:
+            self.cards[number] = entry
+
+    def snapshot(self):
+        """Копия состояния для записи вместе со снимком; None, если архива нет"""
+        if not self.cards and not os.path.exists(self.manifest_path):
+            return None
+        return {number: dict(entry, segments=list(entry['segments'])) for number, entry in self.cards.items()}
+
+    def prepare(self, cards, replaced):
+        """Первый этап: состояние для снимка, который сейчас будет записан.
+        replaced - отпечаток заменяемого снимка (None, если его нет): пока он на диске,
+        действует прежнее состояние"""
+        os.makedirs(self.directory, exist_ok=True)
+        write_json_atomic(self.manifest_path, {
+            'version': MANIFEST_VERSION,
+            'current': {'fingerprint': replaced, 'cards': self._committed},
+            'next': cards})
+
+    def commit(self, cards, fingerprint):
+        """Второй этап (снимок записан): состояние привязывается к его отпечатку,
+        сегменты, на которые оно не ссылается, удаляются"""
+        write_json_atomic(self.manifest_path, {'version': MANIFEST_VERSION,
+                                               'current': {'fingerprint': fingerprint, 'cards': cards}})
+        self._committed = cards
+        used = {name for entry in cards.values() for _, name, _ in entry['segments']}
+        for card_dir in os.listdir(self.directory):
+            path = os.path.join(self.directory, card_dir)
+            if not os.path.isdir(path):
+                continue
+            for file_name in os.listdir(path):
+                if f"{card_dir}/{file_name}" not in used:
+                    os.remove(os.path.join(path, file_name))
+            if not os.listdir(path):
+                os.rmdir(path)
+
+    def stats(self):
+        """Число карт, транзакций и сегментов в архиве (для вкладки диагностики)"""
+        # Копия списка: архив может меняться в потоке записи
+        entries = list(self.cards.values())
+        return {'cards': len(entries),
+                'transactions': sum(entry['count'] for entry in entries),
+                'segments': sum(len(entry['segments']) for entry in entries)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Перенос старых транзакций Card Manager в сжатый архив")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--before', help="переносить транзакции раньше даты (YYYY-MM-DD)")
+    group.add_argument('--days', type=int, help="переносить транзакции старше стольких дней")
+    args = parser.parse_args(argv)
+    before = args.before or (date.today() - timedelta(days=args.days)).isoformat()
+
+    from data_manager import DataManager
+    data_manager = DataManager()
+    try:
+        moved = data_manager.archive_transactions(before)
+    finally:
+        data_manager.close()
+    print(f"Перенесено в архив: {moved}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
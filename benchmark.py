@@ -0,0 +1,181 @@
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from data_manager import DataManager
+from storage import JsonStorage
+from sqlite_storage import SqliteStorage
+from synthetic import populate
+import instrumentation
+
+# Рост p50/p95 или пиковой памяти больше порога считается регрессией
+DEFAULT_THRESHOLD = 0.20
+# Изменения памяти меньше этого значения (КБ) считаются шумом
+PEAK_NOISE_KB = 64
+# Сколько карт выпускать за один прогон сценария issue_cards
+ISSUE_BATCH = 1000
+
+
+def make_storage(backend, directory):
+    if backend == 'sqlite':
+        return SqliteStorage(os.path.join(directory, 'card_manager.db'))
+    return JsonStorage(os.path.join(directory, 'cards.json'),
+                       os.path.join(directory, 'transactions.json'),
+                       os.path.join(directory, 'journal.log'))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies, peak):
+    return {
+        'runs': len(latencies),
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'peak_kb': peak / 1024,
+    }
+
+
+def measure(operation, runs):
+    """Задержки отдельных запусков и пиковая память (отдельным запуском под tracemalloc)"""
+    latencies = []
+    for _ in range(runs):
+        gc.collect()
+        started = time.perf_counter()
+        operation()
+        latencies.append(time.perf_counter() - started)
+    gc.collect()
+    tracemalloc.start()
+    operation()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(latencies, peak)
+
+
+def run(backend='json', n_cards=100, m_transactions=1000, repeat=20, seed=0):
+    """Прогон сценариев DataManager на синтетических данных"""
+    rng = random.Random(seed)
+    categories = ['Покупки', 'Транспорт', 'Развлечения', 'Другое', None]
+    directory = tempfile.mkdtemp(prefix='card_manager_bench_')
+    results = {}
+    try:
+        data_manager = DataManager(make_storage(backend, directory))
+        cards, _ = populate(data_manager, n_cards, m_transactions, seed)
+        data_manager.close()
+        numbers = list(cards)
+
+        def load():
+            DataManager(make_storage(backend, directory)).close()
+
+        results['load_data'] = measure(load, max(3, repeat // 4))
+
+        data_manager = DataManager(make_storage(backend, directory))
+        results['save_data'] = measure(data_manager.save_data, max(3, repeat // 4))
+
+        def add_transaction():
+            data_manager.add_transaction(rng.choice(numbers), {
+                'date': '2025-01-01', 'amount': -100.0,
+                'category': 'Покупки', 'description': 'Бенчмарк'
+            })
+
+        results['add_transaction'] = measure(add_transaction, repeat * 10)
+
+        def balances():
+            for number in numbers:
+                data_manager.get_card_balance(number)
+
+        results['get_card_balance_all'] = measure(balances, repeat)
+
+        def filtered():
+            year = rng.choice(['2023', '2024'])
+            data_manager.get_transactions(rng.choice(numbers), {
+                'date_from': f"{year}-03-01", 'date_to': f"{year}-06-30",
+                'category': rng.choice(categories)
+            })
+
+        results['get_transactions_filtered'] = measure(filtered, repeat * 10)
+
+        def issue_cards():
+            data_manager.issue_cards(ISSUE_BATCH, 'Бенчмарк Выпуск')
+
+        results['issue_cards_1000'] = measure(issue_cards, max(3, repeat // 4))
+        data_manager.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'params': {'backend': backend, 'cards': n_cards, 'transactions_per_card': m_transactions,
+                   'repeat': repeat, 'seed': seed},
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold=DEFAULT_THRESHOLD):
+    """Список регрессий относительно базового прогона"""
+    regressions = []
+    for name, stats in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'peak_kb'):
+            if metric == 'peak_kb' and stats[metric] - base[metric] < PEAK_NOISE_KB:
+                continue
+            if base[metric] > 0 and stats[metric] > base[metric] * (1 + threshold):
+                regressions.append(f"{name}.{metric}: {base[metric]:.3f} -> {stats[metric]:.3f}")
+    return regressions
+
+
+def print_results(report):
+    params = report['params']
+    print(f"Хранилище: {params['backend']}, карт: {params['cards']}, "
+          f"транзакций на карту: {params['transactions_per_card']}")
+    print(f"{'сценарий':<28}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'пик, КБ':>12}")
+    for name, stats in report['results'].items():
+        print(f"{name:<28}{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}"
+              f"{stats['p99_ms']:>10.3f}{stats['peak_kb']:>12.0f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк горячих путей DataManager")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--cards', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=1000, help="транзакций на карту")
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="файл с базовыми результатами для сравнения")
+    parser.add_argument('--save-baseline', help="сохранить результаты как базовые")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    # tracemalloc здесь занят замером пиковой памяти, поэтому только cProfile
+    parser.add_argument('--profile', choices=['cprofile'], help="профилирование прогона")
+    parser.add_argument('--perf-log', help="журнал операций в формате JSON lines")
+    args = parser.parse_args(argv)
+    instrumentation.configure(args.perf_log, args.profile)
+
+    report = run(args.backend, args.cards, args.transactions, args.repeat, args.seed)
+    print_results(report)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print("Внимание: параметры прогона отличаются от базовых", file=sys.stderr)
+        regressions = compare(report, baseline, args.threshold)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,116 @@
+import os
+import secrets
+import threading
+
+# Префикс выпускаемых номеров (BIN), длина номера и CVC
+DEFAULT_BIN = os.environ.get('CARD_MANAGER_BIN', '4276')
+NUMBER_LENGTH = 16
+CVC_LENGTH = 3
+
+# Удвоенная цифра по алгоритму Луна (с вычитанием 9)
+_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+# Вклад пары цифр, у которой удваивается младшая
+_PAIRS = tuple(pair // 10 + _DOUBLED[pair % 10] for pair in range(100))
+# Сколько случайных чисел брать у secrets за один вызов
+RANDOM_BATCH = 4096
+
+
+def _luhn_sum(digits, double_last):
+    """Сумма Луна для цифр; double_last - удваивается ли последняя цифра"""
+    total = 0
+    double = double_last
+    for ch in reversed(digits):
+        digit = ord(ch) - 48
+        total += _DOUBLED[digit] if double else digit
+        double = not double
+    return total
+
+
+def _body_sum(value):
+    """Сумма Луна для цифр числа value перед контрольной цифрой (без строк)"""
+    total = 0
+    while value:
+        value, pair = divmod(value, 100)
+        total += _PAIRS[pair]
+    return total
+
+
+def luhn_check_digit(payload):
+    """Контрольная цифра Луна для номера без нее"""
+    return str(-_luhn_sum(payload, True) % 10)
+
+
+def luhn_valid(number):
+    """Проверка номера карты по алгоритму Луна"""
+    return len(number) > 1 and number.isdigit() and _luhn_sum(number, False) % 10 == 0
+
+
+def generate_cvc():
+    """CVC из криптографически стойкого генератора (secrets)"""
+    return f"{secrets.randbelow(10 ** CVC_LENGTH):0{CVC_LENGTH}d}"
+
+
+class CardNumberAllocator:
+    """Выдача уникальных номеров карт с префиксом bin_prefix и контрольной цифрой Луна.
+    Случайная часть берется из secrets; выданные и существующие номера хранятся
+    в множестве, поэтому проверка на повтор - O(1). Потокобезопасен"""
+
+    def __init__(self, issued=(), bin_prefix=DEFAULT_BIN, length=NUMBER_LENGTH):
+        if not bin_prefix.isdigit() or len(bin_prefix) >= length - 1:
+            raise ValueError(f"Некорректный префикс номера карты: {bin_prefix!r}")
+        self.bin_prefix = bin_prefix
+        self.length = length
+        self.digits = length - len(bin_prefix) - 1
+        # Сколько всего номеров с этим префиксом
+        self.capacity = 10 ** self.digits
+        # Сумма Луна префикса: позиции его цифр от конца номера не меняются
+        self._bin_sum = _luhn_sum(bin_prefix, self.digits % 2 == 0)
+        self._lock = threading.Lock()
+        self.issued = set()
+        self._used = 0      # занято номеров с этим префиксом
+        for number in issued:
+            self.add(number)
+
+    def __contains__(self, number):
+        return number in self.issued
+
+    def __len__(self):
+        return len(self.issued)
+
+    def _own(self, number):
+        return len(number) == self.length and number.startswith(self.bin_prefix)
+
+    def add(self, number):
+        """Учет номера, выданного в другом месте (существующая карта)"""
+        with self._lock:
+            if number not in self.issued:
+                self.issued.add(number)
+                self._used += self._own(number)
+
+    def _random_values(self, count):
+        """count случайных чисел в [0, capacity): пачкой байтов из secrets,
+        без смещения (значения выше кратного capacity отбрасываются)"""
+        size = (self.capacity.bit_length() + 7) // 8
+        limit = (256 ** size // self.capacity) * self.capacity
+        data = secrets.token_bytes(size * count)
+        for offset in range(0, len(data), size):
+            value = int.from_bytes(data[offset:offset + size], 'little')
+            if value < limit:
+                yield value % self.capacity
+
+    def allocate(self, n=1):
+        """Список из n новых номеров; номера сразу считаются выданными"""
+        with self._lock:
+            if self._used + n > self.capacity:
+                raise ValueError(f"Не осталось свободных номеров с префиксом {self.bin_prefix}")
+            numbers = []
+            prefix, width, bin_sum = self.bin_prefix, self.digits, self._bin_sum
+            issued = self.issued
+            while len(numbers) < n:
+                for value in self._random_values(min(n - len(numbers), RANDOM_BATCH)):
+                    number = f"{prefix}{value:0{width}d}{-(bin_sum + _body_sum(value)) % 10}"
+                    if number not in issued:
+                        issued.add(number)
+                        numbers.append(number)
+            self._used += n
+            return numbers
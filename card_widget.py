@@ -2,11 +2,17 @@ from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QFormLayout,
                             QLineEdit, QPushButton, QMessageBox, 
                             QHBoxLayout, QGroupBox, QInputDialog, QDialog, QDialogButtonBox)
 from PyQt5.QtCore import Qt, QDate
-import random
+from events import CARD_DELETED, DATA_RELOADED
+from view_cache import format_number
+import time
+import instrumentation
 
 class CardDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, data_manager=None, data_service=None):
         super().__init__(parent)
+        # Номер и CVC выдает DataManager (card_numbers) в рабочем потоке
+        self.data_manager = data_manager
+        self.data_service = data_service
         self.setWindowTitle("Добавление новой карты")
         self.setMinimumWidth(400)
         
@@ -46,15 +52,13 @@ class CardDialog(QDialog):
         self.generate_card_details()
 
     def generate_card_details(self):
-        """Генерация номера карты и CVC"""
-        # Генерация номера карты (16 цифр, начинается с 4)
-        card_number = "4" + "".join([str(random.randint(0, 9)) for _ in range(15)])
+        """Запрос нового номера карты (уникального, с проверкой Луна) и CVC"""
+        self.data_service.call(self.data_manager.new_card_details, callback=self.set_card_details)
+
+    def set_card_details(self, details):
+        card_number, cvc = details
         # Форматирование номера карты для читаемости (4444 4444 4444 4444)
-        formatted_number = " ".join([card_number[i:i+4] for i in range(0, 16, 4)])
-        self.number_edit.setText(formatted_number)
-        
-        # Генерация CVC (3 цифры)
-        cvc = "".join([str(random.randint(0, 9)) for _ in range(3)])
+        self.number_edit.setText(format_number(card_number))
         self.cvc_edit.setText(cvc)
 
     def validate_and_accept(self):
@@ -62,6 +66,9 @@ class CardDialog(QDialog):
         if not self.first_name_edit.text() or not self.last_name_edit.text():
             QMessageBox.warning(self, "Ошибка", "Пожалуйста, заполните имя и фамилию")
             return
+        if not self.number_edit.text():
+            QMessageBox.warning(self, "Ошибка", "Номер карты еще не получен")
+            return
         self.accept()
 
     def get_card_data(self):
@@ -77,7 +84,11 @@ class CardWidget(QWidget):
         super().__init__()
         self.data_manager = data_manager
         self.main_window = main_window
+        self.data_service = main_window.data_service
+        self.view_cache = main_window.view_cache
         self.current_card = None
+        # Начало показа карты: время до заполнения формы пишется в instrumentation
+        self.display_started = None
         
         layout = QVBoxLayout(self)
         
@@ -88,9 +99,11 @@ class CardWidget(QWidget):
         self.number_edit = QLineEdit()
         self.name_edit = QLineEdit()
         self.balance_edit = QLineEdit()
+        self.count_edit = QLineEdit()
         self.cvc_edit = QLineEdit()  # Д��бавляем поле CVC
         
         self.balance_edit.setReadOnly(True)
+        self.count_edit.setReadOnly(True)
         self.number_edit.setReadOnly(True)  # Делаем поле номера только для чтения
         self.cvc_edit.setReadOnly(True)    # Делаем поле CVC только для чтения
         
@@ -98,6 +111,7 @@ class CardWidget(QWidget):
         form_layout.addRow("Имя владельца:", self.name_edit)
         form_layout.addRow("CVC:", self.cvc_edit)
         form_layout.addRow("Баланс:", self.balance_edit)
+        form_layout.addRow("Операций:", self.count_edit)
         form_group.setLayout(form_layout)
         
         # Кнопки операций
@@ -127,22 +141,52 @@ class CardWidget(QWidget):
     def display_card(self, card):
         """Отображение информации о карте"""
         self.current_card = card
-        # Форматируем номер карты для отображения
-        formatted_number = " ".join([card['number'][i:i+4] for i in range(0, 16, 4)])
-        self.number_edit.setText(formatted_number)
+        self.display_started = time.perf_counter()
         self.name_edit.setText(card['name'])
         # Проверяем наличие CVC кода
         self.cvc_edit.setText(card.get('cvc', '***'))  # Используем get() с значением по умолчанию
-        balance = self.data_manager.get_card_balance(card['number'])
-        self.balance_edit.setText(f"{balance} ₽")
+        # Номер, баланс и число операций - из кэша, через очередь данных
+        # (видят все предыдущие изменения)
+        self.data_service.call(self._collect_view, card['number'], callback=self.show_view)
+
+    def _collect_view(self, card_number):
+        """Выполняется в рабочем потоке"""
+        view = self.view_cache.get(card_number)
+        if view is not None:
+            self.view_cache.transaction_count(card_number)
+        return view
+
+    def show_view(self, view):
+        if view and self.current_card and self.current_card['number'] == view.card['number']:
+            self.number_edit.setText(view.formatted_number)
+            self.balance_edit.setText(f"{view.balance} ₽")
+            self.count_edit.setText(str(view.transaction_count))
+            if self.display_started is not None:
+                instrumentation.record('CardWidget.display_card', time.perf_counter() - self.display_started,
+                                       card=view.card['number'])
+                self.display_started = None
+
+    def on_data_changed(self, events):
+        """Обновление формы, если изменилась отображаемая карта"""
+        if not self.current_card:
+            return
+        card_number = self.current_card['number']
+        related = [event for event in events
+                   if event.card_number == card_number or event.kind == DATA_RELOADED]
+        if not related:
+            return
+        if any(event.kind == CARD_DELETED for event in related):
+            self.current_card = None
+            return
+        self.data_service.call(self.data_manager.get_card, card_number,
+                               callback=lambda card: card and self.display_card(card))
 
     def clear_form(self):
         """Открытие диалога добавления новой карты"""
-        dialog = CardDialog(self)
+        dialog = CardDialog(self, self.data_manager, self.data_service)
         if dialog.exec_() == QDialog.Accepted:
             card_data = dialog.get_card_data()
-            self.data_manager.add_card(card_data)
-            self.main_window.refresh_cards()
+            self.data_service.write(self.data_manager.add_card, card_data)
 
     def deposit_money(self):
         if not self.current_card:
@@ -150,45 +194,49 @@ class CardWidget(QWidget):
         amount, ok = QInputDialog.getDouble(self, "Пополнение", 
                                           "Введите сумму:", 0, 0, 1000000, 2)
         if ok:
-            self.data_manager.add_transaction(self.current_card['number'], {
+            self.data_service.write(self.data_manager.add_transaction, self.current_card['number'], {
                 'date': QDate.currentDate().toString(Qt.ISODate),
                 'amount': amount,
                 'category': 'Пополнение',
                 'description': 'Пополнение карты'
             })
-            self.display_card(self.current_card)
-            self.main_window.refresh_cards()
 
     def withdraw_money(self):
         if not self.current_card:
             return
-        balance = self.data_manager.get_card_balance(self.current_card['number'])
+        card_number = self.current_card['number']
+        self.data_service.call(self.data_manager.get_card_balance, card_number,
+                               callback=lambda balance: self.ask_withdraw(card_number, balance))
+
+    def ask_withdraw(self, card_number, balance):
         amount, ok = QInputDialog.getDouble(self, "Снятие", 
-                                          "Введите сумму:", 0, 0, balance, 2)
+                                          "Введите сумму:", 0, 0, float(balance), 2)
         if ok:
-            self.data_manager.add_transaction(self.current_card['number'], {
+            self.data_service.write(self.data_manager.add_transaction, card_number, {
                 'date': QDate.currentDate().toString(Qt.ISODate),
                 'amount': -amount,
                 'category': 'Снятие',
                 'description': 'Снятие с карты'
             })
-            self.display_card(self.current_card)
-            self.main_window.refresh_cards()
 
     def save_card(self):
         """Сохранение информации о карте"""
+        # Номер в поле появляется вместе с балансом, поэтому берем его из текущей карты
+        number = self.current_card['number'] if self.current_card else self.number_edit.text()
         card_data = {
-            'number': self.number_edit.text().replace(" ", ""),  # Убираем пробелы
+            'number': number.replace(" ", ""),  # Убираем пробелы
             'name': self.name_edit.text(),
             'cvc': self.cvc_edit.text()  # Добавляем CVC в данные карты
         }
         
         if self.current_card:
-            self.data_manager.update_card(card_data)
+            operation = self.data_manager.update_card
         else:
-            self.data_manager.add_card(card_data)
+            operation = self.data_manager.add_card
         
-        self.main_window.refresh_cards()
+        self.data_service.write(operation, card_data, callback=self.card_saved)
+
+    def card_saved(self, _):
         QMessageBox.information(self, "Успех", "Карта сохранена")
 
     def delete_card(self):
@@ -197,6 +245,5 @@ class CardWidget(QWidget):
                                        "Удалить карту?",
                                        QMessageBox.Yes | QMessageBox.No)
             if reply == QMessageBox.Yes:
-                self.data_manager.delete_card(self.current_card['number'])
-                self.clear_form()
-                self.main_window.refresh_cards() 
\ No newline at end of file
+                self.data_service.write(self.data_manager.delete_card, self.current_card['number'],
+                                        callback=lambda _: self.clear_form()) 
\ No newline at end of file
@@ -0,0 +1,144 @@
+from array import array
+from collections.abc import MutableMapping, Sequence
+from datetime import date
+from money import to_minor
+
+try:
+    import numpy
+except ImportError:  # numpy необязателен: без него суммы и маски считаются циклом
+    numpy = None
+
+
+class StringPool:
+    """Пул строк: каждая уникальная строка хранится один раз, в колонке - ее код"""
+
+    def __init__(self):
+        self.strings = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def __getitem__(self, code):
+        return self.strings[code]
+
+
+class CardColumns(Sequence):
+    """История одной карты в колонках: дата - номер дня, сумма - копейки (int64),
+    категория и описание - коды в пулах строк.
+    Как список словарей: len, индексы, срезы, обход и append"""
+
+    def __init__(self, categories, descriptions, transactions=()):
+        self.categories = categories
+        self.descriptions = descriptions
+        self.days = array('i')
+        self.amounts = array('q')
+        self.category_codes = array('I')
+        self.description_codes = array('I')
+        # Признак целой суммы в исходных данных: 50000, а не 50000.0
+        self.whole = array('b')
+        for trans in transactions:
+            self.append(trans)
+
+    def __len__(self):
+        return len(self.days)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        minor = self.amounts[i]
+        return {
+            'date': date.fromordinal(self.days[i]).isoformat(),
+            'amount': minor // 100 if self.whole[i] else minor / 100,
+            'category': self.categories[self.category_codes[i]],
+            'description': self.descriptions[self.description_codes[i]]
+        }
+
+    def append(self, trans):
+        self.days.append(date.fromisoformat(trans['date']).toordinal())
+        self.amounts.append(to_minor(trans['amount']))
+        self.category_codes.append(self.categories.code(trans['category']))
+        self.description_codes.append(self.descriptions.code(trans['description']))
+        self.whole.append(isinstance(trans['amount'], int))
+
+    def extend(self, transactions):
+        for trans in transactions:
+            self.append(trans)
+
+    def truncate(self, length):
+        """Удаление строк с позиции length (откат незафиксированных добавлений)"""
+        for column in (self.days, self.amounts, self.category_codes, self.description_codes, self.whole):
+            del column[length:]
+
+    def sum_minor(self, positions=None):
+        """Сумма в копейках по всем строкам или по списку позиций"""
+        if numpy is not None:
+            amounts = numpy.frombuffer(self.amounts, dtype=numpy.int64)
+            return int(amounts.sum() if positions is None else amounts[positions].sum())
+        if positions is None:
+            return sum(self.amounts)
+        return sum(self.amounts[i] for i in positions)
+
+    def select(self, date_from=None, date_to=None, category=None):
+        """Позиции строк по маске диапазона дат и категории, в порядке даты"""
+        day_from = date.fromisoformat(date_from).toordinal() if date_from else None
+        day_to = date.fromisoformat(date_to).toordinal() if date_to else None
+        code = self.categories.codes.get(category) if category else None
+        if category and code is None:
+            return []
+        if numpy is not None:
+            days = numpy.frombuffer(self.days, dtype=numpy.int32)
+            mask = numpy.ones(len(days), dtype=bool)
+            if day_from is not None:
+                mask &= days >= day_from
+            if day_to is not None:
+                mask &= days <= day_to
+            if code is not None:
+                mask &= numpy.frombuffer(self.category_codes, dtype=numpy.uint32) == code
+            positions = numpy.flatnonzero(mask)
+            order = numpy.argsort(days[positions], kind='stable')
+            return positions[order].tolist()
+        positions = [i for i, day in enumerate(self.days)
+                     if (day_from is None or day >= day_from) and (day_to is None or day <= day_to)
+                     and (code is None or self.category_codes[i] == code)]
+        positions.sort(key=self.days.__getitem__)
+        return positions
+
+
+class CompactTransactions(MutableMapping):
+    """Компактная замена словаря {номер карты: [транзакции]} с общими пулами строк.
+    Значения - CardColumns, которые выдают транзакции словарями по требованию"""
+
+    def __init__(self, transactions=None):
+        self.categories = StringPool()
+        self.descriptions = StringPool()
+        self.cards = {}
+        if transactions:
+            for card_number, items in transactions.items():
+                self[card_number] = items
+
+    def __getitem__(self, card_number):
+        return self.cards[card_number]
+
+    def __setitem__(self, card_number, items):
+        if not isinstance(items, CardColumns):
+            items = CardColumns(self.categories, self.descriptions, items)
+        self.cards[card_number] = items
+
+    def __delitem__(self, card_number):
+        del self.cards[card_number]
+
+    def __iter__(self):
+        return iter(self.cards)
+
+    def __len__(self):
+        return len(self.cards)
+
+    def setdefault(self, card_number, default=()):
+        if card_number not in self.cards:
+            self[card_number] = default
+        return self.cards[card_number]
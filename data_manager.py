@@ -1,114 +1,283 @@
-import json
-import os
+from contextlib import contextmanager
 from datetime import datetime
+from storage import open_storage
+from importer import import_file
+import export
+from rollups import Rollups
+from card_numbers import CardNumberAllocator, generate_cvc
+from instrumentation import timed
+from money import round_amount
+from events import (EventBus, CARD_ADDED, CARD_UPDATED, CARD_DELETED,
+                    TRANSACTION_ADDED, DATA_RELOADED)
+
+
+def _rounded(transaction):
+    """Копия транзакции с суммой до копеек: CompactTransactions хранит копейки,
+    и остальные хранилища должны вернуть ту же сумму (10.005 -> 10.01)"""
+    return dict(transaction, amount=round_amount(transaction['amount']))
+
 
 class DataManager:
-    def __init__(self):
-        self.cards_file = "cards.json"
-        self.transactions_file = "transactions.json"
+    # Время вызовов основных методов пишется в instrumentation (спаны 'DataManager.<метод>')
+    def __init__(self, storage=None, autoload=True):
+        # Хранилище: JSON-файлы (по умолчанию) или SQLite, см. storage.open_storage
+        self.storage = storage if storage is not None else open_storage()
+        # Подписчики получают события об изменениях, см. events.EventBus
+        self.events = EventBus()
+        # Итоги по дням/неделям/месяцам без прохода по истории, см. rollups.Rollups
+        self.rollups = Rollups(self)
+        # Выдача номеров новых карт, строится при первом выпуске, см. card_numbers
+        self._numbers = None
         
-        # Проверяем существование обоих файлов
-        files_exist = os.path.exists(self.cards_file) and os.path.exists(self.transactions_file)
-        
-        self.load_data()
+        # autoload=False - загрузку выполнит вызывающий (например, в рабочем потоке)
+        if autoload:
+            self.load_data()
+
+    @timed()
+    def load_data(self, progress=None):
+        """Загрузка данных из хранилища"""
+        self.storage.load(progress)
         
-        # Если хотя бы одного файла нет, создаем тестовые данные
-        if not files_exist:
+        # Если данных еще нет, создаем тестовые данные
+        if self.storage.is_new:
             self.create_sample_data()
+            self.storage.is_new = False
+        self.rollups.invalidate()
+        self._numbers = None
+        self.events.publish(DATA_RELOADED)
 
-    def load_data(self):
-        """Загрузка данных из файлов"""
-        if os.path.exists(self.cards_file):
-            with open(self.cards_file, 'r') as f:
-                self.cards = json.load(f)
-        else:
-            self.cards = {}
-            
-        if os.path.exists(self.transactions_file):
-            with open(self.transactions_file, 'r') as f:
-                self.transactions = json.load(f)
-        else:
-            self.transactions = {}
+    @property
+    def transactions(self):
+        """История в памяти {номер карты: транзакции} (только для JSON-хранилища).
+        При колоночном хранении значения - ленивые представления со словарями"""
+        return getattr(self.storage, 'transactions', None)
 
+    @property
+    def archive(self):
+        """Архив старых транзакций (archive.Archive, только для JSON-хранилища)"""
+        return getattr(self.storage, 'archive_store', None)
+
+    @timed()
     def save_data(self):
-        """Сохранение данных в файлы"""
-        with open(self.cards_file, 'w') as f:
-            json.dump(self.cards, f)
-        with open(self.transactions_file, 'w') as f:
-            json.dump(self.transactions, f)
+        """Сохранение всех данных в хранилище"""
+        self.storage.save_data()
+
+    @contextmanager
+    def batch(self):
+        """Группа изменений с одной записью на диск и одним списком событий в конце:
+        with data_manager.batch(): ...
+        Изменения фиксируются все вместе; при исключении они откатываются
+        и события не публикуются"""
+        try:
+            with self.events.batch(), self.rollups.locked(), self.storage.batch():
+                yield
+        except BaseException:
+            self.rollups.invalidate()
+            raise
+
+    def subscribe(self, callback, kinds=None):
+        """Подписка на события об изменениях: callback(список ChangeEvent)"""
+        return self.events.subscribe(callback, kinds)
+
+    def unsubscribe(self, callback):
+        self.events.unsubscribe(callback)
 
+    @timed()
     def get_cards(self):
         """Получение списка всех карт"""
-        return list(self.cards.values())
+        return self.storage.get_cards()
 
     def get_card(self, card_number):
         """Получение информации о конкретной карте"""
-        return self.cards.get(card_number)
+        return self.storage.get_card(card_number)
 
+    @timed()
     def add_card(self, card_data):
         """Добавление новой карты"""
-        if card_data['number'] in self.cards:
-            raise ValueError("Карта с таким номером уже существует")
-        self.cards[card_data['number']] = card_data
-        self.save_data()
+        self.storage.add_card(card_data)
+        self._issued(card_data['number'])
+        self.events.publish(CARD_ADDED, card_data['number'])
 
+    @timed()
+    def add_cards(self, cards):
+        """Добавление нескольких карт: все или ни одной, одной записью на диск"""
+        cards = list(cards)
+        with self.batch():
+            self.storage.add_cards(cards)
+            for card_data in cards:
+                self._issued(card_data['number'])
+                self.events.publish(CARD_ADDED, card_data['number'])
+
+    def _issued(self, card_number):
+        if self._numbers is not None:
+            self._numbers.add(card_number)
+
+    def number_allocator(self):
+        """Выдача номеров новых карт (уникальных среди существующих, с проверкой Луна)"""
+        if self._numbers is None:
+            self._numbers = CardNumberAllocator(card['number'] for card in self.storage.get_cards())
+        return self._numbers
+
+    @timed()
+    def new_card_details(self):
+        """Свободный номер карты и CVC для диалога добавления: (номер, CVC).
+        Номер резервируется до перезапуска, даже если карту не добавят"""
+        return self.number_allocator().allocate()[0], generate_cvc()
+
+    @timed()
+    def issue_cards(self, n, names):
+        """Выпуск n карт одной операцией: новые номера и CVC, одна запись на диск.
+        names - имя держателя для всех карт или список из n имен. Возвращает данные карт"""
+        names = [names] * n if isinstance(names, str) else list(names)
+        if len(names) != n:
+            raise ValueError("Число имен не совпадает с числом карт")
+        numbers = self.number_allocator().allocate(n)
+        cards = [{'number': number, 'name': name, 'cvc': generate_cvc()}
+                 for number, name in zip(numbers, names)]
+        self.add_cards(cards)
+        return cards
+
+    @timed()
     def update_card(self, card_data):
         """Обновление информации о карте"""
-        self.cards[card_data['number']] = card_data
-        self.save_data()
+        self.storage.update_card(card_data)
+        self.events.publish(CARD_UPDATED, card_data['number'])
 
+    @timed()
     def delete_card(self, card_number):
         """Удаление карты"""
-        if card_number in self.cards:
-            del self.cards[card_number]
-            if card_number in self.transactions:
-                del self.transactions[card_number]
-            self.save_data()
+        if self.storage.get_card(card_number) is not None:
+            self.storage.delete_card(card_number)
+            self.rollups.invalidate(card_number)
+            self.events.publish(CARD_DELETED, card_number)
 
+    @timed()
     def get_transactions(self, card_number, filters=None):
-        """Получение транзакций с учетом фильтров"""
-        if card_number not in self.transactions:
-            return []
-            
-        transactions = self.transactions[card_number]
-        
-        if filters:
-            filtered = []
-            for trans in transactions:
-                if (not filters.get('date_from') or 
-                    trans['date'] >= filters['date_from']) and \
-                   (not filters.get('date_to') or 
-                    trans['date'] <= filters['date_to']) and \
-                   (not filters.get('category') or 
-                    trans['category'] == filters['category']):
-                    filtered.append(trans)
-            return filtered
-            
-        return transactions
+        """Получение транзакций с учетом фильтров.
+        filters: date_from, date_to, category (как в FilterDialog),
+        а также offset, limit и order ('asc' / 'desc' по дате).
+        Архивные транзакции входят при archived=True, при date_from раньше границы архива
+        и при фильтре по date_to, category или text без date_from. Без фильтров (весь список
+        или страницы по offset/limit) возвращаются только живые транзакции"""
+        return self.storage.get_transactions(card_number, filters)
+
+    @timed()
+    def query_transactions(self, filters=None, card_numbers=None):
+        """Поиск транзакций по нескольким картам (по умолчанию по всем).
+        Каждая транзакция возвращается с добавленным полем 'card_number'"""
+        return self.storage.query_transactions(filters, card_numbers)
+
+    @timed()
+    def count_transactions(self, card_number=None, filters=None):
+        """Количество транзакций карты (или всех карт) с учетом фильтров"""
+        return self.storage.count_transactions(card_number, filters)
 
+    def iter_transactions(self, card_numbers=None, filters=None):
+        """Генератор пар (номер карты, транзакция) в порядке даты, для выгрузки и отчетов"""
+        return self.storage.iter_transactions(card_numbers, filters)
+
+    @timed()
+    def export_csv(self, out, card_numbers=None, filters=None):
+        """Потоковая выгрузка в CSV (путь или открытый файл)"""
+        return export.export_csv(self, out, card_numbers, filters)
+
+    @timed()
+    def export_jsonl(self, out, card_numbers=None, filters=None):
+        """Потоковая выгрузка в JSON lines"""
+        return export.export_jsonl(self, out, card_numbers, filters)
+
+    @timed()
+    def monthly_report(self, by='category', card_numbers=None, filters=None):
+        """Итоги по месяцам в разрезе категорий или карт"""
+        return export.monthly_report(self, by, card_numbers, filters)
+
+    @timed()
     def add_transaction(self, card_number, transaction):
         """Добавление новой транзакции"""
-        if card_number not in self.transactions:
-            self.transactions[card_number] = []
-        self.transactions[card_number].append(transaction)
-        self.save_data() 
+        transaction = _rounded(transaction)
+        with self.rollups.adding(card_number, [transaction]):
+            self.storage.add_transaction(card_number, transaction)
+        self.events.publish(TRANSACTION_ADDED, card_number)
+
+    @timed()
+    def add_transactions(self, card_number, transactions):
+        """Добавление пачки транзакций карты одной записью в хранилище"""
+        transactions = [_rounded(transaction) for transaction in transactions]
+        with self.rollups.adding(card_number, transactions):
+            self.storage.add_transactions(card_number, transactions)
+        self.events.publish(TRANSACTION_ADDED, card_number)
+
+    @timed()
+    def rollup_total(self, date_from=None, date_to=None, card_number=None, category=None):
+        """Поступления, списания, итог и число операций за диапазон дат
+        (по карте или всем картам, по категории или всем) - по агрегатам, без истории"""
+        return self.rollups.total(date_from, date_to, card_number, category)
+
+    @timed()
+    def rollup_series(self, period='month', date_from=None, date_to=None, card_number=None, category=None):
+        """Итоги по дням, неделям или месяцам ('day', 'week', 'month') для сводок"""
+        return self.rollups.series(period, date_from, date_to, card_number, category)
+
+    @timed()
+    def rebuild_rollups(self):
+        """Пересчет агрегатов с нуля"""
+        self.rollups.rebuild()
+
+    @timed()
+    def import_transactions(self, path, card_number=None, fmt=None, chunk_size=5000):
+        """Массовый импорт выписки (CSV, OFX, JSON lines), см. importer.import_file"""
+        return import_file(self, path, card_number, fmt, chunk_size)
 
     def get_card_balance(self, card_number):
-        """Получение баланса карты"""
-        if card_number not in self.transactions:
-            return 0
-        
-        balance = 0
-        for trans in self.transactions[card_number]:
-            balance += trans['amount']
-        return balance
+        """Получение баланса карты (Decimal, из накопленного итога)"""
+        return self.storage.get_card_balance(card_number)
+
+    @timed()
+    def poll_external_changes(self):
+        """Подхват изменений, сделанных другими процессами с тем же хранилищем.
+        Изменения уже применены хранилищем; здесь публикуются их события.
+        Возвращает число событий"""
+        changes = self.storage.poll_changes()
+        with self.events.batch():
+            for kind, card_number in changes:
+                # Чужие транзакции неизвестны - агрегаты перестроятся при запросе
+                if kind in (TRANSACTION_ADDED, CARD_DELETED, DATA_RELOADED):
+                    self.rollups.invalidate(card_number)
+                if kind == CARD_ADDED:
+                    self._issued(card_number)
+                elif kind == DATA_RELOADED:
+                    self._numbers = None
+                self.events.publish(kind, card_number)
+        return len(changes)
+
+    @timed()
+    def preload(self, limit=None):
+        """Фоновое дочитывание историй карт, отложенных при запуске.
+        Возвращает, сколько карт еще осталось"""
+        return self.storage.preload(limit)
+
+    @timed()
+    def archive_transactions(self, before):
+        """Перенос транзакций раньше даты before в сжатый архив (см. archive.Archive).
+        Баланс не меняется; запросы с более ранней date_from или с archived=True
+        читают архив. Возвращает число перенесенных транзакций"""
+        moved = self.storage.archive(before)
+        if moved:
+            self.events.publish(DATA_RELOADED)
+        return moved
+
+    @timed()
+    def verify_balances(self, repair=False):
+        """Сверка накопленных балансов с историей.
+        Возвращает {номер карты: (накопленный, по истории)} для расхождений"""
+        return self.storage.verify_balances(repair)
+
+    def close(self):
+        """Завершение работы с хранилищем"""
+        self.storage.close()
 
     def create_sample_data(self):
         """Создание тестовых данных"""
-        # Очищаем существующие данные
-        self.cards = {}
-        self.transactions = {}
-        
         # Создаем тестовые карты
         cards_data = [
             {
@@ -124,8 +293,7 @@ class DataManager:
         ]
         
         # Добавляем карты
-        for card in cards_data:
-            self.cards[card['number']] = card
+        cards = {card['number']: card for card in cards_data}
         
         # Создаем тестовые транзакции
         transactions_data = {
@@ -177,6 +345,6 @@ class DataManager:
             ]
         }
         
-        self.transactions = transactions_data
-        self.save_data()
+        self.storage.replace_all(cards, transactions_data)
+
   
\ No newline at end of file
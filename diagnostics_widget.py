@@ -0,0 +1,101 @@
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTableWidget, QTableWidgetItem,
+                             QPushButton, QLabel, QHeaderView)
+from PyQt5.QtCore import Qt, QTimer
+from datetime import datetime
+import instrumentation
+
+class DiagnosticsWidget(QWidget):
+    """Вкладка диагностики: последние медленные операции, сводка по операциям,
+    счетчики, статистика кэша карт и архива. Обновляется, пока вкладка видна"""
+
+    REFRESH_INTERVAL = 2000
+
+    def __init__(self, view_cache=None, archive=None, parent=None):
+        super().__init__(parent)
+        self.view_cache = view_cache
+        self.archive = archive
+        layout = QVBoxLayout(self)
+
+        self.summary_label = QLabel()
+        self.summary_label.setWordWrap(True)
+
+        self.slow_table = QTableWidget(0, 4)
+        self.slow_table.setHorizontalHeaderLabels(["Время", "Операция", "мс", "Подробности"])
+        self.slow_table.horizontalHeader().setSectionResizeMode(3, QHeaderView.Stretch)
+        self.slow_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        self.spans_table = QTableWidget(0, 5)
+        self.spans_table.setHorizontalHeaderLabels(["Операция", "Вызовов", "Всего, мс", "Среднее, мс", "Максимум, мс"])
+        self.spans_table.horizontalHeader().setSectionResizeMode(0, QHeaderView.Stretch)
+        self.spans_table.setEditTriggers(QTableWidget.NoEditTriggers)
+
+        button_layout = QHBoxLayout()
+        refresh_btn = QPushButton("Обновить")
+        refresh_btn.clicked.connect(self.refresh)
+        reset_btn = QPushButton("Сбросить")
+        reset_btn.clicked.connect(self.reset)
+        button_layout.addWidget(refresh_btn)
+        button_layout.addWidget(reset_btn)
+        button_layout.addStretch()
+
+        layout.addWidget(self.summary_label)
+        layout.addWidget(QLabel(f"Медленные операции (от {instrumentation.SLOW_MS:g} мс):"))
+        layout.addWidget(self.slow_table, 2)
+        layout.addWidget(QLabel("Все операции:"))
+        layout.addWidget(self.spans_table, 1)
+        layout.addLayout(button_layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(self.REFRESH_INTERVAL)
+        self.timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        self.refresh()
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
+
+    def refresh(self):
+        counters = instrumentation.counters()
+        parts = [f"Строк показано: {counters.get('rows_rendered', 0)}",
+                 f"записано: {counters.get('bytes_written', 0) / 1024:.0f} КБ"]
+        if self.view_cache is not None:
+            stats = self.view_cache.stats()
+            parts.append(f"кэш карт: {stats['size']}/{stats['maxsize']}, "
+                         f"попаданий {stats['hit_rate']:.0%}, вытеснено {stats['evictions']}")
+        if self.archive is not None:
+            stats = self.archive.stats()
+            parts.append(f"архив: {stats['transactions']} операций по {stats['cards']} картам, "
+                         f"сегментов {stats['segments']}")
+        self.summary_label.setText(", ".join(parts))
+
+        slow = instrumentation.recent_slow()
+        self.slow_table.setRowCount(len(slow))
+        for row, entry in enumerate(slow):
+            details = ", ".join(f"{key}={value}" for key, value in entry.items()
+                                if key not in ('ts', 'span', 'ms'))
+            self._set_row(self.slow_table, row, [
+                datetime.fromtimestamp(entry['ts']).strftime('%H:%M:%S'),
+                entry['span'], f"{entry['ms']:.1f}", details])
+
+        spans = sorted(instrumentation.span_stats().items(), key=lambda item: -item[1]['total_ms'])
+        self.spans_table.setRowCount(len(spans))
+        for row, (name, stats) in enumerate(spans):
+            self._set_row(self.spans_table, row, [
+                name, str(stats['count']), f"{stats['total_ms']:.1f}",
+                f"{stats['mean_ms']:.2f}", f"{stats['max_ms']:.1f}"])
+
+    @staticmethod
+    def _set_row(table, row, values):
+        for column, value in enumerate(values):
+            item = QTableWidgetItem(value)
+            if column and value.replace('.', '', 1).isdigit():
+                item.setTextAlignment(int(Qt.AlignRight | Qt.AlignVCenter))
+            table.setItem(row, column, item)
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
@@ -0,0 +1,69 @@
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Виды событий об изменении данных
+CARD_ADDED = 'card_added'
+CARD_UPDATED = 'card_updated'
+CARD_DELETED = 'card_deleted'
+TRANSACTION_ADDED = 'transaction_added'
+DATA_RELOADED = 'data_reloaded'
+
+ChangeEvent = namedtuple('ChangeEvent', ['kind', 'card_number'])
+
+
+class EventBus:
+    """Шина событий об изменениях в DataManager.
+    Подписчик получает список событий; внутри batch() события накапливаются
+    и доставляются одним списком без повторов"""
+
+    def __init__(self):
+        self.subscribers = []
+        self._lock = threading.RLock()
+        self._local = threading.local()
+
+    def subscribe(self, callback, kinds=None):
+        """Подписка: callback(events), kinds - набор интересующих видов (None - все)"""
+        with self._lock:
+            self.subscribers.append((callback, frozenset(kinds) if kinds else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self.subscribers = [(cb, kinds) for cb, kinds in self.subscribers if cb != callback]
+
+    def publish(self, kind, card_number=None):
+        event = ChangeEvent(kind, card_number)
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(event)
+        else:
+            self._deliver([event])
+
+    @contextmanager
+    def batch(self):
+        """Накопление событий текущего потока до конца блока.
+        При исключении события блока отбрасываются (изменения откачены)"""
+        outer = getattr(self._local, 'pending', None) is None
+        if outer:
+            self._local.pending = []
+        mark = len(self._local.pending)
+        try:
+            yield
+        except BaseException:
+            del self._local.pending[mark:]
+            if outer:
+                self._local.pending = None
+            raise
+        if outer:
+            events, self._local.pending = self._local.pending, None
+            if events:
+                self._deliver(list(dict.fromkeys(events)))
+
+    def _deliver(self, events):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for callback, kinds in subscribers:
+            selected = events if kinds is None else [e for e in events if e.kind in kinds]
+            if selected:
+                callback(selected)
@@ -0,0 +1,110 @@
+import argparse
+import csv
+import json
+import sys
+from money import to_minor, from_minor
+
+CSV_FIELDS = ['card_number', 'date', 'amount', 'category', 'description']
+
+
+def _open(out):
+    """Файл по пути или уже открытый поток (его не закрываем)"""
+    if isinstance(out, str):
+        return open(out, 'w', encoding='utf-8', newline=''), True
+    return out, False
+
+
+def export_csv(data_manager, out, card_numbers=None, filters=None):
+    """Выгрузка транзакций в CSV построчно; возвращает число строк"""
+    f, close = _open(out)
+    try:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        count = 0
+        for card_number, trans in data_manager.iter_transactions(card_numbers, filters):
+            writer.writerow([card_number, trans['date'], trans['amount'],
+                             trans['category'], trans['description']])
+            count += 1
+        return count
+    finally:
+        if close:
+            f.close()
+
+
+def export_jsonl(data_manager, out, card_numbers=None, filters=None):
+    """Выгрузка транзакций в JSON lines (одна транзакция на строку)"""
+    f, close = _open(out)
+    try:
+        count = 0
+        for card_number, trans in data_manager.iter_transactions(card_numbers, filters):
+            f.write(json.dumps(dict(trans, card_number=card_number), ensure_ascii=False))
+            f.write("\n")
+            count += 1
+        return count
+    finally:
+        if close:
+            f.close()
+
+
+def monthly_report(data_manager, by='category', card_numbers=None, filters=None):
+    """Итоги по месяцам за один проход: by='category' или 'card'.
+    Возвращает строки {'month', by, 'income', 'expense', 'total', 'count'} (суммы - Decimal)"""
+    if by not in ('category', 'card'):
+        raise ValueError(f"Неизвестная группировка: {by}")
+    totals = {}
+    for card_number, trans in data_manager.iter_transactions(card_numbers, filters):
+        key = (trans['date'][:7], card_number if by == 'card' else trans['category'])
+        bucket = totals.get(key)
+        if bucket is None:
+            bucket = totals[key] = [0, 0, 0]
+        amount = to_minor(trans['amount'])
+        bucket[0 if amount > 0 else 1] += amount
+        bucket[2] += 1
+    return [{'month': month, by: group,
+             'income': from_minor(income), 'expense': from_minor(expense),
+             'total': from_minor(income + expense), 'count': count}
+            for (month, group), (income, expense, count) in sorted(totals.items())]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Выгрузка операций и отчеты Card Manager без интерфейса")
+    parser.add_argument('command', choices=['csv', 'jsonl', 'report'])
+    parser.add_argument('--card', action='append', help="номер карты (можно несколько, по умолчанию все)")
+    parser.add_argument('--from', dest='date_from', help="дата с (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='date_to', help="дата по (YYYY-MM-DD)")
+    parser.add_argument('--category')
+    parser.add_argument('--text', help="слова из описания или имени держателя (можно начало слова)")
+    parser.add_argument('--archived', action='store_true', help="вместе с архивными транзакциями")
+    parser.add_argument('--by', choices=['category', 'card'], default='category', help="группировка отчета")
+    parser.add_argument('-o', '--output', help="файл результата (по умолчанию stdout)")
+    args = parser.parse_args(argv)
+
+    from data_manager import DataManager
+    data_manager = DataManager()
+    filters = {'date_from': args.date_from, 'date_to': args.date_to, 'category': args.category,
+               'text': args.text, 'archived': args.archived}
+    out = args.output or sys.stdout
+    try:
+        if args.command == 'csv':
+            count = export_csv(data_manager, out, args.card, filters)
+        elif args.command == 'jsonl':
+            count = export_jsonl(data_manager, out, args.card, filters)
+        else:
+            rows = monthly_report(data_manager, args.by, args.card, filters)
+            f, close = _open(out)
+            writer = csv.writer(f)
+            writer.writerow(['month', args.by, 'income', 'expense', 'total', 'count'])
+            for row in rows:
+                writer.writerow([row['month'], row[args.by], row['income'], row['expense'],
+                                 row['total'], row['count']])
+            if close:
+                f.close()
+            count = len(rows)
+    finally:
+        data_manager.close()
+    print(f"Записано строк: {count}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
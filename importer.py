@@ -0,0 +1,238 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from money import to_minor
+
+# Категория по умолчанию, если в выписке ее нет
+DEFAULT_CATEGORY = "Другое"
+DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%Y%m%d")
+# Сколько отклоненных строк хранить в отчете (остальные только считаются)
+MAX_REJECTED = 1000
+
+
+class ImportReport:
+    """Итоги импорта: сколько строк добавлено, пропущено как дубли, отклонено"""
+
+    def __init__(self):
+        self.read = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.rejected_count = 0
+        self.rejected = []      # (номер строки, причина)
+        self.elapsed = 0.0
+
+    def reject(self, line, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REJECTED:
+            self.rejected.append((line, reason))
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f"Прочитано строк: {self.read}, добавлено: {self.imported}, "
+                f"дубликатов: {self.duplicates}, отклонено: {self.rejected_count}, "
+                f"время: {self.elapsed:.2f} с ({self.rows_per_second:.0f} строк/с)")
+
+
+def detect_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.ofx', '.qfx'):
+        return 'ofx'
+    return 'csv'
+
+
+def parse_csv(stream):
+    """Строки CSV с заголовком date, amount, category, description[, card_number].
+    Разделитель (',' или ';') определяется по первой строке"""
+    first = stream.readline()
+    delimiter = ';' if first.count(';') > first.count(',') else ','
+    header = next(csv.reader([first], delimiter=delimiter))
+    fields = [name.strip().lower() for name in header]
+    for line, row in enumerate(csv.reader(stream, delimiter=delimiter), start=2):
+        if row:
+            yield line, dict(zip(fields, row))
+
+
+def parse_jsonl(stream):
+    """Одна транзакция (JSON-объект) на строку"""
+    for line, text in enumerate(stream, start=1):
+        text = text.strip()
+        if not text:
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError:
+            row = None
+        yield line, row if isinstance(row, dict) else {'_error': "некорректный JSON"}
+
+
+_OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)")
+
+
+def parse_ofx(stream):
+    """Операции <STMTTRN> из выписки OFX (SGML или XML); номер счета берется из <ACCTID>"""
+    account = None
+    current = None
+    for line, text in enumerate(stream, start=1):
+        for closing, tag, value in _OFX_TAG.findall(text):
+            value = value.strip()
+            if tag == 'ACCTID' and not closing:
+                account = value
+            elif tag == 'STMTTRN':
+                if closing and current is not None:
+                    yield current.pop('_line'), current
+                    current = None
+                elif not closing:
+                    current = {'_line': line}
+            elif current is not None and not closing:
+                if tag == 'DTPOSTED':
+                    current['date'] = value[:8]
+                elif tag == 'TRNAMT':
+                    current['amount'] = value
+                elif tag in ('NAME', 'MEMO'):
+                    current['description'] = (current.get('description', '') + ' ' + value).strip()
+                if account and 'card_number' not in current:
+                    current['card_number'] = account
+
+
+PARSERS = {'csv': parse_csv, 'jsonl': parse_jsonl, 'ofx': parse_ofx}
+
+
+def validate(row):
+    """Приведение строки к схеме транзакции date/amount/category/description"""
+    if '_error' in row:
+        raise ValueError(row['_error'])
+    date = str(row.get('date') or '').strip()
+    for date_format in DATE_FORMATS:
+        try:
+            date = datetime.strptime(date, date_format).date().isoformat()
+            break
+        except ValueError:
+            continue
+    else:
+        raise ValueError(f"некорректная дата: {date!r}")
+    try:
+        amount = Decimal(str(row.get('amount', '')).replace(' ', '').replace(',', '.'))
+    except InvalidOperation:
+        raise ValueError(f"некорректная сумма: {row.get('amount')!r}")
+    if not amount.is_finite() or amount == 0:
+        raise ValueError(f"некорректная сумма: {row.get('amount')!r}")
+    category = str(row.get('category') or '').strip()
+    if not category:
+        category = "Пополнение" if amount > 0 else DEFAULT_CATEGORY
+    return {
+        'date': date,
+        'amount': float(amount),
+        'category': category,
+        'description': str(row.get('description') or '').strip()
+    }
+
+
+def _key(trans):
+    return trans['date'], to_minor(trans['amount']), trans['category'], trans['description']
+
+
+def import_file(data_manager, path, card_number=None, fmt=None, chunk_size=5000):
+    """Потоковый импорт: файл читается построчно, каждые chunk_size транзакций
+    фиксируются отдельным DataManager.batch() (одна запись на диск), поэтому в памяти
+    не больше одной пачки, а блокировки не держатся весь импорт.
+    Импорт не атомарен: при ошибке записанные пачки остаются, и повторный импорт
+    того же файла пропустит их как дубли (строки, уже имеющиеся в истории карты)"""
+    fmt = fmt or detect_format(path)
+    if fmt not in PARSERS:
+        raise ValueError(f"Неизвестный формат: {fmt}")
+    report = ImportReport()
+    started = time.perf_counter()
+    # Счетчики существующих транзакций по (карта, дата) - для поиска дублей
+    known = {}
+    pending = {}
+    cards = {}
+
+    def flush():
+        with data_manager.batch():
+            for number, transactions in pending.items():
+                data_manager.add_transactions(number, transactions)
+        pending.clear()
+
+    waiting = 0
+    with open(path, 'r', encoding='utf-8-sig', newline='') as stream:
+        for line, row in PARSERS[fmt](stream):
+            report.read += 1
+            number = card_number or str(row.get('card_number') or '').replace(' ', '')
+            if number not in cards:
+                cards[number] = bool(number) and data_manager.get_card(number) is not None
+            if not cards[number]:
+                report.reject(line, f"неизвестная карта: {number!r}")
+                continue
+            try:
+                trans = validate(row)
+            except ValueError as e:
+                report.reject(line, str(e))
+                continue
+
+            counts = known.get((number, trans['date']))
+            if counts is None:
+                day = {'date_from': trans['date'], 'date_to': trans['date']}
+                counts = Counter(_key(t) for t in data_manager.get_transactions(number, day))
+                known[(number, trans['date'])] = counts
+            key = _key(trans)
+            if counts[key] > 0:
+                counts[key] -= 1
+                report.duplicates += 1
+                continue
+
+            pending.setdefault(number, []).append(trans)
+            report.imported += 1
+            waiting += 1
+            if waiting >= chunk_size:
+                flush()
+                waiting = 0
+        flush()
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Импорт выписки в Card Manager без запуска интерфейса")
+    parser.add_argument('path', help="файл CSV, OFX или JSON lines")
+    parser.add_argument('--card', help="номер карты (если его нет в строках файла)")
+    parser.add_argument('--format', choices=sorted(PARSERS), help="формат файла (по расширению)")
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--rejects', help="файл CSV для отклоненных строк")
+    args = parser.parse_args(argv)
+
+    from data_manager import DataManager
+    data_manager = DataManager()
+    try:
+        report = import_file(data_manager, args.path, args.card, args.format, args.chunk_size)
+    except (OSError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    finally:
+        data_manager.close()
+
+    print(report)
+    if args.rejects and report.rejected:
+        with open(args.rejects, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['line', 'reason'])
+            writer.writerows(report.rejected)
+    elif report.rejected:
+        for line, reason in report.rejected[:20]:
+            print(f"  строка {line}: {reason}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
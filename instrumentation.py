@@ -0,0 +1,181 @@
+import atexit
+import functools
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Операции дольше порога (мс) попадают в список медленных (панель диагностики)
+SLOW_MS = float(os.environ.get('CARD_MANAGER_SLOW_MS', 50))
+# Сколько последних медленных операций хранить
+RECENT_SIZE = 200
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+_lock = threading.Lock()
+_counters = {}
+_spans = {}             # имя -> [число, всего секунд, максимум секунд]
+_slow = deque(maxlen=RECENT_SIZE)
+_log = None
+_profiler = None
+_profile_mode = None
+_profile_path = None
+
+
+def configure(log_path=None, profile=None, profile_path=None):
+    """Включение структурированного журнала (JSON lines) и режима профилирования.
+    Без аргументов - из переменных окружения CARD_MANAGER_PERF_LOG и CARD_MANAGER_PROFILE"""
+    global _log
+    log_path = log_path or os.environ.get('CARD_MANAGER_PERF_LOG')
+    profile = profile or os.environ.get('CARD_MANAGER_PROFILE')
+    if log_path and _log is None:
+        _log = open(log_path, 'a', encoding='utf-8', buffering=1)
+        atexit.register(_log.close)
+    if profile:
+        start_profiling(profile, profile_path)
+
+
+def _write_log(entry):
+    if _log is not None:
+        _log.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+def count(name, value=1):
+    """Счетчик: строки, отданные представлениям, записанные байты и т.п."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+@contextmanager
+def span(name, **fields):
+    """Замер времени блока: with span('data_manager.save_data'): ..."""
+    started = time.perf_counter()
+    memory = _traced_memory()
+    try:
+        yield fields
+    finally:
+        elapsed = time.perf_counter() - started
+        _finish(name, elapsed, fields, memory)
+
+
+def timed(name=None):
+    """Декоратор: замер каждого вызова функции"""
+    def decorate(fn):
+        label = name or fn.__qualname__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record(name, elapsed, **fields):
+    """Учет уже измеренной длительности (секунды): для операций, которые начинаются
+    в одном месте, а заканчиваются в другом (запрос из интерфейса - ответ рабочего потока)"""
+    _finish(name, elapsed, fields, None)
+
+
+def _finish(name, elapsed, fields, memory):
+    entry = None
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] = max(stats[2], elapsed)
+        if _log is not None or elapsed * 1000 >= SLOW_MS:
+            entry = {'ts': time.time(), 'span': name, 'ms': round(elapsed * 1000, 3),
+                     'thread': threading.current_thread().name}
+            if memory is not None:
+                entry['memory_kb'] = round((_traced_memory() - memory) / 1024, 1)
+            entry.update(fields)
+            if elapsed * 1000 >= SLOW_MS:
+                _slow.append(entry)
+    if entry is not None:
+        _write_log(entry)
+
+
+def _traced_memory():
+    if _profile_mode != 'tracemalloc':
+        return None
+    import tracemalloc
+    return tracemalloc.get_traced_memory()[0]
+
+
+def counters():
+    with _lock:
+        return dict(_counters)
+
+
+def span_stats():
+    """{имя: {'count', 'total_ms', 'mean_ms', 'max_ms'}}"""
+    with _lock:
+        return {name: {'count': n, 'total_ms': total * 1000, 'mean_ms': total / n * 1000,
+                       'max_ms': peak * 1000}
+                for name, (n, total, peak) in _spans.items()}
+
+
+def recent_slow():
+    """Последние медленные операции, новые первыми"""
+    with _lock:
+        return list(reversed(_slow))
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _spans.clear()
+        _slow.clear()
+
+
+def start_profiling(mode, path=None):
+    """Режим 'cprofile' (статистика вызовов) или 'tracemalloc' (выделения памяти).
+    Результат пишется в файл path и в журнал при stop_profiling (и при выходе)"""
+    global _profiler, _profile_mode, _profile_path
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Неизвестный режим профилирования: {mode}")
+    if _profile_mode is not None:
+        return
+    if mode == 'cprofile':
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+    else:
+        import tracemalloc
+        tracemalloc.start(25)
+    _profile_mode = mode
+    _profile_path = path or f"card_manager.{'prof' if mode == 'cprofile' else 'tracemalloc.txt'}"
+    atexit.register(stop_profiling)
+
+
+def stop_profiling(top=20):
+    """Остановка профилирования; возвращает текстовую сводку"""
+    global _profiler, _profile_mode
+    if _profile_mode is None:
+        return None
+    mode, _profile_mode = _profile_mode, None
+    if mode == 'cprofile':
+        import pstats
+        _profiler.disable()
+        _profiler.dump_stats(_profile_path)
+        out = io.StringIO()
+        pstats.Stats(_profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        _profiler = None
+        summary = out.getvalue()
+    else:
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        lines = [f"current: {current / 1024:.0f} KB, peak: {peak / 1024:.0f} KB"]
+        lines += [str(stat) for stat in snapshot.statistics('lineno')[:top]]
+        summary = "\n".join(lines)
+        with open(_profile_path, 'w', encoding='utf-8') as f:
+            f.write(summary)
+    _write_log({'ts': time.time(), 'profile': mode, 'path': _profile_path, 'summary': summary})
+    return summary
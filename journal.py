@@ -0,0 +1,236 @@
+import json
+import os
+import instrumentation
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def write_json_atomic(path, data):
+    """Атомарная запись JSON: временный файл + os.replace"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+        instrumentation.count('bytes_written', f.tell())
+    os.replace(tmp_path, path)
+    fsync_dir(path)
+
+
+def fsync_dir(path):
+    """Сброс на диск записи каталога (на Windows не поддерживается)"""
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class FileLock:
+    """Межпроцессная блокировка на файле: fcntl.flock, на Windows msvcrt.locking.
+    Повторный захват тем же объектом только увеличивает счетчик"""
+
+    def __init__(self, path):
+        self.path = path
+        self.depth = 0
+        self._file = None
+
+    def acquire(self, blocking=True):
+        if self.depth:
+            self.depth += 1
+            return True
+        f = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                f.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        # LK_LOCK сдается через 10 секунд - ждем дальше
+                        if not blocking:
+                            raise
+        except OSError:
+            f.close()
+            if blocking:
+                raise
+            return False
+        self._file = f
+        self.depth = 1
+        return True
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            if fcntl is None:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class Journal:
+    """Журнал операций: одна JSON-запись на строку, только дозапись.
+    Журнал общий для нескольких процессов: offset - сколько байт текущего журнала
+    уже применено, generation - номер ротации (меняется, когда журнал свернут в снимок)"""
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.rotated_path = path + ".1"
+        self.generation_path = path + ".gen"
+        self.fsync = fsync
+        self.records = 0
+        self.offset = 0
+        self.generation = 0
+        self._file = None
+
+    def replay(self):
+        """Чтение записей из отложенного (.1) и текущего журнала"""
+        self.records = 0
+        self.generation = self.read_generation()
+        for record in self._read(self.rotated_path):
+            self.records += 1
+            yield record
+        self.offset = 0
+        for record in self._read(self.path, track=True):
+            self.records += 1
+            yield record
+
+    def read_new(self):
+        """Записи, дописанные другими процессами после offset (под блокировкой записи).
+        None, если журнал с тех пор свернут в снимок (нужна перезагрузка)"""
+        if self.read_generation() != self.generation:
+            return None
+        records = list(self._read(self.path, start=self.offset, track=True))
+        self.records += len(records)
+        return records
+
+    def changed(self):
+        """Быстрая проверка без блокировки: есть ли чужие записи или ротация"""
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return size != self.offset or self.read_generation() != self.generation
+
+    def read_generation(self):
+        try:
+            with open(self.generation_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return 0
+
+    def _read(self, path, start=0, track=False):
+        """Записи начиная с байта start. Группа begin ... commit выдается только целиком.
+        Читается под блокировкой записи, поэтому недописанный хвост - след сбоя: он обрезается"""
+        if not os.path.exists(path):
+            return
+        good_offset = offset = start
+        group = None
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for line in f:
+                # Недописанная строка или мусор после сбоя - конец журнала
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                if record['op'] == 'begin':
+                    group = []
+                    continue
+                if group is not None and record['op'] != 'commit':
+                    group.append(record)
+                    continue
+                good_offset = offset
+                if track:
+                    self.offset = offset
+                if record['op'] == 'commit':
+                    yield from group or ()
+                    group = None
+                else:
+                    yield record
+        if good_offset != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(good_offset)
+
+    def append(self, record):
+        """Дозапись операции в конец журнала"""
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        line = json.dumps(record).encode() + b"\n"
+        self._file.write(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records += 1
+        self.offset += len(line)
+        instrumentation.count('bytes_written', len(line))
+
+    def append_batch(self, records):
+        """Дозапись группы операций: при восстановлении она применится целиком или никак"""
+        if len(records) == 1:
+            return self.append(records[0])
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        written = 0
+        for record in [{'op': 'begin'}] + records + [{'op': 'commit'}]:
+            line = json.dumps(record).encode() + b"\n"
+            self._file.write(line)
+            written += len(line)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.records += len(records)
+        self.offset += written
+        instrumentation.count('bytes_written', written)
+
+    def rotate(self):
+        """Перенос текущего журнала в .1 перед записью снимка"""
+        self.close()
+        if os.path.exists(self.path):
+            if os.path.exists(self.rotated_path):
+                # Предыдущее сжатие не завершилось - дописываем хвост к нему
+                with open(self.path, 'rb') as src, open(self.rotated_path, 'ab') as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.rotated_path)
+            fsync_dir(self.path)
+        self.records = 0
+        self.offset = 0
+        # Другие процессы увидят новый номер и перечитают снимок
+        self.generation = self.read_generation() + 1
+        write_json_atomic(self.generation_path, self.generation)
+
+    def drop_rotated(self):
+        """Удаление .1 после того, как снимок записан"""
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+            fsync_dir(self.rotated_path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,210 @@
+import json
+import os
+import threading
+import instrumentation
+from collections.abc import MutableMapping
+from journal import write_json_atomic, fsync_dir
+
+INDEX_VERSION = 1
+
+
+def index_path(transactions_file):
+    """Файл индекса смещений рядом со снимком: transactions.json.idx"""
+    return transactions_file + ".idx"
+
+
+def _fingerprint(stat):
+    return stat.st_size, stat.st_mtime_ns
+
+
+def fingerprint(path):
+    """Отпечаток файла снимка (размер, время изменения) или None, если файла нет"""
+    try:
+        return _fingerprint(os.stat(path))
+    except OSError:
+        return None
+
+
+class SnapshotReader:
+    """Чтение диапазонов байтов файла снимка.
+    Где есть os.pread, файл держится открытым: если снимок подменит сжатие
+    (в том числе в другом процессе), диапазоны читаются из прежнего файла"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY) if hasattr(os, 'pread') else None
+
+    def stat(self):
+        return os.fstat(self.fd) if self.fd is not None else os.stat(self.path)
+
+    def read(self, offset, length):
+        if self.fd is not None:
+            return os.pread(self.fd, length, offset)
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def __del__(self):
+        if self.fd is not None:
+            os.close(self.fd)
+
+
+class StoredHistory:
+    """Еще не прочитанная история карты: диапазон байтов в файле снимка"""
+
+    def __init__(self, reader, offset, length, count):
+        self.reader = reader
+        self.offset = offset
+        self.length = length
+        self.count = count
+
+    def read_raw(self):
+        return self.reader.read(self.offset, self.length)
+
+    def load(self):
+        return json.loads(self.read_raw())
+
+
+def write_snapshot(path, transactions, balances, lazy=None):
+    """Атомарная запись transactions.json (обычный JSON) и индекса смещений к нему.
+    Значения transactions - списки или StoredHistory (копируются из старого файла без разбора).
+    Непрочитанные истории lazy (LazyTransactions) переводятся на новый файл.
+    Возвращает отпечаток записанного файла (для индексов, построенных по снимку)"""
+    tmp_path = path + ".tmp"
+    cards = {}
+    with open(tmp_path, 'wb') as f:
+        f.write(b'{')
+        for i, (number, items) in enumerate(transactions.items()):
+            if i:
+                f.write(b', ')
+            f.write(json.dumps(number).encode() + b': ')
+            if isinstance(items, StoredHistory):
+                data, count = items.read_raw(), items.count
+            else:
+                data, count = json.dumps(list(items)).encode(), len(items)
+            cards[number] = [f.tell(), len(data), count, balances.get(number, 0)]
+            f.write(data)
+        f.write(b'}')
+        f.flush()
+        os.fsync(f.fileno())
+        instrumentation.count('bytes_written', f.tell())
+    if lazy is None:
+        os.replace(tmp_path, path)
+        reader = SnapshotReader(path)
+    else:
+        with lazy.lock:
+            os.replace(tmp_path, path)
+            reader = SnapshotReader(path)
+            lazy.rebase({number: StoredHistory(reader, offset, length, count)
+                         for number, (offset, length, count, _) in cards.items()})
+    fsync_dir(path)
+    size, mtime = _fingerprint(reader.stat())
+    # Индекс пишется после снимка: при сбое между записями отпечаток не совпадет
+    write_json_atomic(index_path(path), {'version': INDEX_VERSION, 'size': size,
+                                         'mtime_ns': mtime, 'cards': cards})
+    return size, mtime
+
+
+def read_index(path):
+    """Индекс смещений и сводка балансов, если он соответствует файлу снимка, иначе None.
+    Результат: ({номер карты: StoredHistory}, {номер карты: баланс в копейках})"""
+    try:
+        with open(index_path(path), 'r') as f:
+            index = json.load(f)
+        if index.get('version') != INDEX_VERSION:
+            return None
+        reader = SnapshotReader(path)
+        if (index['size'], index['mtime_ns']) != _fingerprint(reader.stat()):
+            return None
+    except (OSError, ValueError, KeyError):
+        return None
+    stored = {}
+    balances = {}
+    for number, (offset, length, count, balance) in index['cards'].items():
+        stored[number] = StoredHistory(reader, offset, length, count)
+        balances[number] = balance
+    return stored, balances
+
+
+class LazyTransactions(MutableMapping):
+    """{номер карты: транзакции} с чтением истории карты из снимка при первом обращении.
+    Прочитанные истории хранятся в store (dict или columnar.CompactTransactions)"""
+
+    def __init__(self, stored, store=None):
+        self.stored = dict(stored)
+        self.store = {} if store is None else store
+        # Чтение из файла и подмена файла снимка при сжатии не должны пересекаться
+        self.lock = threading.Lock()
+
+    def __getitem__(self, card_number):
+        try:
+            return self.store[card_number]
+        except KeyError:
+            pass
+        with self.lock:
+            history = self.stored.pop(card_number, None)
+            if history is not None:
+                self.store[card_number] = history.load()
+        return self.store[card_number]
+
+    def __setitem__(self, card_number, items):
+        if isinstance(items, StoredHistory):
+            # Возврат непрочитанной истории (откат удаления карты)
+            self.store.pop(card_number, None)
+            self.stored[card_number] = items
+            return
+        self.stored.pop(card_number, None)
+        self.store[card_number] = items
+
+    def __delitem__(self, card_number):
+        found = self.stored.pop(card_number, None) is not None
+        if card_number in self.store:
+            del self.store[card_number]
+        elif not found:
+            raise KeyError(card_number)
+
+    def __contains__(self, card_number):
+        return card_number in self.store or card_number in self.stored
+
+    def __iter__(self):
+        yield from list(self.store)
+        yield from list(self.stored)
+
+    def __len__(self):
+        return len(self.store) + len(self.stored)
+
+    def setdefault(self, card_number, default=()):
+        if card_number not in self:
+            self[card_number] = list(default)
+        return self[card_number]
+
+    def raw(self, card_number):
+        """История карты как есть, без чтения: список или StoredHistory (None, если карты нет)"""
+        history = self.stored.get(card_number)
+        if history is not None:
+            return history
+        return self.store.get(card_number)
+
+    def count(self, card_number):
+        """Число транзакций карты без чтения ее истории"""
+        history = self.stored.get(card_number)
+        if history is not None:
+            return history.count
+        return len(self.store.get(card_number, ()))
+
+    def snapshot_items(self):
+        """Копия для записи снимка: прочитанные истории - списками, остальные - StoredHistory"""
+        with self.lock:
+            items = {number: list(items) for number, items in self.store.items()}
+            items.update(self.stored)
+        return items
+
+    def rebase(self, stored):
+        """Переход на новый файл снимка (вызывается под self.lock)"""
+        self.stored = {number: stored[number] for number in self.stored if number in stored}
+
+    def preload(self, limit=None):
+        """Чтение еще не загруженных историй (не больше limit); возвращает, сколько осталось"""
+        for number in list(self.stored)[:limit]:
+            self.get(number)
+        return len(self.stored)
@@ -0,0 +1,162 @@
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+# Доли запросов по умолчанию: чтения разных видов и добавление транзакций
+DEFAULT_MIX = {'cards': 1, 'card': 3, 'balance': 5, 'transactions': 5, 'post': 2}
+
+
+class Client:
+    """Одно keep-alive соединение с сервером (server.py)"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode() if body is not None else b''
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+        await self.writer.drain()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("сервер закрыл соединение")
+        status = int(line.split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        data = await self.reader.readexactly(length)
+        return status, json.loads(data) if data else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def _request(kind, number, rng):
+    if kind == 'cards':
+        return 'GET', '/cards', None
+    if kind == 'card':
+        return 'GET', f'/cards/{number}', None
+    if kind == 'balance':
+        return 'GET', f'/cards/{number}/balance', None
+    if kind == 'transactions':
+        return 'GET', f'/cards/{number}/transactions?order=desc&limit=50', None
+    day = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    return 'POST', f'/cards/{number}/transactions', {
+        'date': day.isoformat(), 'amount': rng.choice([-1, 1]) * rng.randrange(100, 10000),
+        'category': 'Нагрузка', 'description': 'loadtest'}
+
+
+async def _worker(host, port, numbers, kinds, weights, deadline, seed, stats):
+    rng = random.Random(seed)
+    client = Client(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            kind = rng.choices(kinds, weights)[0]
+            method, path, body = _request(kind, rng.choice(numbers), rng)
+            started = time.perf_counter()
+            try:
+                status, _ = await client.request(method, path, body)
+            except (OSError, ValueError, asyncio.IncompleteReadError):
+                client.close()
+                client = Client(host, port)
+                status = None
+                await asyncio.sleep(0.05)
+            stats.setdefault(kind, []).append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                stats['errors'] = stats.get('errors', 0) + 1
+    finally:
+        client.close()
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+async def run(host, port, concurrency, duration, mix, seed=0):
+    """Нагрузка concurrency клиентами в течение duration секунд; возвращает отчет"""
+    client = Client(host, port)
+    try:
+        status, cards = await client.request('GET', '/cards')
+    finally:
+        client.close()
+    if status != 200 or not cards:
+        raise RuntimeError("на сервере нет карт")
+    numbers = [card['number'] for card in cards]
+    kinds = [kind for kind in mix if mix[kind] > 0]
+    weights = [mix[kind] for kind in kinds]
+    stats = {}
+    started = time.perf_counter()
+    deadline = started + duration
+    await asyncio.gather(*(_worker(host, port, numbers, kinds, weights, deadline, seed + i, stats)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies = [value for kind in kinds for value in stats.get(kind, ())]
+    report = {'requests': len(latencies), 'errors': stats.get('errors', 0), 'seconds': elapsed,
+              'rps': len(latencies) / elapsed, 'p50_ms': _percentile(latencies, 0.5) * 1000,
+              'p99_ms': _percentile(latencies, 0.99) * 1000, 'by_kind': {}}
+    for kind in kinds:
+        values = stats.get(kind, [])
+        report['by_kind'][kind] = {'requests': len(values), 'rps': len(values) / elapsed,
+                                   'p50_ms': _percentile(values, 0.5) * 1000,
+                                   'p99_ms': _percentile(values, 0.99) * 1000}
+    return report
+
+
+def print_report(report):
+    print(f"Запросов: {report['requests']} за {report['seconds']:.1f} с, ошибок: {report['errors']}")
+    print(f"{report['rps']:.0f} запросов/с, p50 {report['p50_ms']:.1f} мс, p99 {report['p99_ms']:.1f} мс")
+    print(f"{'запрос':<14}{'всего':>9}{'в секунду':>12}{'p50, мс':>10}{'p99, мс':>10}")
+    for kind, row in report['by_kind'].items():
+        print(f"{kind:<14}{row['requests']:>9}{row['rps']:>12.0f}{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+
+def _mix(text):
+    """'balance=5,post=1' -> {'balance': 5, 'post': 1}"""
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for item in text.split(','):
+        kind, _, weight = item.partition('=')
+        if kind not in mix:
+            raise argparse.ArgumentTypeError(f"неизвестный вид запроса: {kind}")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест HTTP API Card Manager (server.py)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--concurrency', type=int, default=16, help="одновременных клиентов")
+    parser.add_argument('--duration', type=float, default=10.0, help="секунд")
+    parser.add_argument('--mix', type=_mix, default=DEFAULT_MIX,
+                        help="доли запросов, например balance=5,transactions=5,post=1 "
+                             f"(виды: {', '.join(DEFAULT_MIX)})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="отчет в формате JSON")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run(args.host, args.port, args.concurrency, args.duration, args.mix, args.seed))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,10 +1,20 @@
+import argparse
 import sys
+import time
 from PyQt5.QtWidgets import QApplication, QInputDialog
 from main_window import MainWindow
 from PyQt5.QtCore import QDate, Qt
+import instrumentation
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    started = time.perf_counter()
+    # Диагностика: также переменные окружения CARD_MANAGER_PROFILE и CARD_MANAGER_PERF_LOG
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--profile', choices=instrumentation.PROFILE_MODES)
+    parser.add_argument('--perf-log')
+    args, qt_args = parser.parse_known_args()
+    instrumentation.configure(args.perf_log, args.profile)
+    app = QApplication(sys.argv[:1] + qt_args)
+    window = MainWindow(started)
     window.show()
-    sys.exit(app.exec_()) 
\ No newline at end of file
+    sys.exit(app.exec_())
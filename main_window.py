@@ -1,17 +1,198 @@
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, 
-                            QHBoxLayout, QPushButton, QListWidget,
-                            QTabWidget)
+                            QHBoxLayout, QPushButton, QListView,
+                            QTabWidget, QProgressBar, QMessageBox, QLineEdit)
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer
+from bisect import bisect_left, insort
+import sys
+import time
+from itertools import count
 from card_widget import CardWidget
 from transaction_widget import TransactionWidget
 from data_manager import DataManager
+from workers import DataService, EventBridge
+from events import DATA_RELOADED
+from view_cache import CardViewCache
+from diagnostics_widget import DiagnosticsWidget
+import instrumentation
+
+class CardListModel(QAbstractListModel):
+    """Список карт с доступом по номеру: изменение карты обновляет только ее строку.
+    Строки отдаются представлению порциями, поиск - по префиксу имени или номера"""
+    
+    NumberRole = Qt.UserRole
+    CHUNK = 200
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.cards = {}         # номер -> CardView
+        self.sequence = {}      # номер -> порядковый номер (порядок get_cards)
+        self.search_keys = []   # отсортированные пары (ключ поиска, номер)
+        self.visible = []       # номера карт, подходящих под фильтр
+        self.rows = {}          # номер -> строка в visible
+        self.loaded = 0         # сколько строк уже отдано представлению
+        self.filter_text = ''
+        self._counter = count()
+
+    @staticmethod
+    def _keys(card):
+        """Ключи поиска: номер, имя целиком и каждое слово имени"""
+        name = card['name'].casefold()
+        return {card['number'], name} | set(name.split())
+
+    def set_cards(self, views):
+        """Полная загрузка списка: [CardView, ...]"""
+        self.cards = {}
+        self.sequence = {}
+        self.search_keys = []
+        for view in views:
+            card = view.card
+            self.cards[card['number']] = view
+            self.sequence[card['number']] = next(self._counter)
+            self.search_keys.extend((key, card['number']) for key in self._keys(card))
+        self.search_keys.sort()
+        self.set_filter(self.filter_text)
+
+    def set_filter(self, text):
+        """Фильтр по префиксу имени (любого слова) или номера карты"""
+        self.beginResetModel()
+        self.filter_text = text.strip().casefold()
+        if self.filter_text:
+            lo = bisect_left(self.search_keys, (self.filter_text,))
+            hi = bisect_left(self.search_keys, (self.filter_text + '\uffff',))
+            found = {number for _, number in self.search_keys[lo:hi]}
+            self.visible = sorted(found, key=self.sequence.get)
+        else:
+            self.visible = sorted(self.cards, key=self.sequence.get)
+        self.rows = {number: row for row, number in enumerate(self.visible)}
+        self.loaded = min(self.CHUNK, len(self.visible))
+        self.endResetModel()
+        instrumentation.count('rows_rendered', self.loaded)
+
+    def _matches(self, card):
+        return not self.filter_text or any(key.startswith(self.filter_text) for key in self._keys(card))
+
+    def update_card(self, view):
+        """Добавление или обновление одной карты"""
+        card = view.card
+        number = card['number']
+        if number in self.cards:
+            self._drop_keys(self.cards[number].card)
+        else:
+            self.sequence[number] = next(self._counter)
+        self.cards[number] = view
+        for key in self._keys(card):
+            insort(self.search_keys, (key, number))
+        
+        row = self.rows.get(number)
+        matches = self._matches(card)
+        if row is not None and not matches:
+            # Карта больше не подходит под фильтр (например, после переименования)
+            self._remove_row(number)
+        elif row is not None:
+            if row < self.loaded:
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+        elif matches:
+            self._insert_row(number)
+
+    def remove_card(self, number):
+        """Удаление одной карты"""
+        if number not in self.cards:
+            return
+        self._drop_keys(self.cards.pop(number).card)
+        self._remove_row(number)
+        self.sequence.pop(number, None)
+
+    def _insert_row(self, number):
+        """Строка карты на ее место в visible (в порядке get_cards)"""
+        order = self.sequence[number]
+        row = len(self.visible)
+        # Новая карта встает в конец, снова подошедшая под фильтр - на прежнее место
+        while row > 0 and self.sequence[self.visible[row - 1]] > order:
+            row -= 1
+        # Строка видна сразу, если она среди загруженных или список загружен до конца
+        if row < self.loaded or row == self.loaded == len(self.visible):
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.visible.insert(row, number)
+            self.loaded += 1
+            self.endInsertRows()
+        else:
+            self.visible.insert(row, number)
+        for i in range(row, len(self.visible)):
+            self.rows[self.visible[i]] = i
+
+    def _remove_row(self, number):
+        row = self.rows.pop(number, None)
+        if row is None:
+            return
+        if row < self.loaded:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.visible[row]
+            self.loaded -= 1
+            self.endRemoveRows()
+        else:
+            del self.visible[row]
+        for i in range(row, len(self.visible)):
+            self.rows[self.visible[i]] = i
+
+    def _drop_keys(self, card):
+        for key in self._keys(card):
+            i = bisect_left(self.search_keys, (key, card['number']))
+            if i < len(self.search_keys) and self.search_keys[i] == (key, card['number']):
+                del self.search_keys[i]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.loaded
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.loaded < len(self.visible)
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        last = min(self.loaded + self.CHUNK, len(self.visible))
+        instrumentation.count('rows_rendered', last - self.loaded)
+        self.beginInsertRows(QModelIndex(), self.loaded, last - 1)
+        self.loaded = last
+        self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.loaded:
+            return None
+        number = self.visible[index.row()]
+        if role == self.NumberRole:
+            return number
+        if role == Qt.DisplayRole:
+            return self.cards[number].label
+        return None
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # Сколько отложенных историй карт дочитывать за одну задачу рабочего потока
+    PRELOAD_CHUNK = 50
+    STARTUP_STAGES = ("первая отрисовка", "карты и балансы", "полная готовность")
+    # Период опроса изменений от других экземпляров приложения, мс
+    POLL_INTERVAL = 1000
+
+    def __init__(self, started=None):
         super().__init__()
+        # Отчет о запуске: время от старта процесса до первой отрисовки,
+        # показа карт с балансами и чтения всей истории
+        self.started = started or time.perf_counter()
+        self.startup = {}
+        self.histories_loaded = False
+        # Начало обновления списка карт: полное время пишется в instrumentation
+        self.cards_requested = None
         self.setWindowTitle("Банковские карты")
         self.setMinimumSize(1000, 600)
         
-        self.data_manager = DataManager()
+        # Данные загружаются в рабочем потоке, окно показывается сразу
+        self.data_manager = DataManager(autoload=False)
+        self.data_service = DataService(self.data_manager, self)
+        self.data_service.error.connect(self.show_error)
+        # Представления обновляются по событиям DataManager, а не прямыми вызовами
+        self.event_bridge = EventBridge(self.data_manager, parent=self)
+        # Подписи, номера и балансы карт для отображения
+        self.view_cache = CardViewCache(self.data_manager)
         
         central_widget = QWidget()
         self.setCentralWidget(central_widget)
@@ -21,12 +202,20 @@ class MainWindow(QMainWindow):
         left_panel = QWidget()
         left_layout = QVBoxLayout(left_panel)
         
-        self.cards_list = QListWidget()
-        self.cards_list.itemClicked.connect(self.show_card_details)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Поиск по имени или номеру")
+        
+        self.card_model = CardListModel(self)
+        self.cards_list = QListView()
+        self.cards_list.setModel(self.card_model)
+        self.cards_list.setUniformItemSizes(True)
+        self.cards_list.clicked.connect(self.show_card_details)
+        self.search_edit.textChanged.connect(self.card_model.set_filter)
         
         add_card_btn = QPushButton("+ Добавить карту")
         add_card_btn.clicked.connect(self.add_new_card)
         
+        left_layout.addWidget(self.search_edit)
         left_layout.addWidget(self.cards_list)
         left_layout.addWidget(add_card_btn)
         
@@ -37,10 +226,11 @@ class MainWindow(QMainWindow):
         # Создаем вкладки для карты и транзакций
         self.tab_widget = QTabWidget()
         self.card_widget = CardWidget(self.data_manager, self)
-        self.transaction_widget = TransactionWidget(self.data_manager)
+        self.transaction_widget = TransactionWidget(self.data_manager, self.data_service)
         
         self.tab_widget.addTab(self.card_widget, "Информация о карте")
         self.tab_widget.addTab(self.transaction_widget, "Операции")
+        self.tab_widget.addTab(DiagnosticsWidget(self.view_cache, self.data_manager.archive), "Диагностика")
         
         right_layout.addWidget(self.tab_widget)
         
@@ -48,19 +238,114 @@ class MainWindow(QMainWindow):
         main_layout.addWidget(left_panel, 1)
         main_layout.addWidget(right_panel, 2)
         
-        self.load_cards()
+        # Ход загрузки данных в строке состояния
+        self.load_progress = QProgressBar()
+        self.load_progress.setMaximumWidth(200)
+        self.statusBar().addPermanentWidget(self.load_progress)
+        self.statusBar().showMessage("Загрузка данных...")
+        self.data_service.progress.connect(self.on_load_progress)
+        self.event_bridge.changed.connect(self.on_data_changed)
+        self.data_service.load(callback=self.on_data_loaded)
+        # Срабатывает после показа окна, когда цикл событий отрисовал его
+        QTimer.singleShot(0, lambda: self.mark_startup("первая отрисовка"))
+        # Изменения других процессов применяются по мере появления, без полной перезагрузки
+        self.poll_timer = QTimer(self)
+        self.poll_timer.setInterval(self.POLL_INTERVAL)
+        self.poll_timer.timeout.connect(self.poll_external_changes)
+
+    def mark_startup(self, stage):
+        if stage in self.startup:
+            return
+        self.startup[stage] = time.perf_counter() - self.started
+        if len(self.startup) == len(self.STARTUP_STAGES):
+            report = "Запуск: " + self.startup_report()
+            print(report, file=sys.stderr)
+            for stage in self.STARTUP_STAGES:
+                instrumentation.record(f"startup.{stage}", self.startup[stage])
+            self.statusBar().showMessage(report, 5000)
+
+    def startup_report(self):
+        return ", ".join(f"{stage}: {self.startup[stage] * 1000:.0f} мс"
+                         for stage in self.STARTUP_STAGES if stage in self.startup)
+
+    def on_load_progress(self, done, total):
+        self.load_progress.setMaximum(total)
+        self.load_progress.setValue(done)
+
+    def on_data_loaded(self, _):
+        self.load_progress.hide()
+        self.statusBar().clearMessage()
+        self.preload_histories()
+        self.poll_timer.start()
+
+    def poll_external_changes(self):
+        # События придут через EventBridge, как и для своих изменений
+        self.data_service.call(self.data_manager.poll_external_changes)
+
+    def preload_histories(self, remaining=None):
+        """Истории карт дочитываются порциями, между которыми выполняются запросы интерфейса"""
+        if remaining == 0:
+            self.histories_loaded = True
+            self._check_ready()
+            return
+        self.data_service.call(self.data_manager.preload, self.PRELOAD_CHUNK,
+                               callback=self.preload_histories)
+
+    def on_data_changed(self, events):
+        """Обновление только затронутых карт"""
+        if any(event.kind == DATA_RELOADED for event in events):
+            self.load_cards()
+        else:
+            for card_number in dict.fromkeys(event.card_number for event in events):
+                self.refresh_card(card_number)
+        self.card_widget.on_data_changed(events)
+        self.transaction_widget.on_data_changed(events)
+
+    def show_error(self, message):
+        QMessageBox.warning(self, "Ошибка", message)
 
     def load_cards(self):
-        self.cards_list.clear()
-        cards = self.data_manager.get_cards()
-        for card in cards:
-            balance = self.data_manager.get_card_balance(card['number'])
-            self.cards_list.addItem(f"{card['name']}\n{card['number']}\nБаланс: {balance} ₽")
-
-    def show_card_details(self, item):
-        card_number = item.text().split('\n')[1]
-        card = self.data_manager.get_card(card_number)
-        self.card_widget.display_card(card)
+        self.cards_requested = time.perf_counter()
+        self.data_service.call(self._collect_cards, callback=self.show_cards)
+
+    def show_cards(self, cards):
+        with instrumentation.span('CardListModel.set_cards', cards=len(cards)):
+            self.card_model.set_cards(cards)
+        if self.cards_requested is not None:
+            instrumentation.record('MainWindow.load_cards', time.perf_counter() - self.cards_requested,
+                                   cards=len(cards))
+            self.cards_requested = None
+        self.mark_startup("карты и балансы")
+        self._check_ready()
+
+    def _check_ready(self):
+        """Полная готовность: список карт показан и вся история прочитана"""
+        if self.histories_loaded and "карты и балансы" in self.startup:
+            self.mark_startup("полная готовность")
+
+    def _collect_cards(self):
+        """Выполняется в рабочем потоке: карты вместе с балансами"""
+        with instrumentation.span('MainWindow.collect_cards'):
+            return [self.view_cache.get(card['number'], card) for card in self.data_manager.get_cards()]
+
+    def refresh_card(self, card_number):
+        """Обновление строки одной карты (или ее удаление из списка)"""
+        self.data_service.call(self._collect_card, card_number,
+                               callback=lambda result: self._update_card_row(card_number, result))
+
+    def _collect_card(self, card_number):
+        return self.view_cache.get(card_number)
+
+    def _update_card_row(self, card_number, view):
+        if view is None:
+            self.card_model.remove_card(card_number)
+        else:
+            self.card_model.update_card(view)
+
+    def show_card_details(self, index):
+        card_number = index.data(CardListModel.NumberRole)
+        self.data_service.call(self.data_manager.get_card, card_number,
+                               callback=self.card_widget.display_card)
         self.transaction_widget.load_transactions(card_number)
 
     def add_new_card(self):
@@ -68,4 +353,11 @@ class MainWindow(QMainWindow):
         self.tab_widget.setCurrentWidget(self.card_widget)
 
     def refresh_cards(self):
-        self.load_cards() 
\ No newline at end of file
+        self.load_cards()
+
+    def closeEvent(self, event):
+        # Дожидаемся записи поставленных изменений
+        self.poll_timer.stop()
+        self.data_service.stop()
+        self.data_manager.close()
+        super().closeEvent(event)
@@ -0,0 +1,53 @@
+import argparse
+import sys
+import time
+from storage import JsonStorage
+from sqlite_storage import SqliteStorage
+
+
+def migrate(cards_file, transactions_file, journal_file, db_path, force=False):
+    """Перенос данных из JSON-файлов (снимок + журнал) в базу SQLite"""
+    source = JsonStorage(cards_file, transactions_file, journal_file)
+    if source.is_new:
+        raise FileNotFoundError("Не найдены исходные JSON-файлы")
+    target = SqliteStorage(db_path)
+    target.load()
+    if not force and target.get_cards():
+        target.close()
+        raise ValueError(f"База {db_path} уже содержит данные (используйте --force)")
+
+    source.load()
+    # В SQLite переносится вся история: архивные транзакции (archive.Archive) - перед живыми
+    transactions = {}
+    for number in dict.fromkeys(list(source.transactions) + list(source.archive_store.cards)):
+        archived = sorted(source.archive_store.read(number), key=lambda item: item[0])
+        transactions[number] = [trans for _, trans in archived] + list(source.transactions.get(number, []))
+    target.replace_all(source.cards, transactions)
+    target.save_data()
+    target.close()
+    source.close()
+    return len(source.cards), sum(len(items) for items in transactions.values())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Миграция данных Card Manager из JSON в SQLite")
+    parser.add_argument('--cards', default='cards.json')
+    parser.add_argument('--transactions', default='transactions.json')
+    parser.add_argument('--journal', default='journal.log')
+    parser.add_argument('--db', default='card_manager.db')
+    parser.add_argument('--force', action='store_true', help="перезаписать непустую базу")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    try:
+        cards, transactions = migrate(args.cards, args.transactions, args.journal, args.db, args.force)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"Ошибка: {e}", file=sys.stderr)
+        return 1
+    print(f"Перенесено карт: {cards}, транзакций: {transactions} "
+          f"за {time.perf_counter() - started:.2f} с")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,23 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# Суммы хранятся в копейках (целые числа), чтобы не копить ошибку округления float
+MINOR_UNITS = 100
+CENT = Decimal("0.01")
+
+
+def to_minor(amount):
+    """Перевод суммы (int, float, str, Decimal) в копейки"""
+    value = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+    return int(value * MINOR_UNITS)
+
+
+def from_minor(minor):
+    """Перевод копеек в Decimal с двумя знаками после запятой"""
+    return (Decimal(minor) / MINOR_UNITS).quantize(CENT)
+
+
+def round_amount(amount):
+    """Сумма, округленная до копеек (как ее считает to_minor); целые суммы не меняются"""
+    if isinstance(amount, int):
+        return amount
+    return to_minor(amount) / MINOR_UNITS
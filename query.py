@@ -0,0 +1,190 @@
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from itertools import islice
+from money import to_minor
+
+# Ключ индекса: (дата ISO, позиция в списке карты); позиция сохраняет порядок добавления
+_MAX_POS = float('inf')
+
+# Поля, по которым возможна сортировка помимо даты, и ключ сравнения
+SORT_FIELDS = {
+    'amount': lambda trans: to_minor(trans['amount']),
+    'category': lambda trans: trans['category'],
+    'description': lambda trans: trans['description'],
+}
+# Сколько отсортированных выборок держать между запросами страниц
+SORTED_CACHE_SIZE = 8
+
+
+class TransactionIndex:
+    """Индекс транзакций по дате и категории.
+    Строится для карты при первом запросе и обновляется при добавлении"""
+
+    def __init__(self, transactions):
+        self.transactions = transactions
+        self.by_date = {}       # номер карты -> отсортированные ключи
+        self.by_category = {}   # категория -> {номер карты -> отсортированные ключи}
+        self.sorted_cache = {}  # условия запроса -> выборка, отсортированная по полю
+
+    def _build(self, card_number):
+        keys = sorted((trans['date'], pos)
+                      for pos, trans in enumerate(self.transactions.get(card_number, [])))
+        self.by_date[card_number] = keys
+        for key in keys:
+            category = self.transactions[card_number][key[1]]['category']
+            self.by_category.setdefault(category, {}).setdefault(card_number, []).append(key)
+        return keys
+
+    def _keys(self, card_number, category=None):
+        keys = self.by_date.get(card_number)
+        if keys is None:
+            keys = self._build(card_number)
+        if category is not None:
+            keys = self.by_category.get(category, {}).get(card_number, [])
+        return keys
+
+    def add(self, card_number, pos):
+        """Учет транзакции, добавленной в конец списка карты"""
+        self.sorted_cache.clear()
+        keys = self.by_date.get(card_number)
+        if keys is None:
+            return
+        trans = self.transactions[card_number][pos]
+        key = (trans['date'], pos)
+        category_keys = self.by_category.setdefault(trans['category'], {}).setdefault(card_number, [])
+        for target in (keys, category_keys):
+            if not target or target[-1] <= key:
+                target.append(key)
+            else:
+                insort(target, key)
+
+    def drop(self, card_number):
+        """Удаление индекса карты"""
+        self.sorted_cache.clear()
+        self.by_date.pop(card_number, None)
+        for cards in self.by_category.values():
+            cards.pop(card_number, None)
+
+    def clear(self):
+        self.sorted_cache.clear()
+        self.by_date.clear()
+        self.by_category.clear()
+
+    def _range(self, card_number, date_from, date_to, category, matched=None):
+        keys = self._keys(card_number, category)
+        lo = bisect_left(keys, (date_from,)) if date_from else 0
+        hi = bisect_right(keys, (date_to, _MAX_POS)) if date_to else len(keys)
+        positions = matched.get(card_number) if matched is not None else None
+        if positions is not None:
+            # Текстовый поиск: только найденные позиции
+            keys = [key for key in keys[lo:hi] if key[1] in positions]
+            return keys, 0, len(keys)
+        return keys, lo, max(lo, hi)
+
+    def _cards(self, card_numbers, category, matched=None):
+        if matched is not None:
+            # Текстовый поиск (search.TextIndex.search): только карты с найденными транзакциями
+            candidates = self.transactions if card_numbers is None else card_numbers
+            return [number for number in candidates if number in matched]
+        if card_numbers is not None:
+            return list(card_numbers)
+        if category is None:
+            return list(self.transactions)
+        # Для запроса по категории достаточно карт, где она встречается
+        for card_number in self.transactions:
+            self._keys(card_number)
+        return list(self.by_category.get(category, {}))
+
+    def count(self, card_numbers=None, date_from=None, date_to=None, category=None, matched=None):
+        """Число транзакций, подходящих под условия"""
+        total = 0
+        for card_number in self._cards(card_numbers, category, matched):
+            _, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+            total += hi - lo
+        return total
+
+    def query(self, card_numbers=None, date_from=None, date_to=None, category=None,
+              offset=0, limit=None, descending=False, sort_by=None, matched=None):
+        """Поиск транзакций: список пар (номер карты, транзакция) в порядке даты
+        или поля sort_by (amount, category, description).
+        matched - результат текстового поиска (search.TextIndex.search)"""
+        cards = self._cards(card_numbers, category, matched)
+        stop = None if limit is None else offset + limit
+        if sort_by in SORT_FIELDS:
+            selected = self._sorted(cards, date_from, date_to, category, sort_by, matched)
+            if descending:
+                selected = selected[::-1]
+            return [(card_number, self.transactions[card_number][pos])
+                    for _, _, card_number, pos in selected[offset:stop]]
+        if len(cards) == 1:
+            card_number = cards[0]
+            keys, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+            if descending:
+                start = hi - offset
+                end = lo if stop is None else max(lo, hi - stop)
+                selected = keys[end:max(start, end)][::-1]
+            else:
+                end = hi if stop is None else min(hi, lo + stop)
+                selected = keys[lo + offset:end]
+            items = self.transactions.get(card_number, [])
+            return [(card_number, items[pos]) for _, pos in selected]
+
+        # Несколько карт: слияние отсортированных диапазонов
+        streams = []
+        for card_number in cards:
+            keys, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+            if lo == hi:
+                continue
+            streams.append(self._stream(card_number, keys, lo, hi, descending))
+        merged = heapq.merge(*streams, reverse=descending)
+        return [(card_number, self.transactions[card_number][pos])
+                for _, card_number, pos in islice(merged, offset, stop)]
+
+    def select(self, card_numbers=None, date_from=None, date_to=None, category=None, matched=None):
+        """Ключи подходящих транзакций по картам: список (номер карты, [(дата, позиция), ...])"""
+        selected = []
+        for card_number in self._cards(card_numbers, category, matched):
+            keys, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+            if lo < hi:
+                selected.append((card_number, keys[lo:hi]))
+        return selected
+
+    def iterate(self, card_numbers=None, date_from=None, date_to=None, category=None, matched=None):
+        """Ленивый обход транзакций в порядке даты: пары (номер карты, транзакция).
+        Копируются только ключи диапазонов, сами транзакции не собираются в список"""
+        streams = []
+        for card_number in self._cards(card_numbers, category, matched):
+            keys, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+            if lo < hi:
+                streams.append(self._stream(card_number, keys[lo:hi], 0, hi - lo, False))
+        for _, card_number, pos in heapq.merge(*streams):
+            items = self.transactions.get(card_number)
+            # Карта могла быть удалена во время обхода
+            if items is not None:
+                yield card_number, items[pos]
+
+    def _sorted(self, cards, date_from, date_to, category, sort_by, matched=None):
+        """Выборка, отсортированная по полю; кэшируется для постраничного чтения
+        (кроме выборок текстового поиска)"""
+        cache_key = (tuple(cards), date_from, date_to, category, sort_by)
+        selected = self.sorted_cache.get(cache_key) if matched is None else None
+        if selected is None:
+            value = SORT_FIELDS[sort_by]
+            selected = []
+            for card_number in cards:
+                keys, lo, hi = self._range(card_number, date_from, date_to, category, matched)
+                items = self.transactions.get(card_number, [])
+                selected.extend((value(items[pos]), date, card_number, pos) for date, pos in keys[lo:hi])
+            selected.sort()
+            if matched is not None:
+                return selected
+            if len(self.sorted_cache) >= SORTED_CACHE_SIZE:
+                self.sorted_cache.pop(next(iter(self.sorted_cache)))
+            self.sorted_cache[cache_key] = selected
+        return selected
+
+    @staticmethod
+    def _stream(card_number, keys, lo, hi, descending):
+        part = range(hi - 1, lo - 1, -1) if descending else range(lo, hi)
+        for i in part:
+            yield keys[i][0], card_number, keys[i][1]
@@ -0,0 +1,274 @@
+import threading
+from contextlib import contextmanager
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+from money import to_minor, from_minor
+
+PERIODS = ('day', 'week', 'month')
+# Сколько карт держать с построенными итогами (давно не запрошенные вытесняются)
+MAX_CARDS = 256
+# Итоги считаются по всей истории, включая архив (см. archive)
+ARCHIVED = {'archived': True}
+
+
+class Fenwick:
+    """Дерево Фенвика (префиксные суммы) над массивом int64: добавление и сумма за O(log n)"""
+
+    def __init__(self, size):
+        self.tree = array('q', bytes(8 * (size + 1)))
+
+    def __len__(self):
+        return len(self.tree) - 1
+
+    def add(self, i, value):
+        tree = self.tree
+        i += 1
+        while i < len(tree):
+            tree[i] += value
+            i += i & -i
+
+    def prefix(self, i):
+        """Сумма элементов [0, i)"""
+        tree = self.tree
+        total = 0
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def values(self):
+        """Исходный массив за O(n): построение дерева в обратном порядке"""
+        tree = array('q', self.tree)
+        n = len(tree) - 1
+        for i in range(n, 0, -1):
+            j = i + (i & -i)
+            if j <= n:
+                tree[j] -= tree[i]
+        return tree[1:]
+
+    @classmethod
+    def from_values(cls, values, size):
+        fenwick = cls(size)
+        tree = fenwick.tree
+        tree[1:len(values) + 1] = array('q', values)
+        for i in range(1, size + 1):
+            j = i + (i & -i)
+            if j <= size:
+                tree[j] += tree[i]
+        return fenwick
+
+
+class DayTotals:
+    """Поступления, списания (в копейках) и число операций по дням.
+    Диапазон дней растет по мере появления новых дат"""
+
+    def __init__(self):
+        self.origin = None      # номер первого дня (date.toordinal)
+        self.trees = None       # Fenwick: поступления, списания, число
+
+    def add(self, day, minor):
+        if self.origin is None:
+            self.origin = day
+            self.trees = [Fenwick(64) for _ in range(3)]
+        elif not self.origin <= day < self.origin + len(self.trees[0]):
+            self._grow(day)
+        i = day - self.origin
+        self.trees[0 if minor > 0 else 1].add(i, minor)
+        self.trees[2].add(i, 1)
+
+    def _grow(self, day):
+        """Перестроение на расширенный (не меньше чем вдвое) диапазон дней, O(n)"""
+        capacity = len(self.trees[0])
+        end = self.origin + capacity
+        if day < self.origin:
+            # Запас в прошлое: более ранние даты обычно приходят пачкой (импорт)
+            origin = max(0, end - max(end - day, 2 * capacity))
+            size = end - origin
+        else:
+            origin = self.origin
+            size = max(day + 1 - origin, 2 * capacity)
+        shift = self.origin - origin
+        self.trees = [Fenwick.from_values(array('q', bytes(8 * shift)) + tree.values(), size)
+                      for tree in self.trees]
+        self.origin = origin
+
+    def sums(self, day_from, day_to):
+        """(поступления, списания, число) за дни [day_from, day_to]"""
+        if self.origin is None:
+            return 0, 0, 0
+        lo = min(max(day_from - self.origin, 0), len(self.trees[0]))
+        hi = min(max(day_to + 1 - self.origin, 0), len(self.trees[0]))
+        if lo >= hi:
+            return 0, 0, 0
+        return tuple(tree.prefix(hi) - tree.prefix(lo) for tree in self.trees)
+
+    def span(self):
+        """Первый и последний день с операциями или None"""
+        if self.origin is None:
+            return None
+        counts = self.trees[2]
+        total = counts.prefix(len(counts))
+        if not total:
+            return None
+        return self.origin + self._search(counts, 1), self.origin + self._search(counts, total)
+
+    @staticmethod
+    def _search(fenwick, target):
+        """Наименьший индекс i, при котором prefix(i + 1) >= target"""
+        tree = fenwick.tree
+        pos = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            nxt = pos + step
+            if nxt < len(tree) and tree[nxt] < target:
+                pos = nxt
+                target -= tree[nxt]
+            step >>= 1
+        return pos
+
+
+class _Rollup:
+    """Итоги по дням: все операции и отдельно по каждой категории"""
+
+    def __init__(self):
+        self.total = DayTotals()
+        self.categories = {}
+
+    def add(self, day, minor, category):
+        self.total.add(day, minor)
+        self.categories.setdefault(category, DayTotals()).add(day, minor)
+
+    def select(self, category):
+        if category is None:
+            return self.total
+        return self.categories.get(category) or DayTotals()
+
+
+def _entry(trans):
+    """(номер дня, сумма в копейках, категория) для _Rollup.add"""
+    return date.fromisoformat(trans['date']).toordinal(), to_minor(trans['amount']), trans['category']
+
+
+def buckets(period, first, last):
+    """Границы периодов (первый, последний день), покрывающих [first, last] (номера дней)"""
+    if period == 'day':
+        return [(day, day) for day in range(first, last + 1)]
+    if period == 'week':
+        start = first - date.fromordinal(first).weekday()
+        return [(day, day + 6) for day in range(start, last + 1, 7)]
+    if period == 'month':
+        result = []
+        current = date.fromordinal(first).replace(day=1)
+        while current.toordinal() <= last:
+            following = (current + timedelta(days=32)).replace(day=1)
+            result.append((current.toordinal(), following.toordinal() - 1))
+            current = following
+        return result
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+class Rollups:
+    """Агрегаты поступлений и списаний по дням для сводок по периодам.
+    Итоги по всем картам строятся при первом запросе, по карте - при первом запросе
+    к этой карте; дальше поддерживаются при добавлении транзакций.
+    Сумма за любой диапазон дней - O(log n), ряд по периодам - O(число периодов · log n)"""
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.overall = None     # _Rollup по всем картам
+        self.cards = OrderedDict()      # номер карты -> _Rollup, в порядке обращения
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def adding(self, card_number, transactions):
+        """Запись новых транзакций карты (тело with) и их учет в итогах под одной блокировкой,
+        чтобы перестроение итогов в другом потоке не учло их дважды.
+        Даты и суммы разбираются до записи: с ошибкой в них транзакция не записывается"""
+        entries = [_entry(trans) for trans in transactions]
+        with self._lock:
+            yield
+            card = self.cards.get(card_number)
+            for entry in entries:
+                if self.overall is not None:
+                    self.overall.add(*entry)
+                if card is not None:
+                    card.add(*entry)
+
+    @contextmanager
+    def locked(self):
+        """Блокировка итогов на время группы изменений (DataManager.batch); берется
+        раньше блокировки хранилища, как и при перестроении"""
+        with self._lock:
+            overall = self.overall
+            yield
+            # Итоги по всем картам, построенные внутри группы, могут не учесть ее изменений
+            # (SqliteStorage.iter_transactions читает через отдельное соединение)
+            if self.overall is not overall:
+                self.overall = None
+
+    def invalidate(self, card_number=None):
+        """Сброс агрегатов (изменения, которые нельзя учесть приращением);
+        перестроятся при следующем запросе"""
+        with self._lock:
+            self.overall = None
+            if card_number is None:
+                self.cards.clear()
+            else:
+                self.cards.pop(card_number, None)
+
+    def rebuild(self):
+        """Полный пересчет итогов по всем картам"""
+        with self._lock:
+            self.invalidate()
+            self._rollup(None)
+
+    def _rollup(self, card_number):
+        if card_number is None:
+            if self.overall is None:
+                rollup = _Rollup()
+                for _, trans in self.data_manager.iter_transactions(filters=ARCHIVED):
+                    rollup.add(*_entry(trans))
+                self.overall = rollup
+            return self.overall
+        rollup = self.cards.get(card_number)
+        if rollup is None:
+            rollup = _Rollup()
+            for trans in self.data_manager.get_transactions(card_number, ARCHIVED):
+                rollup.add(*_entry(trans))
+            self.cards[card_number] = rollup
+            if len(self.cards) > MAX_CARDS:
+                self.cards.popitem(last=False)
+        else:
+            self.cards.move_to_end(card_number)
+        return rollup
+
+    def total(self, date_from=None, date_to=None, card_number=None, category=None):
+        """Итог за диапазон дат: {'income', 'expense', 'total', 'count'}"""
+        with self._lock:
+            totals = self._rollup(card_number).select(category)
+            day_from = date.fromisoformat(date_from).toordinal() if date_from else 1
+            day_to = date.fromisoformat(date_to).toordinal() if date_to else date.max.toordinal()
+            return _row(*totals.sums(day_from, day_to))
+
+    def series(self, period='month', date_from=None, date_to=None, card_number=None, category=None):
+        """Итоги по периодам ('day', 'week', 'month'): список строк с ключом 'period' -
+        первый день периода; без дат - от первой до последней операции"""
+        with self._lock:
+            totals = self._rollup(card_number).select(category)
+            span = totals.span()
+            if span is None and not (date_from and date_to):
+                return []
+            first = date.fromisoformat(date_from).toordinal() if date_from else span[0]
+            last = date.fromisoformat(date_to).toordinal() if date_to else span[1]
+            rows = []
+            for start, end in buckets(period, first, last):
+                row = _row(*totals.sums(max(start, first), min(end, last)))
+                row['period'] = date.fromordinal(start).isoformat()
+                rows.append(row)
+            return rows
+
+
+def _row(income, expense, count):
+    return {'income': from_minor(income), 'expense': from_minor(expense),
+            'total': from_minor(income + expense), 'count': count}
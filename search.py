@@ -0,0 +1,228 @@
+import base64
+import json
+import re
+import sys
+from array import array
+from bisect import bisect_left, insort
+from journal import write_json_atomic
+
+INDEX_VERSION = 1
+_WORD = re.compile(r"\w+")
+
+
+def index_path(transactions_file):
+    """Файл поискового индекса рядом со снимком: transactions.json.search"""
+    return transactions_file + ".search"
+
+
+def tokenize(text):
+    """Слова текста для поиска: без учета регистра (casefold, в том числе кириллица), ё = е"""
+    return _WORD.findall(text.casefold().replace('ё', 'е'))
+
+
+def prefix_range(terms, prefix):
+    """Слова отсортированного списка, начинающиеся с prefix"""
+    return terms[bisect_left(terms, prefix):bisect_left(terms, prefix + '\uffff')]
+
+
+def match_text(text, *fields):
+    """Проверка без индекса (для архивных транзакций), по тем же правилам, что TextIndex.search:
+    каждое слово запроса - начало какого-то слова в полях"""
+    terms = set(tokenize(' '.join(fields)))
+    return all(any(term.startswith(word) for term in terms) for word in tokenize(text))
+
+
+def _intersect(left, right):
+    """Пересечение результатов двух слов запроса; None - все транзакции карты"""
+    result = {}
+    for number in left.keys() & right.keys():
+        a, b = left[number], right[number]
+        positions = b if a is None else a if b is None else a & b
+        if positions is None or positions:
+            result[number] = positions
+    return result
+
+
+class TextIndex:
+    """Инвертированный индекс по описаниям транзакций и именам держателей карт.
+    Строится при первом поиске или читается из файла, записанного вместе со снимком,
+    и дальше поддерживается при изменениях (как TransactionIndex).
+    Слова запроса ищутся по префиксу; транзакция подходит, если каждое слово запроса
+    есть в ее описании или в имени держателя карты"""
+
+    def __init__(self, cards, transactions):
+        self.cards = cards
+        self.transactions = transactions
+        self.postings = None    # номер карты -> {слово: array позиций в истории карты}
+        self.described = {}     # слово -> карты, где оно есть в описаниях
+        self.named = {}         # слово -> карты, где оно есть в имени держателя
+        self.card_names = {}    # номер карты -> слова имени
+        self.vocabulary = []    # все слова по алфавиту, для поиска по префиксу
+
+    @property
+    def built(self):
+        return self.postings is not None
+
+    def build(self):
+        postings = {}
+        # Описания часто повторяются: разбор одного описания выполняется один раз
+        parsed = {}
+        for number in list(self.transactions):
+            card = postings[number] = {}
+            for pos, trans in enumerate(self.transactions[number]):
+                description = trans['description']
+                terms = parsed.get(description)
+                if terms is None:
+                    terms = parsed[description] = set(tokenize(description))
+                for term in terms:
+                    positions = card.get(term)
+                    if positions is None:
+                        positions = card[term] = array('I')
+                    positions.append(pos)
+        self.load(postings)
+
+    def load(self, postings):
+        """Установка позиций (построенных или прочитанных из файла)"""
+        self.postings = postings
+        self.described = {}
+        for number, card in postings.items():
+            for term in card:
+                self.described.setdefault(term, set()).add(number)
+        self.named = {}
+        self.card_names = {}
+        for card in list(self.cards.values()):
+            self._add_name(card, vocabulary=False)
+        self.vocabulary = sorted(self.described.keys() | self.named.keys())
+
+    def _add_term(self, term):
+        if term not in self.described and term not in self.named:
+            insort(self.vocabulary, term)
+
+    def _drop_term(self, term):
+        if term not in self.described and term not in self.named:
+            i = bisect_left(self.vocabulary, term)
+            if i < len(self.vocabulary) and self.vocabulary[i] == term:
+                del self.vocabulary[i]
+
+    def _add_name(self, card, vocabulary=True):
+        terms = set(tokenize(card['name']))
+        self.card_names[card['number']] = terms
+        for term in terms:
+            if vocabulary:
+                self._add_term(term)
+            self.named.setdefault(term, set()).add(card['number'])
+
+    def _drop_name(self, number):
+        for term in self.card_names.pop(number, ()):
+            cards = self.named[term]
+            cards.discard(number)
+            if not cards:
+                del self.named[term]
+                self._drop_term(term)
+
+    def add(self, number, pos):
+        """Учет транзакции, добавленной в историю карты на позицию pos"""
+        if self.postings is None:
+            return
+        card = self.postings.setdefault(number, {})
+        for term in set(tokenize(self.transactions[number][pos]['description'])):
+            positions = card.get(term)
+            if positions is None:
+                self._add_term(term)
+                positions = card[term] = array('I')
+                self.described.setdefault(term, set()).add(number)
+            elif positions[-1] >= pos:
+                continue
+            positions.append(pos)
+
+    def set_card(self, card):
+        """Учет добавленной карты или нового имени держателя"""
+        if self.postings is None:
+            return
+        self._drop_name(card['number'])
+        self._add_name(card)
+
+    def drop(self, number):
+        """Удаление карты из индекса"""
+        if self.postings is None:
+            return
+        self._drop_name(number)
+        for term in self.postings.pop(number, {}):
+            cards = self.described[term]
+            cards.discard(number)
+            if not cards:
+                del self.described[term]
+                self._drop_term(term)
+
+    def reindex(self, number):
+        """Повторная индексация карты по текущим данным (после отката изменений)"""
+        if self.postings is None:
+            return
+        self.drop(number)
+        card = self.cards.get(number)
+        if card is not None:
+            self._add_name(card)
+        if number in self.transactions:
+            for pos in range(len(self.transactions[number])):
+                self.add(number, pos)
+
+    def search(self, text):
+        """Транзакции, подходящие под текст запроса: {номер карты: множество позиций
+        или None, если подходят все транзакции карты (совпало имя держателя)}.
+        None, если в тексте нет слов"""
+        words = list(dict.fromkeys(tokenize(text)))
+        if not words:
+            return None
+        if self.postings is None:
+            self.build()
+        result = None
+        for word in words:
+            found = {}
+            for term in prefix_range(self.vocabulary, word):
+                for number in self.named.get(term, ()):
+                    found[number] = None
+                for number in self.described.get(term, ()):
+                    if number in found and found[number] is None:
+                        continue
+                    found.setdefault(number, set()).update(self.postings[number][term])
+            result = found if result is None else _intersect(result, found)
+            if not result:
+                break
+        return result
+
+    def snapshot(self):
+        """Копия позиций для записи вместе со снимком (вызывается под блокировкой хранилища).
+        None, если индекс еще не построен"""
+        if self.postings is None:
+            return None
+        return {number: {term: positions.tobytes() for term, positions in card.items()}
+                for number, card in self.postings.items()}
+
+
+def write_index(transactions_file, fingerprint, postings):
+    """Запись позиций (TextIndex.snapshot) с отпечатком файла снимка, к которому они относятся"""
+    write_json_atomic(index_path(transactions_file), {
+        'version': INDEX_VERSION, 'size': fingerprint[0], 'mtime_ns': fingerprint[1],
+        'byteorder': sys.byteorder, 'itemsize': array('I').itemsize,
+        'cards': {number: {term: base64.b64encode(raw).decode('ascii') for term, raw in card.items()}
+                  for number, card in postings.items()}})
+
+
+def read_index(transactions_file, fingerprint):
+    """Позиции для TextIndex.load, если индекс относится к текущему снимку, иначе None"""
+    try:
+        with open(index_path(transactions_file), 'r') as f:
+            index = json.load(f)
+        if (index.get('version') != INDEX_VERSION or index['byteorder'] != sys.byteorder
+                or index['itemsize'] != array('I').itemsize
+                or fingerprint is None or (index['size'], index['mtime_ns']) != tuple(fingerprint)):
+            return None
+        postings = {}
+        for number, card in index['cards'].items():
+            postings[number] = {}
+            for term, encoded in card.items():
+                positions = postings[number][term] = array('I')
+                positions.frombytes(base64.b64decode(encoded))
+        return postings
+    except (OSError, ValueError, KeyError):
+        return None
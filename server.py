@@ -0,0 +1,421 @@
+import argparse
+import asyncio
+import json
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlsplit, parse_qsl, unquote
+import instrumentation
+from importer import validate
+
+# Период опроса изменений от других процессов с тем же хранилищем, с
+POLL_INTERVAL = 1.0
+# Сколько стоящих в очереди изменений выполнять одной группой (одна запись на диск)
+MAX_WRITE_GROUP = 500
+MAX_BODY = 10 * 1024 * 1024
+# Параметры запроса транзакций, передаваемые в фильтр DataManager
+FILTER_PARAMS = ('date_from', 'date_to', 'category', 'order', 'sort_by', 'text')
+STATUS_TEXT = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found',
+               405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+               500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadWriteLock:
+    """Много читателей одновременно или один писатель.
+    Ожидающий писатель не пропускает новых читателей вперед"""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class DataServer:
+    """HTTP/JSON доступ к DataManager.
+    Изменения выполняет одна задача-писатель: подряд идущие изменения - одной группой
+    (DataManager.batch) с одной записью на диск. Чтения выполняются параллельно в пуле
+    потоков и не пересекаются с группой изменений, т.е. видят только зафиксированное состояние"""
+
+    def __init__(self, data_manager, readers=4):
+        self.data_manager = data_manager
+        self.lock = ReadWriteLock()
+        self.read_pool = ThreadPoolExecutor(readers, thread_name_prefix='reader')
+        self.write_pool = ThreadPoolExecutor(1, thread_name_prefix='writer')
+        self.writes = None
+        self.tasks = []
+        self.clients = {}       # задача соединения -> StreamWriter
+        self.routes = [
+            ('GET', ('cards',), self.list_cards),
+            ('POST', ('cards',), self.add_card),
+            ('GET', ('cards', None), self.get_card),
+            ('GET', ('cards', None, 'balance'), self.get_balance),
+            ('GET', ('cards', None, 'transactions'), self.get_transactions),
+            ('POST', ('cards', None, 'transactions'), self.add_transactions),
+            ('GET', ('transactions',), self.query_transactions),
+            ('GET', ('stats',), self.stats),
+        ]
+
+    async def start(self, host, port):
+        self.writes = asyncio.Queue()
+        self.tasks = [asyncio.create_task(self._writer()), asyncio.create_task(self._poll())]
+        return await asyncio.start_server(self._serve_client, host, port)
+
+    async def stop(self):
+        """Остановка после выполнения уже поставленных изменений (прием соединений
+        уже прекращен): открытые соединения закрываются, потоки завершаются"""
+        self.tasks[1].cancel()
+        for writer in self.clients.values():
+            writer.close()
+        # Запросы, уже принятые соединениями, дорабатывают (писатель еще работает)
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        await self.writes.join()
+        self.tasks[0].cancel()
+        self.read_pool.shutdown()
+        self.write_pool.shutdown()
+
+    # Выполнение операций
+
+    async def read(self, fn, *args):
+        """Чтение в пуле потоков; результат сразу кодируется в JSON (уже вне блокировки)"""
+        return await asyncio.get_running_loop().run_in_executor(self.read_pool, self._read, fn, args)
+
+    def _read(self, fn, args):
+        with self.lock.reading():
+            result = fn(*args)
+        return _encode(result)
+
+    async def write(self, fn, *args):
+        """Постановка изменения в очередь писателя; результат - после записи на диск"""
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((fn, args, future))
+        return _encode(await future)
+
+    async def _writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            group = [await self.writes.get()]
+            while not self.writes.empty() and len(group) < MAX_WRITE_GROUP:
+                group.append(self.writes.get_nowait())
+            results = await loop.run_in_executor(self.write_pool, self._apply, group)
+            for (_, _, future), (ok, value) in zip(group, results):
+                if not future.done():
+                    if ok:
+                        future.set_result(value)
+                    else:
+                        future.set_exception(value)
+                self.writes.task_done()
+
+    def _apply(self, group):
+        """Группа изменений под исключительной блокировкой; ошибка одного изменения
+        откатывает только его (как DataWorker)"""
+        results = []
+        with self.lock.writing(), instrumentation.span('DataServer.write_group', size=len(group)):
+            try:
+                with self.data_manager.batch():
+                    for fn, args, _ in group:
+                        try:
+                            with self.data_manager.batch():
+                                results.append((True, fn(*args)))
+                        except Exception as e:
+                            results.append((False, e))
+            except Exception as e:
+                return [(False, e)] * len(group)
+        return results
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(POLL_INTERVAL)
+            try:
+                await self.write(self.data_manager.poll_external_changes)
+            except Exception as e:
+                print(f"Ошибка опроса изменений: {e}", file=sys.stderr)
+
+    # HTTP
+
+    async def _serve_client(self, reader, writer):
+        task = asyncio.current_task()
+        self.clients[task] = writer
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await self.handle(method, target, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except HTTPError as e:
+            writer.write(_response(e.status, _encode({'error': str(e)}), False))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.clients[task]
+            writer.close()
+
+    async def handle(self, method, target, body):
+        """(статус, тело ответа в JSON) для запроса"""
+        url = urlsplit(target)
+        parts = tuple(unquote(part) for part in url.path.strip('/').split('/') if part)
+        params = dict(parse_qsl(url.query))
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            if len(pattern) != len(parts) or any(p is not None and p != part for p, part in zip(pattern, parts)):
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            args = [part for p, part in zip(pattern, parts) if p is None]
+            name = "/".join(p or '{number}' for p in pattern)
+            try:
+                with instrumentation.span(f"server.{method} /{name}"):
+                    return await handler(*args, params=params, body=body)
+            except HTTPError as e:
+                return e.status, _encode({'error': str(e)})
+            except Exception as e:
+                return 500, _encode({'error': str(e)})
+        if allowed:
+            return 405, _encode({'error': "метод не поддерживается"})
+        return 404, _encode({'error': "неизвестный адрес"})
+
+    # Обработчики: (статус, JSON)
+
+    async def list_cards(self, params, body):
+        return 200, await self.read(self._cards)
+
+    def _cards(self):
+        return [_card(card, self.data_manager.get_card_balance(card['number']))
+                for card in self.data_manager.get_cards()]
+
+    async def get_card(self, number, params, body):
+        return 200, await self.read(self._card, number)
+
+    def _card(self, number):
+        card = self._require_card(number)
+        result = _card(card, self.data_manager.get_card_balance(number))
+        result['transaction_count'] = self.data_manager.count_transactions(number)
+        return result
+
+    async def get_balance(self, number, params, body):
+        return 200, await self.read(self._balance, number)
+
+    def _balance(self, number):
+        self._require_card(number)
+        return {'number': number, 'balance': self.data_manager.get_card_balance(number)}
+
+    async def get_transactions(self, number, params, body):
+        return 200, await self.read(self._transactions, number, _filters(params))
+
+    def _transactions(self, number, filters):
+        self._require_card(number)
+        # Копия под блокировкой: без фильтра возвращается сама история карты
+        return list(self.data_manager.get_transactions(number, filters))
+
+    async def query_transactions(self, params, body):
+        cards = [number for number in params.pop('card', '').split(',') if number] or None
+        return 200, await self.read(self.data_manager.query_transactions, _filters(params), cards)
+
+    async def add_card(self, params, body):
+        """Без number карта выпускается с новым номером и CVC (card_numbers)"""
+        data = _json_body(body)
+        if not isinstance(data, dict) or not data.get('name'):
+            raise HTTPError(400, "нужно поле name")
+        if not data.get('number'):
+            return 201, await self.write(self._issue_card, str(data['name']))
+        card = {'number': str(data['number']).replace(' ', ''), 'name': str(data['name']),
+                'cvc': str(data.get('cvc', ''))}
+        return 201, await self.write(self._add_card, card)
+
+    def _add_card(self, card):
+        if self.data_manager.get_card(card['number']) is not None:
+            raise HTTPError(409, "карта с таким номером уже существует")
+        self.data_manager.add_card(card)
+        return _card(card, self.data_manager.get_card_balance(card['number']))
+
+    def _issue_card(self, name):
+        card = self.data_manager.issue_cards(1, name)[0]
+        result = _card(card, self.data_manager.get_card_balance(card['number']))
+        # CVC выпущенной карты возвращается только в этом ответе
+        result['cvc'] = card['cvc']
+        return result
+
+    async def add_transactions(self, number, params, body):
+        """Тело - транзакция или список транзакций (поля как в импорте)"""
+        data = _json_body(body)
+        rows = data if isinstance(data, list) else [data]
+        try:
+            transactions = [validate(row if isinstance(row, dict) else {'_error': "ожидается объект"})
+                            for row in rows]
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        return 201, await self.write(self._add_transactions, number, transactions)
+
+    def _add_transactions(self, number, transactions):
+        self._require_card(number)
+        self.data_manager.add_transactions(number, transactions)
+        return {'added': len(transactions), 'balance': self.data_manager.get_card_balance(number)}
+
+    async def stats(self, params, body):
+        return 200, _encode({'spans': instrumentation.span_stats(), 'counters': instrumentation.counters(),
+                             'queued_writes': self.writes.qsize()})
+
+    def _require_card(self, number):
+        card = self.data_manager.get_card(number)
+        if card is None:
+            raise HTTPError(404, "карта не найдена")
+        return card
+
+
+def _card(card, balance):
+    """Карта для ответа (без CVC)"""
+    return {'number': card['number'], 'name': card['name'], 'balance': balance}
+
+
+def _filters(params):
+    filters = {key: params[key] for key in FILTER_PARAMS if params.get(key)}
+    try:
+        for key in ('offset', 'limit'):
+            if params.get(key):
+                filters[key] = int(params[key])
+    except ValueError:
+        raise HTTPError(400, "offset и limit - целые числа")
+    archived = params.get('archived', '').lower()
+    if archived in ('1', 'true'):
+        filters['archived'] = True
+    elif archived not in ('', '0', 'false'):
+        raise HTTPError(400, "archived - 1/true или 0/false")
+    return filters
+
+
+def _json_body(body):
+    try:
+        return json.loads(body or b'null')
+    except ValueError:
+        raise HTTPError(400, "некорректный JSON")
+
+
+def _encode(value):
+    # Балансы (Decimal) - строками, без потери точности
+    return json.dumps(value, ensure_ascii=False, default=str).encode()
+
+
+async def _read_request(reader):
+    """(метод, адрес, заголовки, тело) или None, если клиент закрыл соединение"""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _ = line.decode('utf-8').split()
+    except ValueError:
+        raise HTTPError(400, "некорректная строка запроса")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HTTPError(400, "некорректный Content-Length")
+    if length < 0:
+        raise HTTPError(400, "некорректный Content-Length")
+    if length > MAX_BODY:
+        raise HTTPError(413, "слишком большое тело запроса")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+def _response(status, payload, keep_alive=True):
+    head = (f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + payload
+
+
+async def serve(data_manager, host, port, readers=4):
+    """Работа до SIGINT/SIGTERM; поставленные изменения перед выходом записываются"""
+    server = DataServer(data_manager, readers)
+    listener = await server.start(host, port)
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for name in ('SIGINT', 'SIGTERM'):
+        try:
+            loop.add_signal_handler(getattr(signal, name), stopping.set)
+        except (NotImplementedError, AttributeError):  # Windows: остается KeyboardInterrupt
+            pass
+    print(f"Сервер запущен: http://{host}:{port}", file=sys.stderr)
+    try:
+        await stopping.wait()
+    finally:
+        listener.close()
+        await server.stop()
+        await listener.wait_closed()
+    print("Сервер остановлен", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Card Manager без интерфейса: HTTP/JSON API к данным")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--readers', type=int, default=4, help="потоков для чтения")
+    parser.add_argument('--profile', choices=instrumentation.PROFILE_MODES)
+    parser.add_argument('--perf-log', help="журнал операций в формате JSON lines")
+    args = parser.parse_args(argv)
+    instrumentation.configure(args.perf_log, args.profile)
+
+    from data_manager import DataManager
+    data_manager = DataManager()
+    try:
+        asyncio.run(serve(data_manager, args.host, args.port, args.readers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        data_manager.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
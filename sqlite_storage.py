@@ -0,0 +1,424 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from money import to_minor, from_minor
+from search import tokenize
+from storage import Storage, query_args, has_filters
+from events import CARD_ADDED, CARD_UPDATED, CARD_DELETED, TRANSACTION_ADDED, DATA_RELOADED
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cards (
+    number TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    card_number TEXT NOT NULL,
+    date TEXT NOT NULL,
+    amount NOT NULL, -- без типа: int и float хранятся как есть, как в JSON
+    amount_minor INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    description TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_card_date ON transactions (card_number, date, id);
+CREATE INDEX IF NOT EXISTS idx_transactions_category ON transactions (category, date);
+CREATE TABLE IF NOT EXISTS balances (
+    card_number TEXT PRIMARY KEY,
+    minor INTEGER NOT NULL
+);
+-- Журнал изменений для других процессов, работающих с той же базой
+CREATE TABLE IF NOT EXISTS change_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    source TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    card_number TEXT
+);
+-- Полнотекстовый поиск: слова описаний транзакций и имен держателей карт (search.tokenize)
+CREATE TABLE IF NOT EXISTS transaction_terms (
+    term TEXT NOT NULL,
+    transaction_id INTEGER NOT NULL,
+    PRIMARY KEY (term, transaction_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_transaction_terms_id ON transaction_terms (transaction_id);
+CREATE TABLE IF NOT EXISTS card_terms (
+    term TEXT NOT NULL,
+    card_number TEXT NOT NULL,
+    PRIMARY KEY (term, card_number)
+) WITHOUT ROWID;
+"""
+# PRAGMA user_version, начиная с которого заполнены таблицы слов
+SEARCH_VERSION = 1
+
+INSERT_CARD = "INSERT INTO cards (number, data) VALUES (?, ?)"
+UPSERT_CARD = "INSERT OR REPLACE INTO cards (number, data) VALUES (?, ?)"
+INSERT_TRANSACTION = ("INSERT INTO transactions (card_number, date, amount, amount_minor, category, description) "
+                      "VALUES (?, ?, ?, ?, ?, ?)")
+INSERT_TRANSACTION_ID = ("INSERT INTO transactions "
+                         "(id, card_number, date, amount, amount_minor, category, description) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)")
+INSERT_TRANSACTION_TERM = "INSERT OR IGNORE INTO transaction_terms (term, transaction_id) VALUES (?, ?)"
+INSERT_CARD_TERM = "INSERT OR IGNORE INTO card_terms (term, card_number) VALUES (?, ?)"
+# Условие поиска по одному слову запроса (по префиксу) в описании или имени держателя
+TEXT_CONDITION = ("(id IN (SELECT transaction_id FROM transaction_terms WHERE term >= ? AND term < ?) "
+                  "OR card_number IN (SELECT card_number FROM card_terms WHERE term >= ? AND term < ?))")
+ADD_BALANCE = ("INSERT INTO balances (card_number, minor) VALUES (?, ?) "
+               "ON CONFLICT (card_number) DO UPDATE SET minor = minor + excluded.minor")
+TRANSACTION_COLUMNS = "card_number, date, amount, category, description"
+# Столбцы для сортировки по полю sort_by (см. query.SORT_FIELDS)
+SORT_COLUMNS = {'amount': 'amount_minor', 'category': 'category', 'description': 'description'}
+
+# Сколько строк вставлять за один вызов executemany при массовой загрузке
+BATCH_SIZE = 10000
+# Сколько последних записей change_log хранить
+CHANGE_LOG_SIZE = 10000
+
+
+def transaction_row(card_number, trans):
+    return (card_number, trans['date'], trans['amount'], to_minor(trans['amount']),
+            trans['category'], trans['description'])
+
+
+def row_to_transaction(row):
+    return {'date': row[1], 'amount': row[2], 'category': row[3], 'description': row[4]}
+
+
+def card_term_rows(card):
+    return [(term, card['number']) for term in set(tokenize(card['name']))]
+
+
+class SqliteStorage(Storage):
+    """Хранилище в SQLite (WAL) для больших историй операций.
+    Данные не держатся в памяти, запросы выполняются по индексам"""
+
+    def __init__(self, path="card_manager.db"):
+        self.path = path
+        self.is_new = not os.path.exists(path)
+        self._lock = threading.RLock()
+        self._write_depth = 0
+        self.conn = None
+        # Свои изменения в change_log помечаются, чтобы не получать их при опросе
+        self.source = uuid.uuid4().hex
+        self._last_change = 0
+
+    def load(self, progress=None):
+        with self._lock:
+            if self.conn is None:
+                # Транзакциями управляем сами (BEGIN/COMMIT), запросы кэшируются модулем sqlite3
+                self.conn = sqlite3.connect(self.path, isolation_level=None,
+                                            check_same_thread=False, cached_statements=256)
+                self.conn.execute("PRAGMA journal_mode=WAL")
+                self.conn.execute("PRAGMA synchronous=NORMAL")
+                self.conn.executescript(SCHEMA)
+                if self.conn.execute("PRAGMA user_version").fetchone()[0] < SEARCH_VERSION:
+                    self._fill_terms()
+            self._last_change = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM change_log").fetchone()[0]
+        if progress:
+            progress(1, 1)
+
+    def _write(self):
+        return _WriteTransaction(self)
+
+    def _fill_terms(self):
+        """Заполнение таблиц слов для базы, созданной до поиска"""
+        with self._write() as cur:
+            # Другой процесс мог заполнить таблицы, пока ждали записи
+            if cur.execute("PRAGMA user_version").fetchone()[0] >= SEARCH_VERSION:
+                return
+            cur.execute("DELETE FROM transaction_terms")
+            cur.execute("DELETE FROM card_terms")
+            for (data,) in self.conn.execute("SELECT data FROM cards").fetchall():
+                cur.executemany(INSERT_CARD_TERM, card_term_rows(json.loads(data)))
+            rows = self.conn.execute("SELECT id, description FROM transactions ORDER BY id")
+            while True:
+                chunk = rows.fetchmany(BATCH_SIZE)
+                if not chunk:
+                    break
+                self._insert_terms(cur, chunk)
+            cur.execute(f"PRAGMA user_version = {SEARCH_VERSION}")
+
+    @staticmethod
+    def _insert_terms(cur, rows, parsed=None):
+        """Слова описаний для строк (id транзакции, описание)"""
+        # Описания часто повторяются: разбор одного описания выполняется один раз
+        parsed = {} if parsed is None else parsed
+        terms = []
+        for transaction_id, description in rows:
+            words = parsed.get(description)
+            if words is None:
+                words = parsed[description] = set(tokenize(description))
+            terms.extend((term, transaction_id) for term in words)
+        cur.executemany(INSERT_TRANSACTION_TERM, terms)
+
+    def _log_change(self, cur, kind, card_number=None):
+        cur.execute("INSERT INTO change_log (source, kind, card_number) VALUES (?, ?, ?)",
+                    (self.source, kind, card_number))
+        if cur.lastrowid % 1000 == 0:
+            cur.execute("DELETE FROM change_log WHERE id <= ?", (cur.lastrowid - CHANGE_LOG_SIZE,))
+
+    def _log_changes(self, cur, kind, card_numbers):
+        """Запись нескольких изменений одного вида"""
+        cur.executemany("INSERT INTO change_log (source, kind, card_number) VALUES (?, ?, ?)",
+                        ((self.source, kind, number) for number in card_numbers))
+        last = cur.execute("SELECT MAX(id) FROM change_log").fetchone()[0]
+        cur.execute("DELETE FROM change_log WHERE id <= ?", (last - CHANGE_LOG_SIZE,))
+
+    def poll_changes(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT id, source, kind, card_number FROM change_log "
+                                     "WHERE id > ? ORDER BY id", (self._last_change,)).fetchall()
+            if not rows:
+                return []
+            # Пропуск номеров - нужные записи уже удалены из change_log
+            missed = rows[0][0] > self._last_change + 1 and self._last_change > 0
+            self._last_change = rows[-1][0]
+        if missed:
+            return [(DATA_RELOADED, None)]
+        return [(kind, card_number) for _, source, kind, card_number in rows if source != self.source]
+
+    def batch(self):
+        """Группа изменений в одной транзакции SQLite"""
+        return self._write()
+
+    def save_data(self):
+        """Изменения фиксируются сразу; здесь только перенос WAL в основной файл"""
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def replace_all(self, cards, transactions):
+        with self._write() as cur:
+            cur.execute("DELETE FROM transaction_terms")
+            cur.execute("DELETE FROM card_terms")
+            cur.execute("DELETE FROM transactions")
+            cur.execute("DELETE FROM balances")
+            cur.execute("DELETE FROM cards")
+            cur.executemany(INSERT_CARD, ((number, json.dumps(card)) for number, card in cards.items()))
+            for card in cards.values():
+                cur.executemany(INSERT_CARD_TERM, card_term_rows(card))
+            for card_number, items in transactions.items():
+                self._insert_transactions(cur, card_number, items)
+            self._log_change(cur, DATA_RELOADED)
+
+    def _insert_transactions(self, cur, card_number, items):
+        """Пакетная вставка транзакций карты с обновлением баланса и таблицы слов.
+        Номера строк задаются явно, чтобы связать с ними слова описаний"""
+        next_id = cur.execute("SELECT COALESCE(MAX(id), 0) FROM transactions").fetchone()[0] + 1
+        total = 0
+        batch = []
+        parsed = {}
+        for trans in items:
+            row = (next_id,) + transaction_row(card_number, trans)
+            next_id += 1
+            total += row[4]
+            batch.append(row)
+            if len(batch) >= BATCH_SIZE:
+                self._insert_batch(cur, batch, parsed)
+                batch = []
+        if batch:
+            self._insert_batch(cur, batch, parsed)
+        cur.execute(ADD_BALANCE, (card_number, total))
+
+    def _insert_batch(self, cur, rows, parsed):
+        cur.executemany(INSERT_TRANSACTION_ID, rows)
+        self._insert_terms(cur, [(row[0], row[6]) for row in rows], parsed)
+
+    def get_cards(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT data FROM cards ORDER BY rowid").fetchall()
+        return [json.loads(data) for data, in rows]
+
+    def get_card(self, card_number):
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM cards WHERE number = ?", (card_number,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_card(self, card_data):
+        with self._write() as cur:
+            try:
+                cur.execute(INSERT_CARD, (card_data['number'], json.dumps(card_data)))
+            except sqlite3.IntegrityError:
+                raise ValueError("Карта с таким номером уже существует")
+            cur.executemany(INSERT_CARD_TERM, card_term_rows(card_data))
+            self._log_change(cur, CARD_ADDED, card_data['number'])
+
+    def add_cards(self, cards):
+        cards = list(cards)
+        with self._write() as cur:
+            try:
+                cur.executemany(INSERT_CARD, ((card['number'], json.dumps(card)) for card in cards))
+            except sqlite3.IntegrityError:
+                raise ValueError("Карта с таким номером уже существует")
+            cur.executemany(INSERT_CARD_TERM, (row for card in cards for row in card_term_rows(card)))
+            self._log_changes(cur, CARD_ADDED, [card['number'] for card in cards])
+
+    def update_card(self, card_data):
+        with self._write() as cur:
+            # UPDATE сохраняет rowid, чтобы порядок карт не менялся
+            cur.execute("UPDATE cards SET data = ? WHERE number = ?",
+                        (json.dumps(card_data), card_data['number']))
+            if cur.rowcount == 0:
+                cur.execute(UPSERT_CARD, (card_data['number'], json.dumps(card_data)))
+            cur.execute("DELETE FROM card_terms WHERE card_number = ?", (card_data['number'],))
+            cur.executemany(INSERT_CARD_TERM, card_term_rows(card_data))
+            self._log_change(cur, CARD_UPDATED, card_data['number'])
+
+    def delete_card(self, card_number):
+        with self._write() as cur:
+            cur.execute("DELETE FROM cards WHERE number = ?", (card_number,))
+            if cur.rowcount:
+                cur.execute("DELETE FROM card_terms WHERE card_number = ?", (card_number,))
+                cur.execute("DELETE FROM transaction_terms WHERE transaction_id IN "
+                            "(SELECT id FROM transactions WHERE card_number = ?)", (card_number,))
+                cur.execute("DELETE FROM transactions WHERE card_number = ?", (card_number,))
+                cur.execute("DELETE FROM balances WHERE card_number = ?", (card_number,))
+                self._log_change(cur, CARD_DELETED, card_number)
+
+    def _select(self, card_numbers, filters):
+        """Построение запроса по фильтрам; порядок как у TransactionIndex: дата, карта, добавление"""
+        args = query_args(filters)
+        where, params = [], []
+        if card_numbers is not None:
+            where.append(f"card_number IN ({', '.join('?' * len(card_numbers))})")
+            params.extend(card_numbers)
+        if args['date_from']:
+            where.append("date >= ?")
+            params.append(args['date_from'])
+        if args['date_to']:
+            where.append("date <= ?")
+            params.append(args['date_to'])
+        if args['category']:
+            where.append("category = ?")
+            params.append(args['category'])
+        if args['text']:
+            # Каждое слово запроса - в описании или в имени держателя карты
+            for word in dict.fromkeys(tokenize(args['text'])):
+                where.append(TEXT_CONDITION)
+                params.extend([word, word + '\uffff'] * 2)
+        sql = " WHERE " + " AND ".join(where) if where else ""
+        return sql, params, args
+
+    def get_transactions(self, card_number, filters=None):
+        if not has_filters(filters):
+            with self._lock:
+                rows = self.conn.execute(f"SELECT {TRANSACTION_COLUMNS} FROM transactions "
+                                         "WHERE card_number = ? ORDER BY id", (card_number,)).fetchall()
+            return [row_to_transaction(row) for row in rows]
+        return [row_to_transaction(row) for row in self._query_rows(filters, [card_number])]
+
+    def _query_rows(self, filters, card_numbers):
+        where, params, args = self._select(card_numbers, filters)
+        direction = "DESC" if args['descending'] else "ASC"
+        order = [f"date {direction}", f"card_number {direction}", f"id {direction}"]
+        if args['sort_by'] in SORT_COLUMNS:
+            order.insert(0, f"{SORT_COLUMNS[args['sort_by']]} {direction}")
+        sql = f"SELECT {TRANSACTION_COLUMNS} FROM transactions{where} ORDER BY {', '.join(order)}"
+        if args['limit'] is not None or args['offset']:
+            sql += " LIMIT ? OFFSET ?"
+            params += [-1 if args['limit'] is None else args['limit'], args['offset']]
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def query_transactions(self, filters=None, card_numbers=None):
+        return [dict(row_to_transaction(row), card_number=row[0])
+                for row in self._query_rows(filters or {}, card_numbers)]
+
+    def iter_transactions(self, card_numbers=None, filters=None):
+        """Чтение через отдельное соединение: в WAL оно видит согласованный снимок
+        и не блокирует запись на время выгрузки"""
+        where, params, _ = self._select(card_numbers, filters or {})
+        conn = sqlite3.connect(self.path)
+        try:
+            cursor = conn.execute(f"SELECT {TRANSACTION_COLUMNS} FROM transactions{where} "
+                                  "ORDER BY date, card_number, id", params)
+            while True:
+                rows = cursor.fetchmany(BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row[0], row_to_transaction(row)
+        finally:
+            conn.close()
+
+    def count_transactions(self, card_number=None, filters=None):
+        where, params, _ = self._select(None if card_number is None else [card_number], filters or {})
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM transactions{where}", params).fetchone()[0]
+
+    def add_transaction(self, card_number, transaction):
+        with self._write() as cur:
+            row = transaction_row(card_number, transaction)
+            cur.execute(INSERT_TRANSACTION, row)
+            self._insert_terms(cur, [(cur.lastrowid, row[5])])
+            cur.execute(ADD_BALANCE, (card_number, row[3]))
+            self._log_change(cur, TRANSACTION_ADDED, card_number)
+
+    def add_transactions(self, card_number, transactions):
+        with self._write() as cur:
+            self._insert_transactions(cur, card_number, transactions)
+            self._log_change(cur, TRANSACTION_ADDED, card_number)
+
+    def get_card_balance(self, card_number):
+        with self._lock:
+            row = self.conn.execute("SELECT minor FROM balances WHERE card_number = ?",
+                                    (card_number,)).fetchone()
+        return from_minor(row[0] if row else 0)
+
+    def verify_balances(self, repair=False):
+        drift = {}
+        with self._write() as cur:
+            rows = cur.execute(
+                "SELECT b.card_number, b.minor, t.minor FROM balances b LEFT JOIN "
+                "(SELECT card_number, SUM(amount_minor) AS minor FROM transactions GROUP BY card_number) t "
+                "ON t.card_number = b.card_number "
+                "UNION ALL "
+                "SELECT t.card_number, NULL, SUM(t.amount_minor) FROM transactions t "
+                "WHERE t.card_number NOT IN (SELECT card_number FROM balances) GROUP BY t.card_number"
+            ).fetchall()
+            for number, cached, actual in rows:
+                cached, actual = cached or 0, actual or 0
+                if cached != actual:
+                    drift[number] = (from_minor(cached), from_minor(actual))
+                    if repair:
+                        cur.execute("INSERT OR REPLACE INTO balances (card_number, minor) VALUES (?, ?)",
+                                    (number, actual))
+        return drift
+
+    def close(self):
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+
+
+class _WriteTransaction:
+    """Контекст записи: блокировка соединения и BEGIN IMMEDIATE ... COMMIT/ROLLBACK.
+    Вложенная запись (внутри batch) выполняется в SAVEPOINT"""
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __enter__(self):
+        self.storage._lock.acquire()
+        self.cursor = self.storage.conn.cursor()
+        self.nested = self.storage._write_depth > 0
+        try:
+            self.cursor.execute("SAVEPOINT write" if self.nested else "BEGIN IMMEDIATE")
+        except BaseException:
+            self.storage._lock.release()
+            raise
+        self.storage._write_depth += 1
+        return self.cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        self.storage._write_depth -= 1
+        try:
+            if self.nested:
+                if exc_type:
+                    self.cursor.execute("ROLLBACK TO write")
+                self.cursor.execute("RELEASE write")
+            else:
+                self.cursor.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.storage._lock.release()
+        return False
@@ -0,0 +1,750 @@
+import json
+import os
+import threading
+from contextlib import contextmanager
+from instrumentation import span
+from journal import FileLock, Journal, write_json_atomic
+from money import to_minor, from_minor
+from query import TransactionIndex, SORT_FIELDS
+from columnar import CompactTransactions
+from lazy_history import LazyTransactions, read_index, write_snapshot, fingerprint
+from search import TextIndex, match_text, read_index as read_search_index, write_index as write_search_index
+from archive import Archive, archive_dir
+from events import CARD_ADDED, CARD_UPDATED, CARD_DELETED, TRANSACTION_ADDED, DATA_RELOADED
+
+# Ключи фильтра, при которых get_transactions выполняет запрос, а не отдает весь список
+FILTER_KEYS = ('date_from', 'date_to', 'category', 'offset', 'limit', 'order', 'sort_by', 'text', 'archived')
+
+
+# Вид события для записи журнала, примененной из другого процесса
+RECORD_EVENTS = {
+    'add_card': CARD_ADDED,
+    'update_card': CARD_UPDATED,
+    'delete_card': CARD_DELETED,
+    'add_transaction': TRANSACTION_ADDED,
+    'add_transactions': TRANSACTION_ADDED,
+}
+# Сколько внешних изменений копить до опроса; дальше - одно событие перезагрузки
+MAX_EXTERNAL_EVENTS = 10000
+
+# Ключи постраничного чтения и сортировки (их обслуживает TransactionIndex)
+PAGING_KEYS = ('offset', 'limit', 'order', 'sort_by')
+
+
+def query_args(filters):
+    """Разбор словаря фильтров (формат FilterDialog.get_filter_data + пагинация).
+    text - слова для поиска по описанию и имени держателя карты (по префиксу).
+    Ключ archived (с архивными транзакциями) разбирает само хранилище"""
+    return {
+        'date_from': filters.get('date_from'),
+        'date_to': filters.get('date_to'),
+        'category': filters.get('category') or None,
+        'text': filters.get('text') or None,
+        'offset': filters.get('offset') or 0,
+        'limit': filters.get('limit'),
+        'descending': filters.get('order') == 'desc',
+        'sort_by': filters.get('sort_by')
+    }
+
+
+def has_filters(filters):
+    return bool(filters) and any(filters.get(key) for key in FILTER_KEYS)
+
+
+class Storage:
+    """Интерфейс хранилища карт и транзакций.
+    DataManager только делегирует вызовы, поэтому поведение одинаково для всех реализаций"""
+
+    # True, если при открытии хранилища данных еще не было
+    is_new = False
+
+    def load(self, progress=None):
+        """Загрузка данных; progress(выполнено, всего) вызывается по этапам"""
+        raise NotImplementedError
+
+    def save_data(self):
+        raise NotImplementedError
+
+    @contextmanager
+    def batch(self):
+        """Группа изменений с одной фиксацией на диске в конце"""
+        yield
+
+    def replace_all(self, cards, transactions):
+        """Полная замена данных (тестовые данные, миграция)"""
+        raise NotImplementedError
+
+    def get_cards(self):
+        raise NotImplementedError
+
+    def get_card(self, card_number):
+        raise NotImplementedError
+
+    def add_card(self, card_data):
+        raise NotImplementedError
+
+    def add_cards(self, cards):
+        """Добавление нескольких карт одной операцией"""
+        with self.batch():
+            for card_data in cards:
+                self.add_card(card_data)
+
+    def update_card(self, card_data):
+        raise NotImplementedError
+
+    def delete_card(self, card_number):
+        raise NotImplementedError
+
+    def get_transactions(self, card_number, filters=None):
+        raise NotImplementedError
+
+    def query_transactions(self, filters=None, card_numbers=None):
+        raise NotImplementedError
+
+    def count_transactions(self, card_number=None, filters=None):
+        raise NotImplementedError
+
+    def iter_transactions(self, card_numbers=None, filters=None):
+        """Генератор пар (номер карты, транзакция) в порядке даты без загрузки всей истории"""
+        raise NotImplementedError
+
+    def add_transaction(self, card_number, transaction):
+        raise NotImplementedError
+
+    def add_transactions(self, card_number, transactions):
+        """Добавление списка транзакций карты одной операцией"""
+        for transaction in transactions:
+            self.add_transaction(card_number, transaction)
+
+    def get_card_balance(self, card_number):
+        raise NotImplementedError
+
+    def poll_changes(self):
+        """Изменения, сделанные другими процессами с прошлого вызова:
+        список (вид события, номер карты)"""
+        return []
+
+    def preload(self, limit=None):
+        """Дочитывание отложенных историй карт (не больше limit за вызов).
+        Возвращает, сколько историй еще не прочитано"""
+        return 0
+
+    def archive(self, before):
+        """Перенос транзакций раньше даты before в архив; возвращает, сколько перенесено.
+        Хранилищам, которые не держат историю в памяти (SQLite), архив не нужен"""
+        return 0
+
+    def verify_balances(self, repair=False):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonStorage(Storage):
+    """Хранилище в JSON-файлах: снимок cards.json / transactions.json + журнал операций.
+    Каталог может быть общим для нескольких процессов: запись идет под блокировкой
+    journal.log.lock, перед ней дочитываются чужие записи журнала"""
+
+    def __init__(self, cards_file="cards.json", transactions_file="transactions.json",
+                 journal_file="journal.log", compact=False):
+        self.cards_file = cards_file
+        self.transactions_file = transactions_file
+        self.journal_file = journal_file
+        # После скольких записей в журнале запускать фоновое сжатие
+        self.compact_threshold = 5000
+        # Хранить историю в колонках (columnar.CompactTransactions) вместо списков словарей
+        self.compact_columns = compact
+
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(journal_file + ".lock")
+        # Сжатие (запись снимка) выполняет только один процесс
+        self._compact_lock = FileLock(journal_file + ".compact.lock")
+        self._compaction = None
+        # Внутри batch(): записи, ждущие фиксации, и данные для отката в памяти
+        self._pending = None
+        self._undo = None
+        self._external = []
+        self.journal = None
+        # Отпечатки снимка и снимка, для которого на диске записан поисковый индекс
+        self._snapshot = None
+        self._search_saved = None
+        # Старые транзакции в сжатых сегментах, см. archive.Archive
+        self.archive_store = Archive(archive_dir(transactions_file))
+
+        # Проверяем существование обоих файлов (или журнала операций)
+        self.is_new = not ((os.path.exists(self.cards_file) and os.path.exists(self.transactions_file))
+                           or os.path.exists(self.journal_file))
+
+    def load(self, progress=None):
+        """Загрузка снимка из файлов и воспроизведение журнала"""
+        with self._lock, self._file_lock:
+            self._wait_compaction()
+            # Пока другой процесс пишет снимок, его не читаем
+            with self._compact_lock:
+                indexed = self._read_snapshot(progress)
+                # Прошлое сжатие прервалось - дописываем снимок сразу
+                interrupted = os.path.exists(self.journal.rotated_path)
+                if interrupted:
+                    self.save_data()
+            if not interrupted and self.journal.records >= self.compact_threshold:
+                self.compact()
+            elif not interrupted and indexed is None and os.path.exists(self.transactions_file):
+                # Снимок старого формата: индекс появится после сжатия в фоне
+                self.compact()
+            self.journal.close()
+
+    def _read_snapshot(self, progress=None):
+        """Чтение снимка и журнала (под обеими блокировками); возвращает индекс смещений или None"""
+        report = progress or (lambda done, total: None)
+        report(0, 4)
+        if os.path.exists(self.cards_file):
+            with open(self.cards_file, 'r') as f, span('storage.parse_cards'):
+                self.cards = json.load(f)
+        else:
+            self.cards = {}
+        report(1, 4)
+
+        # С индексом смещений история карты читается при первом обращении,
+        # а балансы берутся из сводки индекса
+        indexed = None
+        if os.path.exists(self.transactions_file):
+            indexed = read_index(self.transactions_file)
+            if indexed is None:
+                with open(self.transactions_file, 'r') as f, span('storage.parse_transactions'):
+                    self.transactions = self._container(json.load(f))
+        else:
+            self.transactions = self._container({})
+        self._snapshot = fingerprint(self.transactions_file)
+        self.archive_store.load(self._snapshot)
+        report(2, 4)
+
+        if indexed is not None:
+            stored, self.balances = indexed
+            self.transactions = LazyTransactions(stored, self._container({}))
+            self.index = TransactionIndex(self.transactions)
+            self.text_index = TextIndex(self.cards, self.transactions)
+        else:
+            self._reset_aggregates()
+        # Поисковый индекс, записанный вместе со снимком; журнал дополнит его ниже
+        postings = read_search_index(self.transactions_file, self._snapshot)
+        if postings is not None:
+            self.text_index.load(postings)
+        self._search_saved = self._snapshot if postings is not None else None
+        report(3, 4)
+
+        fsync = True
+        if self.journal is not None:
+            fsync = self.journal.fsync
+            self.journal.close()
+        self.journal = Journal(self.journal_file, fsync)
+        with span('storage.replay_journal'):
+            for record in self.journal.replay():
+                self._apply(record)
+        report(4, 4)
+        return indexed
+
+    @contextmanager
+    def _writing(self):
+        """Запись под блокировками потока и файла; сначала применяются чужие записи журнала"""
+        with self._lock, self._file_lock:
+            try:
+                self._catch_up()
+                yield
+            finally:
+                # Файл журнала открыт только под блокировкой (на Windows его иначе не переименовать)
+                if self._file_lock.depth == 1:
+                    self.journal.close()
+
+    def _catch_up(self):
+        records = self.journal.read_new()
+        if records is None:
+            # Другой процесс свернул журнал в снимок - перечитываем (истории лениво)
+            self._wait_compaction()
+            with self._compact_lock:
+                self._read_snapshot()
+            self._external = [(DATA_RELOADED, None)]
+            return
+        for record in records:
+            self._apply(record)
+            number = record['card']['number'] if 'card' in record else record['number']
+            self._external.append((RECORD_EVENTS[record['op']], number))
+        if len(self._external) > MAX_EXTERNAL_EVENTS:
+            self._external = [(DATA_RELOADED, None)]
+
+    def poll_changes(self):
+        if self.journal is None:
+            return []
+        with self._lock:
+            if self.journal.changed():
+                with self._writing():
+                    pass
+            events, self._external = self._external, []
+        return events
+
+    def _container(self, transactions):
+        return CompactTransactions(transactions) if self.compact_columns else transactions
+
+    def _reset_aggregates(self):
+        with span('storage.balances', cards=len(self.transactions)):
+            self.balances = {number: self._compute_balance(number) for number in self.transactions}
+            self.index = TransactionIndex(self.transactions)
+            self.text_index = TextIndex(self.cards, self.transactions)
+
+    def save_data(self):
+        """Синхронная запись полного снимка и очистка журнала"""
+        with self._writing():
+            self._wait_compaction()
+            with self._compact_lock:
+                self._write_snapshot(*self._begin_snapshot())
+
+    def replace_all(self, cards, transactions):
+        with self._writing():
+            self._wait_compaction()
+            self.cards = cards
+            self.transactions = self._container(transactions)
+            self.archive_store.cards = {}
+            self._reset_aggregates()
+            self.save_data()
+
+    @contextmanager
+    def batch(self):
+        """Группа изменений: записи копятся в памяти и в конце пишутся в журнал одной группой
+        (begin ... commit) с одним fsync. При исключении изменения в памяти откатываются,
+        во вложенной группе - только ее собственные"""
+        with self._writing():
+            outer = self._pending is None
+            if outer:
+                self._pending, self._undo = [], []
+            mark = len(self._pending), len(self._undo)
+            try:
+                yield
+                if outer and self._pending:
+                    self.journal.append_batch(self._pending)
+            except BaseException:
+                self._rollback(*mark)
+                if outer:
+                    self._pending = self._undo = None
+                raise
+            if outer:
+                self._pending = self._undo = None
+                if self.journal.records >= self.compact_threshold:
+                    self.compact()
+
+    def _undo_entry(self, record):
+        """Состояние в памяти, которое затронет запись (для отката)"""
+        op = record['op']
+        if op in ('add_card', 'update_card'):
+            number = record['card']['number']
+            return op, number, self.cards.get(number)
+        number = record['number']
+        if op == 'delete_card':
+            # Непрочитанная история сохраняется как StoredHistory, без разбора
+            if isinstance(self.transactions, LazyTransactions):
+                items = self.transactions.raw(number)
+            else:
+                items = self.transactions.get(number)
+            # Место карты в списке: после отката она возвращается туда же
+            place = list(self.cards).index(number) if number in self.cards else None
+            return op, number, (self.cards.get(number), place, items, self.balances.get(number),
+                                self.archive_store.cards.get(number))
+        length = len(self.transactions[number]) if number in self.transactions else None
+        return op, number, (length, self.balances.get(number))
+
+    def _rollback(self, pending_mark, undo_mark):
+        touched = set()
+        for op, number, saved in reversed(self._undo[undo_mark:]):
+            touched.add(number)
+            if op in ('add_card', 'update_card'):
+                _restore(self.cards, number, saved)
+            elif op == 'delete_card':
+                card, place, items, balance, archived = saved
+                if card is not None:
+                    _insert(self.cards, number, card, place)
+                if items is not None:
+                    self.transactions[number] = items
+                _restore(self.balances, number, balance)
+                self.archive_store.restore(number, archived)
+            else:
+                length, balance = saved
+                if length is None:
+                    self.transactions.pop(number, None)
+                else:
+                    items = self.transactions[number]
+                    if hasattr(items, 'truncate'):
+                        items.truncate(length)
+                    else:
+                        del items[length:]
+                _restore(self.balances, number, balance)
+            self.index.drop(number)
+        for number in touched:
+            self.text_index.reindex(number)
+        del self._undo[undo_mark:]
+        del self._pending[pending_mark:]
+
+    def compact(self):
+        """Фоновое сжатие: журнал сворачивается в снимок в отдельном потоке.
+        Если снимок сейчас пишет другой процесс, сжатие пропускается"""
+        with self._writing():
+            if self._compaction is not None and self._compaction.is_alive():
+                return
+            self._wait_compaction()
+            if not self._compact_lock.acquire(blocking=False):
+                return
+            try:
+                args = self._begin_snapshot()
+            except BaseException:
+                self._compact_lock.release()
+                raise
+            self._compaction = threading.Thread(target=self._compact_in_background,
+                                                args=args, daemon=True)
+            self._compaction.start()
+
+    def _compact_in_background(self, *args):
+        try:
+            self._write_snapshot(*args)
+        finally:
+            self._compact_lock.release()
+
+    def _wait_compaction(self):
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _flush_pending(self):
+        if self._pending:
+            # Снимок внутри batch(): накопленное фиксируется до него и больше не откатывается
+            self.journal.append_batch(self._pending)
+            self._pending.clear()
+            self._undo.clear()
+
+    def _begin_snapshot(self):
+        """Ротация журнала и копия состояния (вызывается под блокировкой)"""
+        self._flush_pending()
+        self.journal.rotate()
+        # Транзакции не изменяются после добавления, достаточно копий списков
+        cards = dict(self.cards)
+        if isinstance(self.transactions, LazyTransactions):
+            # Непрочитанные истории копируются из старого снимка без разбора
+            transactions = self.transactions.snapshot_items()
+        else:
+            transactions = {number: list(items) for number, items in self.transactions.items()}
+        lazy = self.transactions if isinstance(self.transactions, LazyTransactions) else None
+        return (cards, transactions, dict(self.balances), lazy, self.text_index.snapshot(),
+                self.archive_store.snapshot())
+
+    def _write_snapshot(self, cards, transactions, balances, lazy, postings, archived):
+        with span('storage.write_snapshot', cards=len(cards)):
+            write_json_atomic(self.cards_file, cards)
+            if archived is not None:
+                # Отпечаток заменяемого файла: до замены на диске действует прежний архив
+                self.archive_store.prepare(archived, fingerprint(self.transactions_file))
+            self._snapshot = write_snapshot(self.transactions_file, transactions, balances, lazy)
+            if archived is not None:
+                self.archive_store.commit(archived, self._snapshot)
+            if postings is not None:
+                write_search_index(self.transactions_file, self._snapshot, postings)
+                self._search_saved = self._snapshot
+        self.journal.drop_rotated()
+
+    def archive(self, before):
+        """Перенос в архив начала истории каждой карты - транзакций раньше даты before
+        (до первой более новой в порядке добавления) - и запись снимка без них"""
+        with self._writing():
+            self._wait_compaction()
+            with self._compact_lock:
+                self._flush_pending()
+                moved = 0
+                for number in list(self.transactions):
+                    items = self.transactions[number]
+                    count = 0
+                    while count < len(items) and items[count]['date'] < before:
+                        count += 1
+                    if not count:
+                        continue
+                    self.archive_store.store(number, [items[pos] for pos in range(count)], before)
+                    self.transactions[number] = [items[pos] for pos in range(count, len(items))]
+                    self.index.drop(number)
+                    self.text_index.reindex(number)
+                    moved += count
+                if moved:
+                    self._write_snapshot(*self._begin_snapshot())
+                return moved
+
+    def _save_search_index(self):
+        """Запись поискового индекса, построенного после чтения снимка, чтобы при следующем
+        запуске не строить его заново. Позиции из журнала безопасны: при воспроизведении
+        журнала повторно они не добавляются"""
+        if (not self.text_index.built or self._snapshot is None or self._pending is not None
+                or self._search_saved == self._snapshot):
+            return
+        if not self._compact_lock.acquire(blocking=False):
+            return
+        try:
+            # Другой процесс мог уже заменить снимок - тогда индекс к нему не относится
+            if fingerprint(self.transactions_file) == self._snapshot:
+                write_search_index(self.transactions_file, self._snapshot, self.text_index.snapshot())
+                self._search_saved = self._snapshot
+        finally:
+            self._compact_lock.release()
+
+    def _commit(self, record):
+        """Запись операции в журнал и применение к данным в памяти"""
+        if self._pending is not None:
+            # Внутри batch(): в журнал при выходе из группы
+            self._undo.append(self._undo_entry(record))
+            self._apply(record)
+            self._pending.append(record)
+            return
+        self.journal.append(record)
+        self._apply(record)
+        if self.journal.records >= self.compact_threshold:
+            self.compact()
+
+    def _apply(self, record):
+        """Применение записи журнала к данным в памяти (идемпотентно)"""
+        op = record['op']
+        if op in ('add_card', 'update_card'):
+            self.cards[record['card']['number']] = record['card']
+            self.text_index.set_card(record['card'])
+        elif op == 'delete_card':
+            self.cards.pop(record['number'], None)
+            # del, а не pop: pop прочитал бы отложенную историю карты
+            if record['number'] in self.transactions:
+                del self.transactions[record['number']]
+            self.balances.pop(record['number'], None)
+            self.index.drop(record['number'])
+            self.text_index.drop(record['number'])
+            self.archive_store.drop(record['number'])
+        elif op in ('add_transaction', 'add_transactions'):
+            number = record['number']
+            items = record['transactions'] if op == 'add_transactions' else [record['transaction']]
+            transactions = self.transactions.setdefault(number, [])
+            # Записи уже попали в снимок, если список длиннее позиции
+            # (позиция считается вместе с архивными транзакциями карты)
+            known = self.archive_store.base(number) + len(transactions)
+            for trans in items[max(0, known - record['pos']):]:
+                transactions.append(trans)
+                self.balances[number] = self.balances.get(number, 0) + to_minor(trans['amount'])
+                self.index.add(number, len(transactions) - 1)
+                self.text_index.add(number, len(transactions) - 1)
+
+    def get_cards(self):
+        return list(self.cards.values())
+
+    def get_card(self, card_number):
+        return self.cards.get(card_number)
+
+    def add_card(self, card_data):
+        with self._writing():
+            if card_data['number'] in self.cards:
+                raise ValueError("Карта с таким номером уже существует")
+            self._commit({'op': 'add_card', 'card': card_data})
+
+    def add_cards(self, cards):
+        """Проверка номеров до изменений и одна группа записей журнала"""
+        with self.batch():
+            numbers = set()
+            for card_data in cards:
+                if card_data['number'] in self.cards or card_data['number'] in numbers:
+                    raise ValueError("Карта с таким номером уже существует")
+                numbers.add(card_data['number'])
+            for card_data in cards:
+                self._commit({'op': 'add_card', 'card': card_data})
+
+    def update_card(self, card_data):
+        with self._writing():
+            self._commit({'op': 'update_card', 'card': card_data})
+
+    def delete_card(self, card_number):
+        with self._writing():
+            if card_number in self.cards:
+                self._commit({'op': 'delete_card', 'number': card_number})
+
+    def _index_args(self, filters):
+        """Аргументы TransactionIndex: текст запроса заменяется результатом поиска
+        по TextIndex (вызывается под блокировкой)"""
+        args = query_args(filters)
+        text = args.pop('text')
+        args['matched'] = self.text_index.search(text) if text else None
+        return args
+
+    def _uses_archive(self, card_numbers, filters):
+        """Нужен ли архив: явно (archived), дата начала раньше границы архива карт
+        или ее нет при фильтре по дате окончания, категории или тексту.
+        Без этих фильтров (весь список, страницы) читаются только живые транзакции"""
+        if not filters or not self.archive_store.cards:
+            return False
+        if filters.get('archived'):
+            return True
+        if not (filters.get('date_from') or filters.get('date_to') or filters.get('category')
+                or filters.get('text')):
+            return False
+        return self.archive_store.covers(card_numbers, filters.get('date_from'))
+
+    def _archived_query(self, card_numbers, filters):
+        """Выборка вместе с архивом (под блокировкой): список (номер карты, транзакция)
+        в том же порядке, что дает TransactionIndex.query"""
+        args = self._index_args(filters)
+        selected = []
+        for card_number, keys in self.index.select(card_numbers, args['date_from'], args['date_to'],
+                                                   args['category'], args['matched']):
+            base = self.archive_store.base(card_number)
+            items = self.transactions[card_number]
+            selected.extend((date, card_number, base + pos, items[pos]) for date, pos in keys)
+        text = filters.get('text')
+        for card_number in list(self.archive_store.cards if card_numbers is None else card_numbers):
+            name = (self.cards.get(card_number) or {}).get('name', '')
+            for pos, trans in self.archive_store.read(card_number, args['date_from'], args['date_to']):
+                if args['category'] and trans['category'] != args['category']:
+                    continue
+                if text and not match_text(text, trans['description'], name):
+                    continue
+                selected.append((trans['date'], card_number, pos, trans))
+        selected.sort(key=lambda item: item[:3])
+        if args['sort_by'] in SORT_FIELDS:
+            value = SORT_FIELDS[args['sort_by']]
+            selected.sort(key=lambda item: value(item[3]))
+        if args['descending']:
+            selected.reverse()
+        stop = None if args['limit'] is None else args['offset'] + args['limit']
+        return [(card_number, trans) for _, card_number, _, trans in selected[args['offset']:stop]]
+
+    def get_transactions(self, card_number, filters=None):
+        if has_filters(filters):
+            with self._lock:
+                # Проверка под блокировкой: карту может удалить другой поток
+                if card_number not in self.transactions:
+                    return []
+                if self._uses_archive([card_number], filters):
+                    return [trans for _, trans in self._archived_query([card_number], filters)]
+                items = self.transactions[card_number]
+                if (hasattr(items, 'select') and not filters.get('text')
+                        and not any(filters.get(key) for key in PAGING_KEYS)):
+                    # Колоночное хранение: маска по датам и категории
+                    args = query_args(filters)
+                    return [items[pos] for pos in items.select(args['date_from'], args['date_to'],
+                                                               args['category'])]
+                return [trans for _, trans in self.index.query([card_number], **self._index_args(filters))]
+
+        return self.transactions.get(card_number, [])
+
+    def query_transactions(self, filters=None, card_numbers=None):
+        with self._lock:
+            if self._uses_archive(card_numbers, filters):
+                found = self._archived_query(card_numbers, filters)
+            else:
+                found = self.index.query(card_numbers, **self._index_args(filters or {}))
+        return [dict(trans, card_number=card_number) for card_number, trans in found]
+
+    def iter_transactions(self, card_numbers=None, filters=None):
+        with self._lock:
+            if self._uses_archive(card_numbers, filters):
+                # С архивом выборка собирается целиком
+                found = self._archived_query(card_numbers, dict(filters, offset=0, limit=None,
+                                                                order=None, sort_by=None))
+            else:
+                found = None
+        if found is not None:
+            yield from found
+            return
+        with self._lock:
+            args = self._index_args(filters or {})
+            pairs = self.index.iterate(card_numbers, args['date_from'], args['date_to'], args['category'],
+                                       args['matched'])
+            # Диапазоны ключей фиксируются при первом next(), под блокировкой
+            first = next(pairs, None)
+        if first is not None:
+            yield first
+            yield from pairs
+
+    def count_transactions(self, card_number=None, filters=None):
+        with self._lock:
+            card_numbers = None if card_number is None else [card_number]
+            if self._uses_archive(card_numbers, filters):
+                return len(self._archived_query(card_numbers, dict(filters, offset=0, limit=None)))
+            args = self._index_args(filters or {})
+            if (card_number is not None and isinstance(self.transactions, LazyTransactions)
+                    and not (args['date_from'] or args['date_to'] or args['category'])
+                    and args['matched'] is None):
+                return self.transactions.count(card_number)
+            return self.index.count(None if card_number is None else [card_number],
+                                    args['date_from'], args['date_to'], args['category'], args['matched'])
+
+    def add_transaction(self, card_number, transaction):
+        with self._writing():
+            self._commit({'op': 'add_transaction', 'number': card_number,
+                          'pos': self._length(card_number), 'transaction': transaction})
+
+    def add_transactions(self, card_number, transactions):
+        """Пачка транзакций - одна запись журнала"""
+        with self._writing():
+            self._commit({'op': 'add_transactions', 'number': card_number,
+                          'pos': self._length(card_number), 'transactions': list(transactions)})
+
+    def _length(self, card_number):
+        """Позиция следующей транзакции карты (с учетом архива)"""
+        return self.archive_store.base(card_number) + len(self.transactions.get(card_number, []))
+
+    def get_card_balance(self, card_number):
+        return from_minor(self.balances.get(card_number, 0))
+
+    def preload(self, limit=None):
+        if isinstance(self.transactions, LazyTransactions):
+            return self.transactions.preload(limit)
+        return 0
+
+    def _compute_balance(self, card_number):
+        """Пересчет баланса по истории операций (и входящему остатку архива), в копейках"""
+        items = self.transactions.get(card_number, [])
+        opening = self.archive_store.opening(card_number)
+        if hasattr(items, 'sum_minor'):
+            return opening + items.sum_minor()
+        return opening + sum(to_minor(trans['amount']) for trans in items)
+
+    def verify_balances(self, repair=False):
+        drift = {}
+        with self._lock:
+            for number in set(self.balances) | set(self.transactions):
+                cached = self.balances.get(number, 0)
+                actual = self._compute_balance(number)
+                if cached != actual:
+                    drift[number] = (from_minor(cached), from_minor(actual))
+                    if repair:
+                        self.balances[number] = actual
+        return drift
+
+    def close(self):
+        with self._lock:
+            self._wait_compaction()
+            if self.journal is not None:
+                self._save_search_index()
+                self.journal.close()
+
+
+def _insert(mapping, key, value, index):
+    """Возврат ключа на место index с сохранением порядка словаря (объект тот же)"""
+    items = list(mapping.items())
+    items.insert(index, (key, value))
+    mapping.clear()
+    mapping.update(items)
+
+
+def _restore(mapping, key, value):
+    if value is None:
+        mapping.pop(key, None)
+    else:
+        mapping[key] = value
+
+
+def open_storage(kind=None, path=None):
+    """Создание хранилища по имени: 'json' (по умолчанию) или 'sqlite'.
+    Без аргументов используются переменные окружения CARD_MANAGER_STORAGE и CARD_MANAGER_DB,
+    CARD_MANAGER_COMPACT=1 включает колоночное хранение истории для JSON"""
+    kind = kind or os.environ.get('CARD_MANAGER_STORAGE', 'json')
+    if kind == 'json':
+        return JsonStorage(compact=os.environ.get('CARD_MANAGER_COMPACT') == '1')
+    if kind == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(path or os.environ.get('CARD_MANAGER_DB', 'card_manager.db'))
+    raise ValueError(f"Неизвестный тип хранилища: {kind}")
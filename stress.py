@@ -0,0 +1,696 @@
+import argparse
+import copy
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from data_manager import DataManager
+from money import to_minor, from_minor
+from query import SORT_FIELDS
+from rollups import buckets
+from search import match_text
+from sqlite_storage import SqliteStorage
+from storage import JsonStorage, query_args, has_filters
+from synthetic import SPENDING, card_name
+from view_cache import CardViewCache
+
+# Хранилища, которые сверяются с эталоном; архив старых транзакций есть только у JSON
+VARIANTS = ('json', 'compact', 'sqlite')
+ARCHIVING = ('json', 'compact')
+# Доли операций в случайной последовательности
+DEFAULT_MIX = {
+    'add_card': 3, 'update_card': 2, 'delete_card': 1, 'add_transaction': 30,
+    'get_transactions': 20, 'query_transactions': 5, 'count_transactions': 5,
+    'iter_transactions': 2, 'get_card_balance': 15, 'get_cards': 2,
+    'save_data': 1, 'archive_transactions': 1, 'reload': 1,
+    'rollup_total': 5, 'rollup_series': 2, 'card_view': 5, 'batch': 2,
+}
+# Операции, затрагивающие все карты: в многопоточном режиме не выполняются,
+# потому что результат зависит от того, как потоки чередовались
+SHARED_OPS = ('get_cards', 'archive_transactions', 'reload')
+# Изменения внутри batch
+BATCH_OPS = ('add_card', 'update_card', 'delete_card', 'add_transaction')
+PERIODS = ('day', 'week', 'month')
+# Маленький кэш CardView, чтобы записи вытеснялись
+VIEW_CACHE_SIZE = 8
+# Маленький порог, чтобы фоновое сжатие журнала срабатывало во время прогона
+COMPACT_THRESHOLD = 200
+# Даты операций идут вперед (в среднем на день за DAY_STEP добавлений),
+# изредка добавляется задним числом
+FIRST_DAY = date(2023, 1, 1)
+DAY_STEP = 3
+CATEGORIES = [item[0] for item in SPENDING] + ['Пополнение']
+DESCRIPTIONS = [text for item in SPENDING for text in item[2]] + ['Зачисление зарплаты', 'Кофе с собой']
+# Слова для текстового поиска: начала слов описаний и имен держателей
+WORDS = ['такси', 'прод', 'кафе', 'зарпл', 'перевод друг', 'иван', 'мари', 'петров', 'ё', 'кофе']
+
+
+def make_storage(variant, directory):
+    if variant == 'sqlite':
+        storage = SqliteStorage(os.path.join(directory, 'card_manager.db'))
+    else:
+        storage = JsonStorage(os.path.join(directory, 'cards.json'),
+                              os.path.join(directory, 'transactions.json'),
+                              os.path.join(directory, 'journal.log'), compact=variant == 'compact')
+        storage.compact_threshold = COMPACT_THRESHOLD
+    # Прогон начинается с пустого хранилища, без тестовых данных create_sample_data
+    storage.is_new = False
+    return storage
+
+
+class Reference:
+    """Эталон для сверки: словари и списки без индексов, кэшей и файлов,
+    каждый запрос - полный проход по истории. Повторяет семантику DataManager,
+    в том числе архив (archives=True): начало истории карты с датами раньше границы
+    переносится и видно только запросам с archived, более ранней date_from или с фильтром
+    без date_from (date_to, category, text)"""
+
+    def __init__(self, archives=False):
+        self.archives = archives
+        self.cards = {}
+        self.live = {}        # номер карты -> [(позиция, транзакция)] в порядке добавления
+        self.archived = {}    # номер карты -> [(позиция, транзакция)] в архиве
+        self.before = {}      # номер карты -> граница архива
+
+    def merge(self, other):
+        """Объединение с эталоном другого потока (карты не пересекаются)"""
+        for name in ('cards', 'live', 'archived', 'before'):
+            getattr(self, name).update(getattr(other, name))
+
+    def get_cards(self):
+        return list(self.cards.values())
+
+    def add_card(self, card_data):
+        if card_data['number'] in self.cards:
+            raise ValueError("Карта с таким номером уже существует")
+        self.cards[card_data['number']] = card_data
+
+    def update_card(self, card_data):
+        self.cards[card_data['number']] = card_data
+
+    def delete_card(self, card_number):
+        if self.cards.pop(card_number, None) is not None:
+            for mapping in (self.live, self.archived, self.before):
+                mapping.pop(card_number, None)
+
+    def add_transaction(self, card_number, transaction):
+        items = self.live.setdefault(card_number, [])
+        items.append((len(self.archived.get(card_number, ())) + len(items), transaction))
+
+    def get_card_balance(self, card_number):
+        items = self.archived.get(card_number, []) + self.live.get(card_number, [])
+        return from_minor(sum(to_minor(trans['amount']) for _, trans in items))
+
+    def archive_transactions(self, before):
+        if not self.archives:
+            return 0
+        moved = 0
+        for number, items in self.live.items():
+            count = 0
+            while count < len(items) and items[count][1]['date'] < before:
+                count += 1
+            if count:
+                self.archived.setdefault(number, []).extend(items[:count])
+                self.before[number] = max(self.before.get(number, before), before)
+                del items[:count]
+                moved += count
+        return moved
+
+    def save_data(self):
+        pass
+
+    def batch(self, ops, fail):
+        """Группа изменений: все или ни одного; fail - исключение после последнего"""
+        saved = copy.deepcopy((self.cards, self.live, self.archived, self.before))
+        try:
+            for name, args in ops:
+                getattr(self, name)(*args)
+            if fail:
+                raise Rollback
+        except Exception as e:
+            self.cards, self.live, self.archived, self.before = saved
+            if not isinstance(e, Rollback):
+                raise
+
+    def card_view(self, card_number):
+        if card_number not in self.cards:
+            return None
+        return (self.cards[card_number]['name'], self.get_card_balance(card_number),
+                self.count_transactions(card_number))
+
+    def _days(self, card_number, category):
+        """(номер дня, сумма в копейках) всех транзакций, включая архив"""
+        numbers = list(self.cards) if card_number is None else [card_number]
+        return [(date.fromisoformat(trans['date']).toordinal(), to_minor(trans['amount']))
+                for number in numbers if number in self.cards
+                for _, trans in self.archived.get(number, []) + self.live.get(number, [])
+                if category is None or trans['category'] == category]
+
+    @staticmethod
+    def _row(days, first, last):
+        amounts = [minor for day, minor in days if first <= day <= last]
+        income = sum(minor for minor in amounts if minor > 0)
+        expense = sum(minor for minor in amounts if minor <= 0)
+        return {'income': from_minor(income), 'expense': from_minor(expense),
+                'total': from_minor(income + expense), 'count': len(amounts)}
+
+    def rollup_total(self, date_from=None, date_to=None, card_number=None, category=None):
+        first = date.fromisoformat(date_from).toordinal() if date_from else 1
+        last = date.fromisoformat(date_to).toordinal() if date_to else date.max.toordinal()
+        return self._row(self._days(card_number, category), first, last)
+
+    def rollup_series(self, period='month', date_from=None, date_to=None, card_number=None, category=None):
+        days = self._days(card_number, category)
+        if not days and not (date_from and date_to):
+            return []
+        first = date.fromisoformat(date_from).toordinal() if date_from else min(day for day, _ in days)
+        last = date.fromisoformat(date_to).toordinal() if date_to else max(day for day, _ in days)
+        rows = []
+        for start, end in buckets(period, first, last):
+            row = self._row(days, max(start, first), min(end, last))
+            row['period'] = date.fromordinal(start).isoformat()
+            rows.append(row)
+        return rows
+
+    def _select(self, card_numbers, filters):
+        """Пары (номер карты, транзакция) в порядке DataManager.query_transactions"""
+        args = query_args(filters)
+        numbers = list(self.cards) if card_numbers is None else card_numbers
+        date_from = args['date_from']
+        bounded = date_from or args['date_to'] or args['category'] or args['text']
+        archived = self.archives and (filters.get('archived') or bool(bounded) and any(
+            number in self.before and (not date_from or date_from < self.before[number])
+            for number in numbers))
+        selected = []
+        for number in dict.fromkeys(numbers):
+            if number not in self.cards:
+                continue
+            items = self.live.get(number, [])
+            if archived:
+                items = self.archived.get(number, []) + items
+            name = self.cards[number]['name']
+            for pos, trans in items:
+                if ((date_from and trans['date'] < date_from)
+                        or (args['date_to'] and trans['date'] > args['date_to'])
+                        or (args['category'] and trans['category'] != args['category'])
+                        or (args['text'] and not match_text(args['text'], trans['description'], name))):
+                    continue
+                selected.append((trans['date'], number, pos, trans))
+        selected.sort(key=lambda item: item[:3])
+        if args['sort_by'] in SORT_FIELDS:
+            value = SORT_FIELDS[args['sort_by']]
+            selected.sort(key=lambda item: value(item[3]))
+        if args['descending']:
+            selected.reverse()
+        stop = None if args['limit'] is None else args['offset'] + args['limit']
+        return [(number, trans) for _, number, _, trans in selected[args['offset']:stop]]
+
+    def get_transactions(self, card_number, filters=None):
+        if card_number not in self.cards:
+            return []
+        if not has_filters(filters):
+            return [trans for _, trans in self.live.get(card_number, [])]
+        return [trans for _, trans in self._select([card_number], filters)]
+
+    def query_transactions(self, filters=None, card_numbers=None):
+        return [dict(trans, card_number=number)
+                for number, trans in self._select(card_numbers, filters or {})]
+
+    def count_transactions(self, card_number=None, filters=None):
+        card_numbers = None if card_number is None else [card_number]
+        return len(self._select(card_numbers, dict(filters or {}, offset=0, limit=None)))
+
+    def iter_transactions(self, card_numbers=None, filters=None):
+        return iter(self._select(card_numbers, dict(filters or {}, offset=0, limit=None,
+                                                    order=None, sort_by=None)))
+
+
+class Rollback(Exception):
+    """Исключение внутри batch: изменения группы должны откатиться"""
+
+
+class Variant:
+    """DataManager варианта и кэш CardView над ним (как в главном окне)"""
+
+    def __init__(self, data_manager):
+        self.data_manager = data_manager
+        self.view_cache = CardViewCache(data_manager, maxsize=VIEW_CACHE_SIZE)
+
+    def __getattr__(self, name):
+        return getattr(self.data_manager, name)
+
+    def batch(self, ops, fail):
+        try:
+            with self.data_manager.batch():
+                for name, args in ops:
+                    getattr(self.data_manager, name)(*args)
+                if fail:
+                    raise Rollback
+        except Rollback:
+            pass
+
+    def card_view(self, card_number):
+        view = self.view_cache.get(card_number)
+        if view is None:
+            return None
+        return view.card['name'], view.balance, self.view_cache.transaction_count(card_number)
+
+
+class Mismatch(Exception):
+    """Расхождение варианта с эталоном"""
+
+    def __init__(self, variant, step, op, expected, actual):
+        self.variant = variant
+        self.step = step
+        self.op = op
+        super().__init__(f"{variant}: шаг {step}, {json.dumps(op, ensure_ascii=False)}\n"
+                         f"  эталон:  {_short(expected)}\n  вариант: {_short(actual)}")
+
+
+def _short(value, limit=600):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _transaction(trans):
+    return (trans['date'], to_minor(trans['amount']), trans['category'], trans['description'])
+
+
+def _normalize(name, result):
+    """Результат операции в виде, не зависящем от хранилища (суммы в копейках)"""
+    if name == 'get_transactions':
+        return [_transaction(trans) for trans in result]
+    if name == 'query_transactions':
+        return [(trans['card_number'],) + _transaction(trans) for trans in result]
+    if name == 'iter_transactions':
+        return [(number,) + _transaction(trans) for number, trans in result]
+    if name == 'get_cards':
+        return [(card['number'], card['name'], card['cvc']) for card in result]
+    if name == 'get_card_balance':
+        return str(result)
+    if name == 'rollup_total':
+        return _rollup_row(result)
+    if name == 'rollup_series':
+        return [(row['period'],) + _rollup_row(row) for row in result]
+    if name == 'card_view':
+        return result and (result[0], str(result[1]), result[2])
+    return result
+
+
+def _rollup_row(row):
+    return str(row['income']), str(row['expense']), str(row['total']), row['count']
+
+
+def execute(target, op):
+    """Выполнение операции [имя, аргументы] над DataManager или эталоном.
+    Ошибки ValueError входят в результат: эталон и вариант должны ошибаться одинаково"""
+    name, args = op
+    try:
+        return _normalize(name, getattr(target, name)(*copy.deepcopy(args)))
+    except ValueError as e:
+        return ('ValueError', str(e))
+
+
+class Generator:
+    """Случайная последовательность операций. Следующая операция зависит только от
+    предыдущих, поэтому первые N операций одинаковы при любой длине прогона.
+    prefix - начало номеров карт (у каждого потока свое); shared=False - без операций
+    над всеми картами (SHARED_OPS), запросы только по своим картам"""
+
+    def __init__(self, seed, mix=None, prefix='427600', shared=True):
+        self.rng = random.Random(seed)
+        mix = dict(mix or DEFAULT_MIX)
+        if not shared:
+            for name in SHARED_OPS:
+                mix.pop(name, None)
+        self.kinds = [name for name in mix if mix[name] > 0]
+        self.weights = [mix[name] for name in self.kinds]
+        self.prefix = prefix
+        self.shared = shared
+        self.numbers = []
+        self.deleted = []
+        self.issued = 0
+        self.days = 30      # сколько дней прошло с FIRST_DAY
+
+    def _day(self, ahead=30):
+        """Случайная дата от FIRST_DAY до текущей (плюс ahead дней)"""
+        return (FIRST_DAY + timedelta(days=self.rng.randrange(self.days + ahead))).isoformat()
+
+    def _card(self, number):
+        return {'number': number, 'name': card_name(self.rng), 'cvc': f"{self.rng.randrange(1000):03d}"}
+
+    def _number(self):
+        """Номер существующей карты; иногда - удаленной"""
+        if self.deleted and self.rng.random() < 0.05:
+            return self.rng.choice(self.deleted)
+        return self.rng.choice(self.numbers)
+
+    def _filters(self):
+        rng = self.rng
+        filters = {}
+        if rng.random() < 0.5:
+            filters['date_from'] = self._day()
+        if rng.random() < 0.3:
+            filters['date_to'] = self._day()
+        if rng.random() < 0.3:
+            filters['category'] = rng.choice(CATEGORIES)
+        if rng.random() < 0.15:
+            filters['text'] = rng.choice(WORDS)
+        if rng.random() < 0.2:
+            filters['order'] = 'desc'
+        if rng.random() < 0.15:
+            filters['sort_by'] = rng.choice(list(SORT_FIELDS))
+        if rng.random() < 0.2:
+            filters['offset'] = rng.randrange(5)
+        if rng.random() < 0.3:
+            filters['limit'] = rng.randrange(1, 20)
+        if rng.random() < 0.1:
+            filters['archived'] = True
+        return filters
+
+    def _card_numbers(self):
+        if self.shared and self.rng.random() < 0.6:
+            return None
+        return self.rng.sample(self.numbers, min(len(self.numbers), self.rng.randrange(1, 4)))
+
+    def next(self):
+        rng = self.rng
+        name = rng.choices(self.kinds, self.weights)[0] if len(self.numbers) >= 3 else 'add_card'
+        if name in BATCH_OPS:
+            return self._change(name)
+        return self._read(name)
+
+    def _change(self, name, duplicates=True):
+        rng = self.rng
+        if name == 'add_card':
+            if duplicates and self.numbers and rng.random() < 0.05:
+                # Повтор номера: оба должны отказать
+                return [name, [self._card(rng.choice(self.numbers))]]
+            if self.deleted and rng.random() < 0.2:
+                number = self.deleted.pop(rng.randrange(len(self.deleted)))
+            else:
+                self.issued += 1
+                number = f"{self.prefix}{self.issued:010d}"
+            self.numbers.append(number)
+            return [name, [self._card(number)]]
+        if name == 'update_card':
+            return [name, [self._card(rng.choice(self.numbers))]]
+        if name == 'delete_card':
+            number = self.numbers.pop(rng.randrange(len(self.numbers)))
+            self.deleted.append(number)
+            return [name, [number]]
+        if name == 'add_transaction':
+            self.days += rng.random() < 1 / DAY_STEP
+            if rng.random() < 0.05:
+                day = self._day(ahead=0)
+            else:
+                day = (FIRST_DAY + timedelta(days=self.days - rng.randrange(min(self.days, 10)))).isoformat()
+            return [name, [rng.choice(self.numbers), {
+                'date': day, 'amount': rng.randrange(-500000, 500000) / 100,
+                'category': rng.choice(CATEGORIES), 'description': rng.choice(DESCRIPTIONS)}]]
+
+    def _read(self, name):
+        rng = self.rng
+        if name == 'get_transactions':
+            return [name, [self._number(), self._filters() if rng.random() < 0.8 else None]]
+        if name in ('query_transactions', 'iter_transactions'):
+            filters, card_numbers = self._filters(), self._card_numbers()
+            args = [filters, card_numbers] if name == 'query_transactions' else [card_numbers, filters]
+            return [name, args]
+        if name == 'count_transactions':
+            number = self._number() if not self.shared or rng.random() < 0.5 else None
+            return [name, [number, self._filters()]]
+        if name == 'get_card_balance':
+            return [name, [self._number()]]
+        if name == 'archive_transactions':
+            return [name, [self._day(ahead=0)]]
+        if name in ('rollup_total', 'rollup_series'):
+            # Итоги по всем картам в многопоточном режиме не сверяются по ходу (см. run_threads)
+            number = None if rng.random() < 0.3 else self._number()
+            dates = [self._day() if rng.random() < 0.5 else None for _ in range(2)]
+            if name == 'rollup_series' and dates[0] and dates[1]:
+                dates.sort()
+            category = rng.choice(CATEGORIES) if rng.random() < 0.3 else None
+            args = dates + [number, category]
+            return [name, [rng.choice(PERIODS)] + args if name == 'rollup_series' else args]
+        if name == 'card_view':
+            return [name, [self._number()]]
+        if name == 'batch':
+            # Изменения группы, которая откатится, не меняют состояние генератора
+            saved = list(self.numbers), list(self.deleted)
+            ops = []
+            for _ in range(rng.randrange(1, 6)):
+                kind = rng.choice(BATCH_OPS) if len(self.numbers) > 1 else 'add_card'
+                ops.append(self._change(kind, duplicates=False))
+            fail = rng.random() < 0.5
+            if fail:
+                self.numbers, self.deleted = saved
+            return [name, [ops, fail]]
+        return [name, []]
+
+    def take(self, count):
+        return [self.next() for _ in range(count)]
+
+
+def _final_check(variant, data_manager, reference, step, ordered=True):
+    """Полная сверка состояния в конце прогона.
+    ordered=False - порядок карт не сравнивается (он зависит от чередования потоков)"""
+    checks = [['get_cards', []], ['count_transactions', [None, None]],
+              ['iter_transactions', [None, {'archived': True}]],
+              ['rollup_total', []], ['rollup_series', ['month']]]
+    for number in reference.cards:
+        checks.append(['get_transactions', [number, None]])
+        checks.append(['get_card_balance', [number]])
+        checks.append(['rollup_total', [None, None, number]])
+        checks.append(['card_view', [number]])
+    for op in checks:
+        expected, actual = execute(reference, op), execute(data_manager, op)
+        if op[0] == 'get_cards' and not ordered:
+            expected, actual = sorted(expected), sorted(actual)
+        if expected != actual:
+            raise Mismatch(variant, step, op, expected, actual)
+    drift = data_manager.verify_balances()
+    if drift:
+        raise Mismatch(variant, step, ['verify_balances', []], {}, drift)
+
+
+def run_sequence(variant, ops, directory):
+    """Последовательный прогон ops на варианте и эталоне со сверкой каждого результата.
+    Возвращает время, проведенное в DataManager (секунды)"""
+    reference = Reference(variant in ARCHIVING)
+    data_manager = Variant(DataManager(make_storage(variant, directory)))
+    elapsed = 0.0
+    try:
+        for step, op in enumerate(ops):
+            if op[0] == 'reload':
+                started = time.perf_counter()
+                data_manager.close()
+                data_manager = Variant(DataManager(make_storage(variant, directory)))
+                elapsed += time.perf_counter() - started
+                continue
+            expected = execute(reference, op)
+            started = time.perf_counter()
+            actual = execute(data_manager, op)
+            elapsed += time.perf_counter() - started
+            if expected != actual:
+                raise Mismatch(variant, step, op, expected, actual)
+        _final_check(variant, data_manager, reference, len(ops))
+        # После перезапуска состояние восстанавливается из снимка, архива и журнала
+        data_manager.close()
+        data_manager = Variant(DataManager(make_storage(variant, directory)))
+        _final_check(variant, data_manager, reference, len(ops))
+    finally:
+        data_manager.close()
+    return elapsed
+
+
+def _observe(data_manager, done, seed, failures):
+    """Чтение, как у окна и вкладки диагностики, пока потоки пишут: итоги карт
+    перестраиваются заново, пока в карты добавляются транзакции. Результаты
+    не сверяются по ходу; то, что осталось в итогах и кэше, проверит _final_check"""
+    rng = random.Random(f"{seed}:observer")
+    try:
+        while not done.is_set():
+            cards = data_manager.get_cards()
+            if not cards:
+                continue
+            number = rng.choice(cards)['number']
+            if rng.random() < 0.1:
+                data_manager.rebuild_rollups()
+            else:
+                data_manager.rollups.invalidate(number)
+                data_manager.rollup_total(card_number=number)
+            data_manager.card_view(number)
+    except Exception as e:
+        failures.append(e)
+
+
+def run_threads(variant, seed, count, threads, directory, mix=None):
+    """Потоки с общим DataManager, у каждого свои карты и своя последовательность.
+    Операции над разными картами независимы, поэтому ответы потока сверяются с его
+    эталоном, а итог - с объединением эталонов. Последовательности воспроизводимы
+    по seed, порядок чередования потоков - нет. Итоги по всем картам (rollup_*
+    без карты) зависят от других потоков и сверяются только в конце.
+    Параллельно наблюдатель (_observe) перестраивает итоги и читает CardView чужих карт.
+    Возвращает время прогона"""
+    data_manager = Variant(DataManager(make_storage(variant, directory)))
+    references = [Reference(variant in ARCHIVING) for _ in range(threads)]
+    sequences = [Generator(f"{seed}:{i}", mix, prefix=f"4276{i + 1:02d}", shared=False).take(count)
+                 for i in range(threads)]
+    failures = []
+
+    def worker(reference, ops):
+        try:
+            for step, op in enumerate(ops):
+                expected, actual = execute(reference, op), execute(data_manager, op)
+                if op[0].startswith('rollup_') and op[1][-2] is None:
+                    continue
+                if expected != actual:
+                    raise Mismatch(variant, step, op, expected, actual)
+        except Exception as e:
+            failures.append(e)
+
+    switch_interval = sys.getswitchinterval()
+    # Частые переключения потоков - больше разных чередований
+    sys.setswitchinterval(1e-5)
+    done = threading.Event()
+    observer = threading.Thread(target=_observe, args=(data_manager, done, seed, failures))
+    started = time.perf_counter()
+    try:
+        workers = [threading.Thread(target=worker, args=pair) for pair in zip(references, sequences)]
+        observer.start()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        done.set()
+        observer.join()
+        elapsed = time.perf_counter() - started
+        if not failures:
+            reference = references[0]
+            for other in references[1:]:
+                reference.merge(other)
+            # Итоги, накопленные во время прогона, и затем состояние после перезапуска
+            _final_check(variant, data_manager, reference, count, ordered=False)
+    finally:
+        sys.setswitchinterval(switch_interval)
+        data_manager.close()
+    if failures:
+        raise failures[0]
+    data_manager = Variant(DataManager(make_storage(variant, directory)))
+    try:
+        _final_check(variant, data_manager, reference, count, ordered=False)
+    finally:
+        data_manager.close()
+    return elapsed
+
+
+def run(variants=VARIANTS, seed=0, count=2000, threads=0, mix=None, ops=None):
+    """Прогон последовательности seed (или готовой ops) на вариантах; threads > 0 -
+    дополнительно многопоточный прогон. Возвращает список строк отчета (словари)"""
+    report = []
+    sequence = ops if ops is not None else Generator(seed, mix).take(count)
+    for variant in variants:
+        modes = [('sequential', None)]
+        if threads and ops is None:
+            modes.append(('threads', threads))
+        for mode, workers in modes:
+            directory = tempfile.mkdtemp(prefix='card_manager_stress_')
+            row = {'variant': variant, 'mode': mode, 'seed': seed,
+                   'ops': len(sequence) if workers is None else count * workers}
+            try:
+                if workers is None:
+                    elapsed = run_sequence(variant, sequence, directory)
+                else:
+                    elapsed = run_threads(variant, seed, count, workers, directory, mix)
+                row.update(ok=True, seconds=elapsed, ops_per_second=row['ops'] / elapsed if elapsed else 0.0)
+            except Mismatch as e:
+                row.update(ok=False, error=str(e), step=e.step, op=e.op)
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            report.append(row)
+    return report
+
+
+def print_report(report):
+    print(f"{'вариант':<10}{'режим':<12}{'seed':>6}{'операций':>10}{'с':>8}{'оп/с':>10}  итог")
+    for row in report:
+        if row['ok']:
+            print(f"{row['variant']:<10}{row['mode']:<12}{row['seed']:>6}{row['ops']:>10}"
+                  f"{row['seconds']:>8.2f}{row['ops_per_second']:>10.0f}  ok")
+        else:
+            print(f"{row['variant']:<10}{row['mode']:<12}{row['seed']:>6}{row['ops']:>10}"
+                  f"{'':>18}  РАСХОЖДЕНИЕ")
+            print(row['error'], file=sys.stderr)
+
+
+def _mix(text):
+    """'add_transaction=10,delete_card=2' -> доли операций (остальные - 0)"""
+    mix = dict.fromkeys(DEFAULT_MIX, 0)
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in mix:
+            raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def _variants(text):
+    variants = text.split(',')
+    for variant in variants:
+        if variant not in VARIANTS:
+            raise argparse.ArgumentTypeError(f"неизвестный вариант: {variant}")
+    return variants
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Сверка хранилищ DataManager с эталоном на случайных последовательностях операций")
+    parser.add_argument('--variants', type=_variants, default=list(VARIANTS),
+                        help=f"варианты через запятую ({', '.join(VARIANTS)})")
+    parser.add_argument('--seed', type=int, default=0, help="первая последовательность")
+    parser.add_argument('--seeds', type=int, default=1, help="сколько последовательностей прогнать")
+    parser.add_argument('--ops', type=int, default=2000, help="операций в последовательности (на поток)")
+    parser.add_argument('--threads', type=int, default=0, help="также многопоточный прогон с N потоками")
+    parser.add_argument('--mix', type=_mix, default=DEFAULT_MIX,
+                        help=f"доли операций, например add_transaction=10,get_transactions=5 "
+                             f"(операции: {', '.join(DEFAULT_MIX)})")
+    parser.add_argument('--replay', help="файл с операциями (из --dump) вместо случайной последовательности")
+    parser.add_argument('--dump', help="при расхождении записать операции до него включительно в файл")
+    parser.add_argument('--json', action='store_true', help="отчет в формате JSON")
+    args = parser.parse_args(argv)
+
+    ops = None
+    if args.replay:
+        with open(args.replay, 'r', encoding='utf-8') as f:
+            ops = json.load(f)
+    report = []
+    for seed in range(args.seed, args.seed + (1 if ops is not None else args.seeds)):
+        rows = run(args.variants, seed, args.ops, args.threads, args.mix, ops)
+        report.extend(rows)
+        failed = [row for row in rows if not row['ok']]
+        if failed:
+            row = failed[0]
+            if row['mode'] == 'sequential' and ops is None:
+                # Первые операции не зависят от длины прогона; step == ops - итоговая сверка
+                count = min(row['step'] + 1, args.ops)
+                print(f"Повтор: python stress.py --variants {row['variant']} --seed {seed} "
+                      f"--ops {count}", file=sys.stderr)
+                if args.dump:
+                    with open(args.dump, 'w', encoding='utf-8') as f:
+                        json.dump(Generator(seed, args.mix).take(count), f, ensure_ascii=False, indent=1)
+            break
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print_report(report)
+    return 0 if all(row['ok'] for row in report) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
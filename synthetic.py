@@ -0,0 +1,83 @@
+import random
+from datetime import date, timedelta
+
+FIRST_NAMES = ['Иван', 'Мария', 'Петр', 'Анна', 'Сергей', 'Елена', 'Алексей', 'Ольга',
+               'Дмитрий', 'Наталья', 'Андрей', 'Татьяна', 'Михаил', 'Ирина', 'Николай']
+LAST_NAMES = ['Петров', 'Сидоров', 'Иванов', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов',
+              'Лебедев', 'Козлов', 'Новиков', 'Морозов', 'Волков', 'Алексеев', 'Павлов']
+
+# Расходы: категория, вес, описания, (минимум, максимум) суммы
+SPENDING = [
+    ('Покупки', 45, ['Продукты в супермаркете', 'Хозяйственные товары', 'Одежда', 'Аптека'], (100, 8000)),
+    ('Транспорт', 20, ['Такси', 'Метро', 'Бензин', 'Каршеринг'], (50, 3000)),
+    ('Развлечения', 15, ['Кино и ресторан', 'Подписка на сервис', 'Концерт', 'Кафе'], (200, 6000)),
+    ('Другое', 10, ['Перевод другу', 'Связь', 'Коммунальные услуги'], (100, 10000)),
+    ('Снятие', 10, ['Снятие с карты'], (500, 20000)),
+]
+
+
+def card_name(rng):
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES)
+    # Женская форма фамилии для женских имен
+    if first.endswith('а') or first.endswith('я'):
+        last += 'а'
+    return f"{first} {last}"
+
+
+def generate_card_history(rng, count, start, days):
+    """История карты: зарплата раз в месяц и расходы, отсортированные по дате"""
+    dates = sorted(rng.randrange(days) for _ in range(count))
+    categories = [item[0] for item in SPENDING]
+    weights = [item[1] for item in SPENDING]
+    history = []
+    last_month = None
+    for offset in dates:
+        day = start + timedelta(days=offset)
+        if (day.year, day.month) != last_month:
+            last_month = (day.year, day.month)
+            history.append({
+                'date': day.isoformat(),
+                'amount': float(rng.randrange(40000, 150000, 500)),
+                'category': 'Пополнение',
+                'description': 'Зачисление зарплаты'
+            })
+            continue
+        category = rng.choices(categories, weights)[0]
+        _, _, descriptions, (low, high) = SPENDING[categories.index(category)]
+        # Небольшие траты встречаются чаще крупных
+        amount = round(low + (high - low) * rng.random() ** 3, 2)
+        history.append({
+            'date': day.isoformat(),
+            'amount': -amount,
+            'category': category,
+            'description': rng.choice(descriptions)
+        })
+    return history
+
+
+def generate_dataset(n_cards, m_transactions, seed=0, start='2023-01-01', days=730):
+    """N карт по M транзакций в формате DataManager: (cards, transactions)"""
+    rng = random.Random(seed)
+    start_date = date.fromisoformat(start)
+    cards = {}
+    transactions = {}
+    while len(cards) < n_cards:
+        number = '4276' + ''.join(rng.choice('0123456789') for _ in range(12))
+        if number in cards:
+            continue
+        cards[number] = {
+            'number': number,
+            'name': card_name(rng),
+            'cvc': f"{rng.randrange(1000):03d}"
+        }
+        transactions[number] = generate_card_history(rng, m_transactions, start_date, days)
+    return cards, transactions
+
+
+def populate(data_manager, n_cards, m_transactions, seed=0):
+    """Замена данных DataManager синтетическим набором"""
+    cards, transactions = generate_dataset(n_cards, m_transactions, seed)
+    data_manager.storage.replace_all(cards, transactions)
+    data_manager.rollups.invalidate()
+    return cards, transactions
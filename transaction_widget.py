@@ -1,20 +1,145 @@
-from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QTableWidget,
-                             QTableWidgetItem, QPushButton, QDialog,
-                             QFormLayout, QLineEdit, QDateEdit, QComboBox, QHBoxLayout, QDialogButtonBox)
-from PyQt5.QtCore import Qt, QDate
+from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QTableView,
+                             QPushButton, QDialog,
+                             QFormLayout, QLineEdit, QDateEdit, QComboBox, QHBoxLayout, QDialogButtonBox, QLabel)
+from PyQt5.QtCore import Qt, QDate, QAbstractTableModel, QModelIndex, QTimer
+import time
+import instrumentation
+from events import CARD_DELETED, TRANSACTION_ADDED, DATA_RELOADED
+
+class TransactionTableModel(QAbstractTableModel):
+    """Модель таблицы транзакций: строки подгружаются страницами из DataManager,
+    сортировка и фильтрация выполняются на стороне данных"""
+    
+    HEADERS = ["Дата", "Сумма", "Категория", "Описание"]
+    FIELDS = ['date', 'amount', 'category', 'description']
+    PAGE_SIZE = 500
+
+    def __init__(self, data_manager, data_service, parent=None):
+        super().__init__(parent)
+        self.data_manager = data_manager
+        self.data_service = data_service
+        self.card_number = None
+        self.filters = {}
+        self.sort_by = None
+        self.order = 'asc'
+        self.rows = []
+        self.total = 0
+        # Номер запроса: ответы рабочего потока на устаревшие запросы отбрасываются
+        self.generation = 0
+        self.fetching = False
+        # Начало текущего запроса: время до первой страницы пишется в instrumentation
+        self.requested = None
+
+    def set_query(self, card_number, filters=None):
+        """Новый запрос: сброс модели и подсчет общего числа строк в рабочем потоке"""
+        self.beginResetModel()
+        self.card_number = card_number
+        self.filters = dict(filters or {})
+        self.rows = []
+        self.total = 0
+        self.generation += 1
+        self.fetching = False
+        self.requested = time.perf_counter()
+        self.endResetModel()
+        if card_number is not None:
+            generation = self.generation
+            self.data_service.call(self.data_manager.count_transactions, card_number, self.filters,
+                                   callback=lambda total: self._on_count(generation, total))
+
+    def _on_count(self, generation, total):
+        if generation != self.generation:
+            return
+        self.total = total
+        if self.canFetchMore():
+            self.fetchMore()
+        else:
+            self._loaded()
+
+    def refresh(self):
+        self.set_query(self.card_number, self.filters)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.fetching and len(self.rows) < self.total
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Запрос следующей страницы строк"""
+        if parent.isValid() or self.fetching:
+            return
+        self.fetching = True
+        generation = self.generation
+        query = dict(self.filters, offset=len(self.rows), limit=self.PAGE_SIZE,
+                     order=self.order, sort_by=self.sort_by)
+        self.data_service.call(self.data_manager.get_transactions, self.card_number, query,
+                               callback=lambda page: self._on_page(generation, page))
+
+    def _on_page(self, generation, page):
+        if generation != self.generation:
+            return
+        self.fetching = False
+        if not page:
+            self.total = len(self.rows)
+            self._loaded()
+            return
+        with instrumentation.span('TransactionTableModel.insert_rows', rows=len(page)):
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+        instrumentation.count('rows_rendered', len(page))
+        self._loaded()
+
+    def _loaded(self):
+        """Первая страница запроса показана"""
+        if self.requested is not None:
+            instrumentation.record('TransactionWidget.load_transactions', time.perf_counter() - self.requested,
+                                   card=self.card_number, total=self.total)
+            self.requested = None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            # Форматирование только для отображаемых ячеек
+            value = self.rows[index.row()][self.FIELDS[index.column()]]
+            return str(value)
+        if role == Qt.TextAlignmentRole and self.FIELDS[index.column()] == 'amount':
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return super().headerData(section, orientation, role)
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Сортировка передается в запрос к данным"""
+        self.sort_by = self.FIELDS[column]
+        self.order = 'desc' if order == Qt.DescendingOrder else 'asc'
+        self.refresh()
 
 class TransactionWidget(QWidget):
-    def __init__(self, data_manager):
+    # Задержка поиска после ввода в строке поиска, мс
+    SEARCH_DELAY = 300
+
+    def __init__(self, data_manager, data_service):
         super().__init__()
         self.data_manager = data_manager
+        self.data_service = data_service
         self.current_card = None
         
         layout = QVBoxLayout(self)
         
         # Создание таблицы транзакций
-        self.table = QTableWidget()
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["Дата", "Сумма", "Категория", "Описание"])
+        self.model = TransactionTableModel(data_manager, data_service, self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSortingEnabled(True)
+        self.table.sortByColumn(0, Qt.AscendingOrder)
         
         # Кнопки управления
         button_layout = QHBoxLayout()
@@ -25,35 +150,95 @@ class TransactionWidget(QWidget):
         filter_btn = QPushButton("Фильтр")
         filter_btn.clicked.connect(self.show_filter_dialog)
         
+        # Поиск по описанию и имени держателя карты (фильтр 'text', см. search.TextIndex)
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText("Поиск по описанию и имени")
+        self.search_edit.setClearButtonEnabled(True)
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(self.SEARCH_DELAY)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.search_edit.textChanged.connect(self.search_timer.start)
+        
         button_layout.addWidget(add_btn)
         button_layout.addWidget(filter_btn)
+        button_layout.addWidget(self.search_edit)
+        
+        # Итоги по текущему фильтру (по агрегатам DataManager, без чтения истории)
+        self.totals_label = QLabel()
         
         layout.addLayout(button_layout)
         layout.addWidget(self.table)
+        layout.addWidget(self.totals_label)
 
     def load_transactions(self, card_number, filters=None):
         """Загрузка транзакций"""
         self.current_card = card_number
-        transactions = self.data_manager.get_transactions(card_number, filters)
-        
-        self.table.setRowCount(len(transactions))
-        for i, trans in enumerate(transactions):
-            self.table.setItem(i, 0, QTableWidgetItem(trans['date']))
-            self.table.setItem(i, 1, QTableWidgetItem(str(trans['amount'])))
-            self.table.setItem(i, 2, QTableWidgetItem(trans['category']))
-            self.table.setItem(i, 3, QTableWidgetItem(trans['description']))
+        self.model.set_query(card_number, filters)
+        # Строка поиска показывает текст текущего фильтра
+        self.search_timer.stop()
+        self.search_edit.blockSignals(True)
+        self.search_edit.setText(self.model.filters.get('text') or '')
+        self.search_edit.blockSignals(False)
+        self.update_totals()
+
+    def apply_search(self):
+        """Перезапрос таблицы с текстом из строки поиска"""
+        filters = dict(self.model.filters)
+        text = self.search_edit.text().strip()
+        if text == (filters.get('text') or ''):
+            return
+        filters['text'] = text or None
+        self.load_transactions(self.current_card, filters)
+
+    def update_totals(self):
+        card_number, filters = self.current_card, self.model.filters
+        if card_number is None:
+            self.totals_label.clear()
+            return
+        if filters.get('text'):
+            # Агрегаты не знают о тексте - показываем число найденных операций
+            self.data_service.call(self.data_manager.count_transactions, card_number, filters,
+                                   callback=lambda total: self.show_found(card_number, total))
+            return
+        self.data_service.call(self.data_manager.rollup_total, filters.get('date_from'),
+                               filters.get('date_to'), card_number, filters.get('category') or None,
+                               callback=lambda totals: self.show_totals(card_number, totals))
+
+    def show_found(self, card_number, total):
+        if card_number == self.current_card:
+            self.totals_label.setText(f"Найдено операций: {total}")
+
+    def show_totals(self, card_number, totals):
+        if card_number == self.current_card:
+            self.totals_label.setText(f"Поступления: {totals['income']} ₽, списания: {totals['expense']} ₽, "
+                                      f"итого: {totals['total']} ₽")
 
     def add_transaction(self):
         """Добавление новой транзакции"""
         dialog = TransactionDialog(self)
         if dialog.exec_() == QDialog.Accepted:
             transaction = dialog.get_transaction_data()
-            self.data_manager.add_transaction(self.current_card, transaction)
-            self.load_transactions(self.current_card)
+            # Таблица обновится по событию TRANSACTION_ADDED
+            self.data_service.write(self.data_manager.add_transaction, self.current_card, transaction)
+
+    def on_data_changed(self, events):
+        """Перезапрос таблицы, если изменились операции текущей карты"""
+        if self.current_card is None:
+            return
+        for event in events:
+            if event.kind == CARD_DELETED and event.card_number == self.current_card:
+                self.load_transactions(None)
+                return
+            if event.kind == DATA_RELOADED or \
+                    (event.kind == TRANSACTION_ADDED and event.card_number == self.current_card):
+                self.model.refresh()
+                self.update_totals()
+                return
 
     def show_filter_dialog(self):
         """Показ диалога фильтрации транзакций"""
-        dialog = FilterDialog(self)
+        dialog = FilterDialog(self, self.model.filters)
         if dialog.exec_() == QDialog.Accepted:
             filters = dialog.get_filter_data()
             self.load_transactions(self.current_card, filters)
@@ -93,7 +278,7 @@ class TransactionDialog(QDialog):
         } 
 
 class FilterDialog(QDialog):
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, filters=None):
         super().__init__(parent)
         self.setWindowTitle("Фильтр транзакций")
         
@@ -108,9 +293,13 @@ class FilterDialog(QDialog):
         self.category_combo = QComboBox()
         self.category_combo.addItems(["", "Покупки", "Развлечения", "Транспорт", "Другое"])
         
+        # Слова из описания или имени держателя, можно начало слова
+        self.text_edit = QLineEdit((filters or {}).get('text') or '')
+        
         layout.addRow("Дата с:", self.date_from)
         layout.addRow("Дата по:", self.date_to)
         layout.addRow("Категория:", self.category_combo)
+        layout.addRow("Текст:", self.text_edit)
         
         buttons = QDialogButtonBox(
             QDialogButtonBox.Ok | QDialogButtonBox.Cancel,
@@ -125,5 +314,6 @@ class FilterDialog(QDialog):
         return {
             'date_from': self.date_from.date().toString(Qt.ISODate) if self.date_from.date() != self.date_from.minimumDate() else None,
             'date_to': self.date_to.date().toString(Qt.ISODate),
-            'category': self.category_combo.currentText() if self.category_combo.currentText() else None
+            'category': self.category_combo.currentText() if self.category_combo.currentText() else None,
+            'text': self.text_edit.text().strip() or None
         } 
\ No newline at end of file
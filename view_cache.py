@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from events import DATA_RELOADED
+
+
+def format_number(number):
+    """Номер карты группами по 4 цифры: 4444 4444 4444 4444"""
+    return " ".join(number[i:i + 4] for i in range(0, len(number), 4))
+
+
+class CardView:
+    """Производные данные карты для отображения"""
+
+    __slots__ = ('card', 'formatted_number', 'label', 'balance', 'transaction_count')
+
+    def __init__(self, card, balance):
+        self.card = card
+        self.formatted_number = format_number(card['number'])
+        self.label = f"{card['name']}\n{card['number']}\nБаланс: {balance} ₽"
+        self.balance = balance
+        # Считается при первом запросе (CardViewCache.transaction_count)
+        self.transaction_count = None
+
+
+class CardViewCache:
+    """Ограниченный LRU-кэш CardView по номеру карты.
+    Запись карты сбрасывается по событиям DataManager об ее изменении,
+    все записи - при перезагрузке данных"""
+
+    def __init__(self, data_manager, maxsize=2048):
+        self.data_manager = data_manager
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Номер сброса: значение, посчитанное до сброса, в кэш не попадает
+        self._version = 0
+        self._lock = threading.Lock()
+        data_manager.subscribe(self.on_events)
+
+    def get(self, card_number, card=None):
+        """CardView карты или None, если карты нет; card - уже прочитанные данные карты"""
+        with self._lock:
+            view = self.entries.get(card_number)
+            if view is not None:
+                self.entries.move_to_end(card_number)
+                self.hits += 1
+                return view
+            self.misses += 1
+            version = self._version
+        card = card or self.data_manager.get_card(card_number)
+        if card is None:
+            return None
+        view = CardView(card, self.data_manager.get_card_balance(card_number))
+        with self._lock:
+            if version == self._version:
+                self.entries[card_number] = view
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return view
+
+    def transaction_count(self, card_number):
+        view = self.get(card_number)
+        if view is None:
+            return 0
+        if view.transaction_count is None:
+            view.transaction_count = self.data_manager.count_transactions(card_number)
+        return view.transaction_count
+
+    def invalidate(self, card_number=None):
+        with self._lock:
+            self._version += 1
+            if card_number is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(card_number, None)
+
+    def on_events(self, events):
+        if any(event.kind == DATA_RELOADED for event in events):
+            self.invalidate()
+            return
+        for card_number in dict.fromkeys(event.card_number for event in events):
+            self.invalidate(card_number)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,162 @@
+import threading
+from collections import deque
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal
+
+
+class _Task:
+    def __init__(self, fn, args, callback, errback, write):
+        self.fn = fn
+        self.args = args
+        self.callback = callback
+        self.errback = errback
+        self.write = write
+
+
+class DataWorker(QThread):
+    """Рабочий поток: выполняет операции с данными строго по очереди.
+    Подряд идущие изменения выполняются одной группой (DataManager.batch)
+    с одной записью на диск"""
+
+    finished_task = pyqtSignal(object, object)   # задача, результат
+    failed_task = pyqtSignal(object, object)     # задача, исключение
+    progress = pyqtSignal(int, int)
+
+    def __init__(self, data_manager, parent=None):
+        super().__init__(parent)
+        self.data_manager = data_manager
+        self.tasks = deque()
+        self.condition = threading.Condition()
+        self.stopping = False
+
+    def put(self, task):
+        with self.condition:
+            self.tasks.append(task)
+            self.condition.notify()
+
+    def stop(self):
+        """Завершение после выполнения уже поставленных задач"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.wait()
+
+    def _next(self):
+        """Следующая задача или группа подряд идущих изменений"""
+        with self.condition:
+            while not self.tasks and not self.stopping:
+                self.condition.wait()
+            if not self.tasks:
+                return None
+            group = [self.tasks.popleft()]
+            if group[0].write:
+                while self.tasks and self.tasks[0].write:
+                    group.append(self.tasks.popleft())
+            return group
+
+    def run(self):
+        while True:
+            group = self._next()
+            if group is None:
+                break
+            if group[0].write:
+                results = []
+                try:
+                    with self.data_manager.batch():
+                        for task in group:
+                            results.append(self._execute_write(task))
+                except Exception as e:
+                    # Ошибка фиксации группы - сообщаем всем ее задачам
+                    for task in group:
+                        self.failed_task.emit(task, e)
+                    continue
+                for task, (ok, value) in zip(group, results):
+                    (self.finished_task if ok else self.failed_task).emit(task, value)
+            else:
+                ok, value = self._execute(group[0])
+                (self.finished_task if ok else self.failed_task).emit(group[0], value)
+
+    def _execute(self, task):
+        try:
+            return True, task.fn(*task.args)
+        except Exception as e:
+            return False, e
+
+    def _execute_write(self, task):
+        """Изменение во вложенной группе: при ошибке откатывается только эта задача"""
+        try:
+            with self.data_manager.batch():
+                return True, task.fn(*task.args)
+        except Exception as e:
+            return False, e
+
+
+class DataService(QObject):
+    """Асинхронный доступ к DataManager из GUI.
+    Запросы и изменения ставятся в одну очередь, поэтому чтение всегда видит
+    изменения, поставленные перед ним; обратные вызовы выполняются в потоке GUI"""
+
+    progress = pyqtSignal(int, int)
+    error = pyqtSignal(str)
+
+    def __init__(self, data_manager, parent=None):
+        super().__init__(parent)
+        self.data_manager = data_manager
+        self.worker = DataWorker(data_manager)
+        self.worker.finished_task.connect(self._on_finished)
+        self.worker.failed_task.connect(self._on_failed)
+        self.worker.progress.connect(self.progress)
+        self.worker.start()
+
+    def load(self, callback=None):
+        """Загрузка данных в рабочем потоке с отчетом о ходе загрузки"""
+        self.call(self.data_manager.load_data, self.worker.progress.emit, callback=callback)
+
+    def call(self, fn, *args, callback=None, errback=None):
+        """Запрос к данным (без изменений)"""
+        self.worker.put(_Task(fn, args, callback, errback, write=False))
+
+    def write(self, fn, *args, callback=None, errback=None):
+        """Изменение данных; соседние изменения сохраняются на диск вместе"""
+        self.worker.put(_Task(fn, args, callback, errback, write=True))
+
+    def stop(self):
+        self.worker.stop()
+
+    def _on_finished(self, task, result):
+        if task.callback is not None:
+            task.callback(result)
+
+    def _on_failed(self, task, exc):
+        if task.errback is not None:
+            task.errback(exc)
+        else:
+            self.error.emit(str(exc))
+
+
+class EventBridge(QObject):
+    """Доставка событий DataManager в поток GUI.
+    События за короткий интервал собираются в один список (подавление дребезга)"""
+
+    changed = pyqtSignal(object)    # список ChangeEvent без повторов
+    _received = pyqtSignal(object)
+
+    def __init__(self, data_manager, interval=50, parent=None):
+        super().__init__(parent)
+        self.pending = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self._flush)
+        # Сигнал из рабочего потока доставляется в поток GUI через очередь событий Qt
+        self._received.connect(self._collect)
+        data_manager.subscribe(self._received.emit)
+
+    def _collect(self, events):
+        self.pending.extend(events)
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def _flush(self):
+        events, self.pending = list(dict.fromkeys(self.pending)), []
+        if events:
+            self.changed.emit(events)